@@ -1 +1,3 @@
 from .camera import Camera
+from .frame_grabber import FrameGrabber
+from .frame_view import FrameView
@@ -1,7 +1,13 @@
+import cv2
+import threading
+from typing import Optional
 from picamera2 import Picamera2
 from picamera2.encoders import H264Encoder
 from settings.config import *
 from .picamera2_fix.CaptureAndStreamOutput import CaptureAndStreamOutput
+from .outputs import FanOutOutput
+from .frame_view import FrameView
+from .ffmpeg_pool import FfmpegPool, writer_options
 from .camera_mode_controller import CameraModeController
 
 
@@ -12,7 +18,11 @@ class Camera:
         Manages the Raspberry Pi camera for video capture and streaming.\n
         Handles both local video recording and remote streaming capabilities,
         with support for day/night mode switching through the IR filter control.
-        Uses separate encoders for recording and streaming.
+        One H264 encoder is shared by recording and streaming, its output is fanned out
+        to sinks that are added and removed while the encoder runs.
+        Detectors can get frames from a small lores stream scaled by the ISP.
+        With pre-roll enabled the encoder runs all the time into a circular
+        buffer, so recordings start a few seconds before the detection.
         """
         self.camera_mode_controller = None
 
@@ -26,8 +36,17 @@ class Camera:
         self.configure_camera()
         self._picam.start()
 
-        self._capture_encoder = H264Encoder(bitrate=settings.bitrate)
-        self._stream_encoder  = H264Encoder(bitrate=settings.bitrate)
+        # Headers are repeated on every keyframe, so sinks can join the running stream
+        self._encoder = H264Encoder(bitrate=settings.bitrate, repeat=True, iperiod=settings.keyframe_interval)
+        self._output  = FanOutOutput(settings.preroll_seconds if settings.enable_preroll else 0)
+        self._encoder.output = self._output
+        self._lock = threading.Lock() # stream is started from the server connection thread
+
+        if settings.enable_preroll:
+            self._picam.start_encoder(self._encoder)
+
+        # Recordings don't wait for ffmpeg to start
+        self._ffmpeg_pool = FfmpegPool(framerate=self._recording_framerate)
 
 
     def configure_camera(self) -> None:
@@ -38,10 +57,17 @@ class Camera:
 
         frame_duration = int(1000000 / settings.fps)
 
+        # Lores stream is scaled by the ISP, so detectors don't have to resize full frames
+        lores = None
+        if settings.enable_lores_stream:
+            lores = {"size":   [settings.lores_width, settings.lores_height],
+                     "format": settings.lores_format}
+
         config = self._picam.create_video_configuration(
                     main={
                         "size":   [settings.width, settings.height],
                         "format": settings.format},
+                    lores=lores,
                     controls={
                         "FrameDurationLimits": (frame_duration, frame_duration)}
                     )
@@ -50,13 +76,29 @@ class Camera:
 
 
     @property
-    def capturing(self) -> None:
-        return self._capture_encoder.running
+    def capturing(self) -> bool:
+        return self._output.has_sink("capture")
 
 
     @property
-    def streaming(self) -> None:
-        return self._stream_encoder.running
+    def streaming(self) -> bool:
+        return any(name.startswith("stream") for name in self._output.sink_names)
+
+
+    @property
+    def _recording_framerate(self):
+        """Frames flushed from the pre-roll buffer need timestamps by frame rate, not wallclock."""
+        return settings.fps if settings.enable_preroll else None
+
+
+    @property
+    def recording_stats(self) -> dict:
+        """ffmpeg startup stats and writer queue stats of the current recording."""
+        stats = self._ffmpeg_pool.stats
+        output = self._output.get_sink("capture")
+        if output is not None:
+            stats["writer"] = output.stats
+        return stats
 
 
     def cleanup(self) -> None:
@@ -65,6 +107,9 @@ class Camera:
             self.stop_capture()
         if self.streaming:
             self.stop_stream()
+        if self._encoder.running:
+            self._picam.stop_encoder(self._encoder)
+        self._ffmpeg_pool.cleanup()
         self._picam.stop()
         if self.camera_mode_controller:
             self.camera_mode_controller.cleanup()
@@ -74,21 +119,97 @@ class Camera:
         return self._picam.capture_array()
 
 
-    def capture_video(self, video_name: str) -> None:
+    def get_detection_frame(self):
+        """
+        Get a BGR frame for detectors.\n
+        Returns the lores stream frame if it is enabled, full resolution frame otherwise.
+        Recording and streaming always use the full resolution main stream.
+        """
+        if not settings.enable_lores_stream:
+            return self.get_frame()
+
+        frame = self._picam.capture_array("lores")
+        if settings.lores_format == "YUV420":
+            # Pi 4 and older can output lores only in YUV420, conversion of a small frame is cheap
+            return cv2.cvtColor(frame, cv2.COLOR_YUV420p2BGR)
+        return frame[:, :, :3]
+
+
+    def get_detection_view(self) -> FrameView:
+        """
+        Get the detection frame as a view of the camera buffer, without copying it.\n
+        The camera request is held until the view is released, so it must be released
+        as soon as detectors are done with the frame.
+        Falls back to a copy if zero-copy frames are disabled, if the preview draws on frames
+        or if the lores frame has to be converted from YUV420 anyway.
+        """
+        lores_yuv = settings.enable_lores_stream and settings.lores_format == "YUV420"
+        if not settings.zero_copy_frames or settings.show_preview or lores_yuv:
+            return FrameView(self.get_detection_frame())
+
+        request = self._picam.capture_request()
+        try:
+            return FrameView.from_request(request, "lores" if settings.enable_lores_stream else "main")
+        except Exception:
+            request.release()
+            raise
+
+
+    def _add_sink(self, name: str, sink, preroll: bool=False) -> None:
+        """Start the sink and attach it to the encoder, starting the encoder if needed."""
+        with self._lock:
+            sink.start()
+            self._output.add_sink(name, sink, preroll)
+            if not self._encoder.running:
+                self._picam.start_encoder(self._encoder)
+
+
+    def _remove_sink(self, name: str):
+        """Detach and stop the sink, the encoder is stopped if nothing needs it anymore."""
+        with self._lock:
+            sink = self._output.remove_sink(name)
+            if not self._output.sink_names and not settings.enable_preroll and self._encoder.running:
+                self._picam.stop_encoder(self._encoder)
+        if sink is not None:
+            sink.stop()
+        return sink
+
+
+    def capture_video(self, video_name: str, manifest: Optional[str]=None) -> None:
         """
         Start capturing video to a local file.\n
-        Uses the CaptureAndStreamOutput which is a slightly adjusted FfmpegOutput
+        Uses the CaptureAndStreamOutput which is a slightly adjusted FfmpegOutput.
+        With pre-roll the buffered seconds are written first, audio is delayed to match them.
+        Args:
+            video_name: Path of the video file, or the segment pattern in segmented mode
+            manifest: Path of the segment list, given only in segmented mode
         """
-        self._capture_encoder.output = CaptureAndStreamOutput(video_name,
-                                                              audio=settings.enable_audio)
-        self._picam.start_encoder(self._capture_encoder)
-        log.info("Capture started")
+        preroll = self._output.buffered_seconds() if settings.enable_preroll else 0.0
+        if manifest:
+            # ffmpeg splits at the first keyframe after segment_time and lists closed segments in the manifest.
+            # The pre-spawned process can't be used, segment names are known only now
+            target = (f"-f segment -segment_time {settings.segment_duration} -reset_timestamps 1 "
+                      f"-segment_list {manifest} -segment_list_type csv {video_name}")
+            output = CaptureAndStreamOutput(target,
+                                            audio=settings.enable_audio,
+                                            audio_sync=settings.audio_sync + preroll,
+                                            framerate=self._recording_framerate,
+                                            **writer_options())
+        else:
+            output = self._ffmpeg_pool.acquire(video_name,
+                                               audio=settings.enable_audio,
+                                               audio_sync=settings.audio_sync + preroll,
+                                               framerate=self._recording_framerate)
+        self._add_sink("capture", output, preroll=settings.enable_preroll)
+        log.info(f"Capture started with {preroll:.1f} s of pre-roll")
 
 
     def stop_capture(self) -> None:
         if not self.capturing:
             return
-        self._picam.stop_encoder(self._capture_encoder)
+        output = self._remove_sink("capture")
+        if output is not None:
+            self._ffmpeg_pool.release(output)
         log.info("Capture stopped")
 
 
@@ -96,20 +217,25 @@ class Camera:
         """
         Start streaming video to a remote server.\n
         Uses RTP (Real-time Transport Protocol) to stream H264 encoded video
-        to the server.
+        to the server. The stream is attached to the running encoder, if it is running,
+        so it doesn't need a second encoder even during recording.
         Args:
             port: Port number to stream to
             path: Stream path
         """
-        self._stream_encoder.output = CaptureAndStreamOutput(f"-preset fast -tune zerolatency -f rtp_mpegts rtp://{settings.server_host}:{port}/{path}",
-                                                             audio=settings.enable_audio)
-        self._picam.start_encoder(self._stream_encoder)
+        output = CaptureAndStreamOutput(f"-preset fast -tune zerolatency -f rtp_mpegts rtp://{settings.server_host}:{port}/{path}",
+                                        audio=settings.enable_audio,
+                                        audio_sync=settings.audio_sync,
+                                        **writer_options())
+        self._add_sink(f"stream:{port}/{path}", output)
         log.info(f"Stream started: rtp://{settings.server_host}:{port}/{path}")
 
 
     def stop_stream(self) -> None:
-        """Stop the current video stream if active, do nothing else"""
+        """Stop all active video streams, do nothing if there are none"""
         if not self.streaming:
             return
-        self._picam.stop_encoder(self._stream_encoder)
+        for name in self._output.sink_names:
+            if name.startswith("stream"):
+                self._remove_sink(name)
         log.info("Stream stopped")
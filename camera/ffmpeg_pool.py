@@ -0,0 +1,172 @@
+import itertools
+import os
+import threading
+from collections import deque
+from typing import Optional
+from settings.config import *
+from .picamera2_fix.CaptureAndStreamOutput import CaptureAndStreamOutput
+
+
+def writer_options() -> dict:
+    """Options of the ffmpeg writer queue from the settings."""
+    return {"max_queue_bytes": settings.writer_queue_bytes,
+            "full_policy":     settings.writer_full_policy}
+
+
+class FfmpegPool:
+    """
+    Keeps an idle ffmpeg process ready for the next recording.\n
+    Spawning ffmpeg on the Pi takes a noticeable time, so the next process is spawned
+    in the background as soon as the previous one is taken. It writes to a hidden
+    temporary file in the video folder, which is renamed to the video name when ffmpeg exits.
+    ffmpeg creates its output only after the first frames arrive, so the file can't be renamed
+    earlier. Instead the video name is written next to it to a .target file when the recording
+    is acquired. On start, recordings interrupted by a crash are renamed to their video name,
+    which must happen before the upload journal is recovered, and other temporary files are removed.
+    Only video-only recordings are pre-spawned: the audio input starts recording
+    as soon as ffmpeg starts, so with audio the process is spawned on demand.
+    """
+    def __init__(self, framerate: Optional[int]=None) -> None:
+        self.framerate = framerate
+        self.enabled = settings.enable_ffmpeg_prewarm and not settings.enable_audio
+        os.makedirs(settings.video_folder, exist_ok=True)
+        self._recover_stale()
+
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._idle = None
+        self._closed = False
+        self._latencies = deque(maxlen=20)
+        self._stats = {"warm_starts": 0, "cold_starts": 0}
+
+        if self.enabled:
+            self._refill()
+
+
+    def cleanup(self) -> None:
+        """Kill the idle ffmpeg process and remove its temporary file."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, None
+        if idle is not None:
+            self._discard(idle)
+
+
+    @staticmethod
+    def _recover_stale() -> None:
+        """Rename recordings of a previous run that was interrupted and remove other temporary files."""
+        folder = settings.video_folder
+        for name in sorted(os.listdir(folder)):
+            if not (name.startswith(".prewarm-") and name.endswith(".target")):
+                continue
+            target, temporary = os.path.join(folder, name), os.path.join(folder, name[:-len(".target")])
+            try:
+                with open(target) as f:
+                    filename = f.read().strip()
+                if filename and os.path.exists(temporary):
+                    os.replace(temporary, filename)
+                    log.info(f"Recovered interrupted recording {filename}")
+            except OSError:
+                log.warning(f"Can't recover interrupted recording {temporary}", exc_info=True)
+
+        for name in os.listdir(folder):
+            if name.startswith(".prewarm-"):
+                try:
+                    os.remove(os.path.join(folder, name))
+                    log.info(f"Removed stale ffmpeg file {name}")
+                except OSError:
+                    log.warning(f"Can't remove stale ffmpeg file {name}", exc_info=True)
+
+
+    def _spawn(self) -> CaptureAndStreamOutput:
+        name = os.path.join(settings.video_folder, f".prewarm-{os.getpid()}-{next(self._counter)}.{settings.video_file_ext}")
+        output = CaptureAndStreamOutput(name, audio=False, framerate=self.framerate, **writer_options())
+        output.spawn()
+        return output
+
+
+    def _refill(self) -> None:
+        """Spawn the next idle process without blocking the caller."""
+        def spawn() -> None:
+            try:
+                output = self._spawn()
+            except Exception:
+                log.error("Can't spawn ffmpeg in advance", exc_info=True)
+                return
+            with self._lock:
+                if self._closed or self._idle is not None:
+                    stale = output
+                else:
+                    self._idle, stale = output, None
+            if stale is not None:
+                self._discard(stale)
+
+        threading.Thread(target=spawn, daemon=True, name="ffmpeg-prewarm").start()
+
+
+    @staticmethod
+    def _discard(output: CaptureAndStreamOutput) -> None:
+        if output.ffmpeg is not None:
+            output.ffmpeg.kill()
+            output.ffmpeg.wait()
+            output.ffmpeg = None
+        if os.path.exists(output.output_filename):
+            os.remove(output.output_filename)
+
+
+    def acquire(self, filename: str, audio: bool=False, audio_sync: float=-0.3,
+                framerate: Optional[int]=None) -> CaptureAndStreamOutput:
+        """
+        Get an output recording to the file.\n
+        Returns the pre-spawned output when it fits the request, otherwise a new one
+        which spawns ffmpeg on start.
+        Args:
+            filename: Path of the video file
+            audio: Whether to record audio
+            audio_sync: Audio offset in seconds
+            framerate: Frame rate for frame timestamps, None for wallclock timestamps
+        """
+        output = None
+        if self.enabled and not audio and framerate == self.framerate:
+            with self._lock:
+                output, self._idle = self._idle, None
+            if output is not None and not output.alive:
+                log.warning("Pre-spawned ffmpeg exited, starting a new one")
+                self._discard(output)
+                output = None
+            self._refill()
+
+        if output is None:
+            self._stats["cold_starts"] += 1
+            return CaptureAndStreamOutput(filename, audio=audio, audio_sync=audio_sync, framerate=framerate,
+                                          **writer_options())
+
+        self._stats["warm_starts"] += 1
+        output.final_filename = filename
+        try:
+            with open(output.output_filename + ".target", "w") as f:
+                f.write(filename)
+        except OSError:
+            log.warning(f"Can't journal the temporary file of {filename}, it is lost on a crash", exc_info=True)
+        return output
+
+
+    def release(self, output: CaptureAndStreamOutput) -> None:
+        """Record the startup latency of the stopped output and remove its .target file."""
+        if output.final_filename:
+            try:
+                os.remove(output.output_filename + ".target")
+            except FileNotFoundError:
+                pass
+        if output.first_frame_latency is not None:
+            self._latencies.append(output.first_frame_latency)
+
+
+    @property
+    def stats(self) -> dict:
+        """Warm and cold starts and the latency from recording start to the first frame in ffmpeg."""
+        stats = dict(self._stats)
+        if self._latencies:
+            stats["last_first_frame_latency"] = round(self._latencies[-1], 3)
+            stats["mean_first_frame_latency"] = round(sum(self._latencies) / len(self._latencies), 3)
+        return stats
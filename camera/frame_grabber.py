@@ -0,0 +1,134 @@
+import threading
+import time
+from typing import Callable, Optional, Tuple
+from settings.config import *
+
+
+class FrameGrabber:
+    """
+    Captures frames on a background thread one frame ahead of the consumer.\n
+    The next frame is captured as soon as the consumer takes the current one, so capture
+    overlaps with detection. Nothing more is captured until that frame is taken, so a consumer
+    that waits long between frames (e.g. the idle back-off) doesn't cost a conversion of every
+    camera frame. A frame older than max_age when it is asked for is dropped and a new one captured.
+    Frames with a release() method (camera buffer views) are released when dropped,
+    taken frames are released by the consumer.
+    """
+    def __init__(self, capture: Callable, max_age: Optional[float]=None) -> None:
+        """
+        Initialize the frame grabber, capture thread is started by start().\n
+        Args:
+            capture: Blocking function that returns the next camera frame
+            max_age: Seconds a captured frame can wait for the consumer, None for no limit
+        """
+        self._capture = capture
+        self.max_age = max_age
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self._frame = None
+        self._timestamp = None
+        self._sequence = 0
+        self._consumed_sequence = 0
+
+        self._captured = 0
+        self._dropped = 0
+        self._consumed = 0
+        self._frame_age_sum = 0.0
+        self._last_frame_age = 0.0
+        self._started_at = None
+
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="frame-grabber")
+        self._thread.start()
+        log.info("Frame grabber started")
+
+
+    def stop(self) -> None:
+        """Stop the capture thread and wake up a waiting consumer."""
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        log.info("Frame grabber stopped")
+
+
+    @staticmethod
+    def _release(frame) -> None:
+        release = getattr(frame, "release", None)
+        if release is not None:
+            release()
+
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                # Capture only when the last frame was taken or dropped
+                self._condition.wait_for(lambda: self._sequence == self._consumed_sequence or not self._running)
+                if not self._running:
+                    break
+            try:
+                frame = self._capture()
+            except Exception:
+                log.error("Can\'t capture frame", exc_info=True)
+                time.sleep(0.1)
+                continue
+
+            with self._condition:
+                self._frame = frame
+                self._timestamp = time.monotonic()
+                self._sequence += 1
+                self._captured += 1
+                self._condition.notify_all()
+
+
+    def get_latest(self, timeout: Optional[float]=None) -> Tuple[object, float]:
+        """
+        Wait for a frame newer than the one returned last time and return it.\n
+        Returns (frame, timestamp), timestamp is time.monotonic() of the capture.
+        Returns (None, None) on timeout or if the grabber is stopped
+        """
+        with self._condition:
+            if (self.max_age is not None and self._running and self._sequence > self._consumed_sequence
+                    and time.monotonic() - self._timestamp > self.max_age):
+                # Captured long ago while the consumer was busy or sleeping, take a new one
+                self._dropped += 1
+                self._release(self._frame)
+                self._frame = None
+                self._consumed_sequence = self._sequence
+                self._condition.notify_all()
+            if not self._condition.wait_for(lambda: self._sequence > self._consumed_sequence
+                                                    or not self._running, timeout):
+                return None, None
+            if self._sequence == self._consumed_sequence:
+                return None, None
+
+            self._consumed_sequence = self._sequence
+            self._consumed += 1
+            self._last_frame_age = time.monotonic() - self._timestamp
+            self._frame_age_sum += self._last_frame_age
+            self._condition.notify_all() # capture the next frame
+            return self._frame, self._timestamp
+
+
+    @property
+    def stats(self) -> dict:
+        """Throughput of capture and consumption and age of frames when they were taken."""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "captured": self._captured,
+            "consumed": self._consumed,
+            "dropped": self._dropped,
+            "capture_fps": round(self._captured / elapsed, 2) if elapsed else 0.0,
+            "consume_fps": round(self._consumed / elapsed, 2) if elapsed else 0.0,
+            "last_frame_age_ms": round(self._last_frame_age * 1000, 1),
+            "mean_frame_age_ms": round(self._frame_age_sum / self._consumed * 1000, 1) if self._consumed else 0.0,
+        }
@@ -0,0 +1,57 @@
+import threading
+import numpy as np
+from picamera2 import MappedArray
+
+
+class FrameView:
+    """
+    Frame for detectors that may point directly into a camera buffer.\n
+    A view created from a request holds the request until release(), so the camera
+    can't reuse the buffer while detectors read it. The array must not be used after release,
+    code that keeps or draws on the frame has to copy() it.
+    Views of an ordinary array (copy mode) just keep the array.
+    Can be used as a context manager, the view is released on exit.
+    """
+    def __init__(self, array: np.ndarray, request=None, mapped: MappedArray=None) -> None:
+        self.array = array
+        self._request = request
+        self._mapped = mapped
+        self._lock = threading.Lock() # dropped frames are released from the frame grabber thread
+
+
+    @classmethod
+    def from_request(cls, request, stream: str) -> "FrameView":
+        """Map the stream buffer of the completed request without copying it."""
+        mapped = MappedArray(request, stream)
+        array = mapped.__enter__().array
+        # Only the color channels, e.g. XBGR8888 has the unused fourth one
+        return cls(array[:, :, :3], request, mapped)
+
+
+    @property
+    def zero_copy(self) -> bool:
+        return self._request is not None
+
+
+    def copy(self) -> np.ndarray:
+        return self.array.copy()
+
+
+    def release(self) -> None:
+        """Return the buffer to the camera, safe to call more than once."""
+        with self._lock:
+            request, self._request = self._request, None
+            mapped, self._mapped = self._mapped, None
+        if mapped is not None:
+            mapped.__exit__(None, None, None)
+        if request is not None:
+            request.release()
+        self.array = None
+
+
+    def __enter__(self) -> "FrameView":
+        return self
+
+
+    def __exit__(self, *args) -> None:
+        self.release()
@@ -0,0 +1,117 @@
+import collections
+import threading
+import time
+from typing import Optional
+from picamera2.outputs import Output
+from settings.config import *
+
+
+class FanOutOutput(Output):
+    """
+    Sends frames of one running encoder to any number of sinks.\n
+    Sinks (recording, RTP streams) can be added and removed without restarting the encoder.
+    A new sink starts receiving frames from a keyframe, so its stream is always decodable.
+    Optionally keeps the last seconds of video in memory, like picamera2 CircularOutput,
+    which can be flushed to a new sink so that a recording starts before the detection.
+    """
+    def __init__(self, preroll_seconds: float=0) -> None:
+        super().__init__()
+        self.preroll_seconds = preroll_seconds
+        self._buffer = collections.deque() # (frame, keyframe, timestamp in microseconds)
+        self._lock = threading.Lock()
+        self._sinks = {}
+        self._waiting_keyframe = set()
+
+
+    def has_sink(self, name: str) -> bool:
+        return name in self._sinks
+
+
+    def get_sink(self, name: str) -> Optional[Output]:
+        return self._sinks.get(name)
+
+
+    @property
+    def sink_names(self) -> list:
+        return list(self._sinks)
+
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if audio:
+            raise RuntimeError("FanOutOutput does not support audio")
+        if timestamp is None:
+            timestamp = int(time.monotonic() * 1000000)
+
+        with self._lock:
+            if self.preroll_seconds > 0:
+                self._buffer.append((frame, keyframe, timestamp))
+                self._trim()
+            if keyframe:
+                self._waiting_keyframe.clear()
+            sinks = [sink for name, sink in self._sinks.items() if name not in self._waiting_keyframe]
+
+        for sink in sinks:
+            sink.outputframe(frame, keyframe, timestamp)
+
+
+    def _trim(self) -> None:
+        """Drop old frames, but keep the buffer starting from a keyframe."""
+        newest = self._buffer[-1][2]
+        while True:
+            next_keyframe = next((i for i, (_, keyframe, _) in enumerate(self._buffer)
+                                  if keyframe and i > 0), None)
+            if next_keyframe is None or newest - self._buffer[next_keyframe][2] < self.preroll_seconds * 1000000:
+                break
+            for _ in range(next_keyframe):
+                self._buffer.popleft()
+
+        # Without any keyframe the buffer is useless, keep it from growing
+        if not self._buffer[0][1] and newest - self._buffer[0][2] >= self.preroll_seconds * 1000000:
+            self._buffer.popleft()
+
+
+    def buffered_seconds(self) -> float:
+        """Duration of video that will be flushed to the next sink added with pre-roll."""
+        with self._lock:
+            frames = self._from_keyframe()
+            if not frames:
+                return 0.0
+            return (frames[-1][2] - frames[0][2]) / 1000000
+
+
+    def _from_keyframe(self) -> list:
+        for i, (_, keyframe, _) in enumerate(self._buffer):
+            if keyframe:
+                return list(self._buffer)[i:]
+        return []
+
+
+    def add_sink(self, name: str, sink: Output, preroll: bool=False) -> None:
+        """
+        Start sending frames to the started sink.\n
+        Args:
+            name: Unique name of the sink
+            sink: Output that will receive the video
+            preroll: Flush buffered frames to the sink first,
+                     otherwise the sink gets frames from the next keyframe
+        """
+        with self._lock:
+            if preroll:
+                frames = self._from_keyframe()
+                for frame, keyframe, timestamp in frames:
+                    sink.outputframe(frame, keyframe, timestamp)
+                if not frames:
+                    self._waiting_keyframe.add(name)
+            else:
+                self._waiting_keyframe.add(name)
+            self._sinks[name] = sink
+        log.debug(f"Output {name} added")
+
+
+    def remove_sink(self, name: str) -> Optional[Output]:
+        """Stop sending frames to the sink, returns the removed sink."""
+        with self._lock:
+            self._waiting_keyframe.discard(name)
+            sink = self._sinks.pop(name, None)
+        log.debug(f"Output {name} removed")
+        return sink
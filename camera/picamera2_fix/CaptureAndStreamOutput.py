@@ -1,12 +1,15 @@
 # Copyright (c) 2021, Raspberry Pi
 # This file is part of picamera2, licensed under the BSD 2-Clause License.
-# Modified Petrov Konstantin in 2025 (function start)
+# Modified Petrov Konstantin in 2025 (function start, framerate option, spawn in advance, writer thread)
 # See the camera/picamera2_fix/LICENSE file for details.
 
 
+import collections
 import gc
+import os
 import signal
 import subprocess
+import threading
 import time
 from ..camera import log
 
@@ -17,14 +20,32 @@ from picamera2.outputs import Output
 
 class CaptureAndStreamOutput(Output):
     """
-    Copy of FfmpegOutput with small change to disable ffmpeg exit when thread in which popen was called dies
+    Copy of FfmpegOutput with small change to disable ffmpeg exit when thread in which popen was called dies.\n
+    If framerate is given, frames are timestamped by their number instead of the wallclock,
+    so frames written at once (e.g. from a pre-roll buffer) keep their real timing.
+    ffmpeg can be spawned before start, if final_filename is given the output file
+    is renamed to it when ffmpeg exits.
+    With max_queue_bytes frames are written to ffmpeg by a separate thread, so a stalled
+    ffmpeg or SD card doesn't block the encoder. When the queue is full, full_policy is used:
+    "block" waits for space, "drop_non_keyframes" drops frames except keyframes and
+    "drop_until_keyframe" drops frames until the next keyframe, so the video stays decodable.
     """
 
+    FULL_POLICIES = ("block", "drop_non_keyframes", "drop_until_keyframe")
+
     def __init__(self, output_filename, audio=False, audio_device="default", audio_sync=-0.3,
-                 audio_samplerate=48000, audio_codec="aac", audio_bitrate=128000, audio_filter=None, pts=None):
+                 audio_samplerate=48000, audio_codec="aac", audio_bitrate=128000, audio_filter=None, pts=None,
+                 framerate=None, final_filename=None, max_queue_bytes=0, full_policy="drop_until_keyframe"):
         super().__init__(pts=pts)
+        if full_policy not in self.FULL_POLICIES:
+            raise ValueError(f"Unknown full queue policy: {full_policy}")
+        self.framerate = framerate
         self.ffmpeg = None
         self.output_filename = output_filename
+        self.final_filename = final_filename
+        self.spawned_at = None
+        self.started_at = None
+        self.first_frame_latency = None  # seconds from start to the first frame given to ffmpeg
         self.audio = audio
         self.audio_device = audio_device
         self.audio_filter = audio_filter
@@ -38,9 +59,34 @@ class CaptureAndStreamOutput(Output):
         # A user can set this to get notifications of FFmpeg failures.
         self.error_callback = None
         # We don't understand timestamps, so an encoder may have to pace output to us.
-        self.needs_pacing = True
+        self.needs_pacing = framerate is None
 
-    def start(self):
+        self.max_queue_bytes = max_queue_bytes
+        self.full_policy = full_policy
+        self._queue = collections.deque()  # (frame, keyframe, timestamp)
+        self._queued_bytes = 0
+        self._dropping = False
+        self._condition = threading.Condition()
+        self._writer = None
+        self._writer_running = False
+        self._stats = {"written_frames": 0, "dropped_frames": 0, "max_queued_bytes": 0,
+                       "write_time": 0.0, "max_write_latency": 0.0}
+
+    @property
+    def stats(self):
+        """Writer queue fill, dropped frames and time spent writing to ffmpeg."""
+        stats = dict(self._stats, queued_bytes=self._queued_bytes)
+        written = stats.pop("write_time")
+        stats["mean_write_latency"] = round(written / stats["written_frames"], 4) if stats["written_frames"] else 0.0
+        stats["max_write_latency"] = round(stats["max_write_latency"], 4)
+        return stats
+
+    @property
+    def alive(self):
+        return self.ffmpeg is not None and self.ffmpeg.poll() is None
+
+    def spawn(self):
+        """Start the ffmpeg process, it waits for the video on stdin."""
         general_options = ['-loglevel', 'warning',
                            '-y']  # -y means overwrite output without asking
         # We have to get FFmpeg to timestamp the video frames as it gets them. This isn't
@@ -49,6 +95,10 @@ class CaptureAndStreamOutput(Output):
         video_input = ['-use_wallclock_as_timestamps', '1',
                        '-thread_queue_size', '64',  # necessary to prevent warnings
                        '-i', '-']
+        if self.framerate:
+            video_input = ['-r', str(self.framerate),
+                           '-thread_queue_size', '64',
+                           '-i', '-']
         video_codec = ['-c:v', 'copy']
         audio_input = []
         audio_codec = []
@@ -71,11 +121,30 @@ class CaptureAndStreamOutput(Output):
         #log.error(self.ffmpeg.communicate())
         # With this, ffmpeg will die when the thread in which it was created dies
         #self.ffmpeg = subprocess.Popen(command, stdin=subprocess.PIPE, preexec_fn=lambda: prctl.set_pdeathsig(signal.SIGKILL))
+        self.spawned_at = time.monotonic()
 
+    def start(self):
+        if self.ffmpeg is None:
+            self.spawn()
+        self.started_at = time.monotonic()
+        self.first_frame_latency = None
         super().start()
+        if self.max_queue_bytes > 0:
+            self._writer_running = True
+            self._writer = threading.Thread(target=self._write_loop, daemon=True, name="ffmpeg-writer")
+            self._writer.start()
 
     def stop(self):
         super().stop()
+        if self._writer is not None:
+            # Let the writer flush the queue, but don't wait forever for a stalled ffmpeg
+            with self._condition:
+                self._writer_running = False
+                self._condition.notify_all()
+            self._writer.join(timeout=5)
+            self._writer = None
+            if self._stats["dropped_frames"]:
+                log.warning(f"{self._stats['dropped_frames']} frames were dropped writing {self.output_filename}")
         if self.ffmpeg is not None:
             self.ffmpeg.stdin.close()  # FFmpeg needs this to shut down tidily
             try:
@@ -90,18 +159,84 @@ class CaptureAndStreamOutput(Output):
             self.ffmpeg = None
             # This seems to be necessary to get the subprocess to clean up fully.
             gc.collect()
+            if self.final_filename and os.path.exists(self.output_filename):
+                os.replace(self.output_filename, self.final_filename)
 
     def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
         if audio:
             raise RuntimeError("FfmpegOutput does not support audio packets from Picamera2")
         if self.recording and self.ffmpeg:
-            # Handle the case where the FFmpeg prcoess has gone away for reasons of its own.
-            try:
-                self.ffmpeg.stdin.write(frame)
-                self.ffmpeg.stdin.flush()  # forces every frame to get timestamped individually
-            except Exception as e:  # presumably a BrokenPipeError? should we check explicitly?
-                self.ffmpeg = None
-                if self.error_callback:
-                    self.error_callback(e)
+            if self._writer is not None:
+                self._enqueue(frame, keyframe, timestamp)
             else:
-                self.outputtimestamp(timestamp)
+                self._write(frame, timestamp)
+
+    def _enqueue(self, frame, keyframe, timestamp):
+        """Queue the frame for the writer thread applying the full queue policy."""
+        size = len(frame)
+        with self._condition:
+            if self._dropping and not keyframe:
+                self._stats["dropped_frames"] += 1
+                return
+            self._dropping = False
+
+            while self._queue and self._queued_bytes + size > self.max_queue_bytes:
+                if self.full_policy == "block":
+                    if not (self.recording and self._writer_running):
+                        return
+                    self._condition.wait(timeout=0.1)
+                    continue
+                if self.full_policy == "drop_non_keyframes" and keyframe:
+                    break  # keyframes are queued anyway, the video can't be decoded without them
+                self._stats["dropped_frames"] += 1
+                # Frames after the dropped one reference it, so skip them up to the next keyframe
+                self._dropping = self.full_policy == "drop_until_keyframe"
+                return
+
+            self._queue.append((frame, keyframe, timestamp))
+            self._queued_bytes += size
+            self._stats["max_queued_bytes"] = max(self._stats["max_queued_bytes"], self._queued_bytes)
+            self._condition.notify_all()
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                while not self._queue and self._writer_running:
+                    self._condition.wait()
+                if not self._queue:
+                    break
+                frame, _, timestamp = self._queue.popleft()
+                self._queued_bytes -= len(frame)
+                self._condition.notify_all()
+
+            if not self._write(frame, timestamp):
+                with self._condition:
+                    self._queue.clear()
+                    self._queued_bytes = 0
+                    self._condition.notify_all()
+                break
+
+    def _write(self, frame, timestamp):
+        """Write the frame to ffmpeg, returns False if ffmpeg has gone."""
+        ffmpeg = self.ffmpeg
+        if ffmpeg is None:
+            return False
+        # Handle the case where the FFmpeg prcoess has gone away for reasons of its own.
+        start = time.monotonic()
+        try:
+            ffmpeg.stdin.write(frame)
+            ffmpeg.stdin.flush()  # forces every frame to get timestamped individually
+        except Exception as e:  # presumably a BrokenPipeError? should we check explicitly?
+            self.ffmpeg = None
+            if self.error_callback:
+                self.error_callback(e)
+            return False
+
+        elapsed = time.monotonic() - start
+        self._stats["written_frames"] += 1
+        self._stats["write_time"] += elapsed
+        self._stats["max_write_latency"] = max(self._stats["max_write_latency"], elapsed)
+        if self.first_frame_latency is None:
+            self.first_frame_latency = time.monotonic() - self.started_at
+        self.outputtimestamp(timestamp)
+        return True
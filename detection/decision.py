@@ -0,0 +1,52 @@
+from collections import deque
+
+
+class VotingDecision:
+    """
+    Smooths raw detector results with N-of-M voting and hysteresis.\n
+    The decision becomes positive when at least enter_votes of the last window results
+    are positive and becomes negative when at least exit_votes of them are negative.
+    Votes are reset on every transition, so a new state always needs fresh votes to be left.
+    """
+    def __init__(self, window: int, enter_votes: int, exit_votes: int) -> None:
+        if not (0 < enter_votes <= window and 0 < exit_votes <= window):
+            raise ValueError(f"Votes must be between 1 and window size {window}")
+
+        self.enter_votes = enter_votes
+        self.exit_votes  = exit_votes
+        self._votes = deque(maxlen=window)
+        self.active = False
+
+        self.enters = 0
+        self.exits = 0
+        self.suppressed = 0 # raw results that disagreed with the decision but didn't change it
+
+
+    def update(self, detected: bool) -> bool:
+        """Add a raw detector result and return the current decision."""
+        self._votes.append(detected)
+        positives = sum(self._votes)
+        negatives = len(self._votes) - positives
+
+        if not self.active and positives >= self.enter_votes:
+            self.active = True
+            self.enters += 1
+            self._votes.clear()
+        elif self.active and negatives >= self.exit_votes:
+            self.active = False
+            self.exits += 1
+            self._votes.clear()
+        elif detected != self.active:
+            self.suppressed += 1
+
+        return self.active
+
+
+    def reset(self) -> None:
+        self._votes.clear()
+        self.active = False
+
+
+    @property
+    def stats(self) -> dict:
+        return {"enters": self.enters, "exits": self.exits, "suppressed": self.suppressed}
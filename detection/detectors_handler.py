@@ -1,32 +1,253 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, NamedTuple, Optional, Tuple
 from .hands_detection import HandsDetector
-from .squirrel_detection import SquirrelDetector, CustomSquirrelDetector
+from .squirrel_detection import SquirrelDetector, CustomSquirrelDetector, CascadeSquirrelDetector, SquirrelDetections
+from .motion_detection import MotionDetector
+from .frame_preprocessing import PreprocessedFrame
+from .tracking import SquirrelTracker
+from .decision import VotingDecision
+from settings.config import *
+
+
+class DetectionResult(NamedTuple):
+    """Combined result of all detectors on one frame."""
+    hands: bool
+    squirrel: bool
+
+
+def squirrel_detector_factory() -> Tuple[Callable, object]:
+    """
+    Get the factory of the squirrel detector chosen in settings and its empty result.\n
+    "ssd" finds boxes, "classifier" only tells if there is a squirrel,
+    "cascade" runs the classifier first and the SSD detector only when needed.
+    """
+    if settings.squirrel_detector == "classifier":
+        return CustomSquirrelDetector, False
+    if settings.squirrel_detector == "cascade":
+        # Boxes are needed for tracking and to draw them on the preview
+        need_boxes = settings.enable_roi_tracking or settings.show_preview
+        return partial(CascadeSquirrelDetector, need_boxes), SquirrelDetections.empty()
+    if settings.squirrel_detector == "ssd":
+        return SquirrelDetector, SquirrelDetections.empty()
+    raise ValueError(f"Unknown squirrel detector: {settings.squirrel_detector}")
 
 
 class DetectorsHandler:
-    """Coordinates different computer vision detectors."""
+    """
+    Coordinates different computer vision detectors.\n
+    When the motion gate is enabled, detectors are only run if the scene
+    has changed since their last run, otherwise the cached result is returned.
+    Color conversions and resizes of the frame are shared between detectors.
+    detect_all() runs the detectors concurrently on a persistent thread pool.
+    After a squirrel is found, it is tracked and detection runs on the region
+    around it, with periodic full frame detections.
+    Raw detector results are smoothed with N-of-M voting before they are returned,
+    so a single wrong result doesn't make the feeder change its state.
+    In "processes" detection mode the detectors run in worker processes,
+    everything else stays in the feeder process.
+    """
     def __init__(self) -> None:
-        self._squirrel_detector = SquirrelDetector()
-        #self._squirrel_detector = CustomSquirrelDetector()
-        self._hands_detector    = HandsDetector()
+        self._engine = None
+        squirrel_factory, squirrel_empty = squirrel_detector_factory()
+        # Preview windows can be shown only from the feeder process
+        if settings.detection_mode == "processes" and not settings.show_preview:
+            from .process_engine import ProcessDetectionEngine
+            self._engine = ProcessDetectionEngine({"squirrel": (squirrel_factory, squirrel_empty),
+                                                   "hands":    (HandsDetector, False)})
+            self._squirrel_detector = self._engine.proxy("squirrel")
+            self._hands_detector    = self._engine.proxy("hands")
+            if not self._engine.wait_ready(settings.worker_startup_timeout):
+                log.warning("Detector workers are still loading models, their results are empty until they are ready")
+        else:
+            self._squirrel_detector = squirrel_factory()
+            self._hands_detector    = HandsDetector()
         self._frame = None
 
+        # TFLite and mediapipe release the GIL, so threads are enough to overlap them
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="detector")
+
+        # Tracking needs boxes, so it works only with detectors that return them
+        self._tracker = None
+        if settings.enable_roi_tracking and settings.squirrel_detector != "classifier":
+            self._tracker = SquirrelTracker()
+
+        self._motion_detector = MotionDetector() if settings.enable_motion_gate else None
+        # Whether the scene changed on the current frame, always False without the motion gate
+        # so it doesn't count as activity for the scheduler
+        self.motion = False
+
+        # Per detector state of the motion gate
+        self._cached  = {"squirrel": None, "hands": None}
+        self._dirty   = {"squirrel": True, "hands": True}
+        self._skipped_in_row = {"squirrel": 0, "hands": 0}
+
+        self._decisions = {
+            "squirrel": VotingDecision(settings.squirrel_vote_window,
+                                       settings.squirrel_enter_votes,
+                                       settings.squirrel_exit_votes),
+            "hands":    VotingDecision(settings.hands_vote_window,
+                                       settings.hands_enter_votes,
+                                       settings.hands_exit_votes),
+        }
+
+        self._stats = {"frames": 0, "motion_frames": 0,
+                       "inferences": {"squirrel": 0, "hands": 0},
+                       "skipped":    {"squirrel": 0, "hands": 0},
+                       "roi_detections": 0, "roi_misses": 0}
+
+
+    def cleanup(self) -> None:
+        """Stop the detectors thread pool and worker processes."""
+        self._executor.shutdown(wait=True)
+        if self._engine is not None:
+            self._engine.cleanup()
+
 
     def update_frame(self, frame) -> None:
-        """Update the current frame that will be analyzed by detectors."""
-        self._frame = frame
+        """
+        Update the current frame that will be analyzed by detectors.\n
+        Preprocessed variants of the frame are kept until a different frame is passed.
+        """
+        if self._frame is not None and self._frame.frame is frame:
+            return
+        self._frame = PreprocessedFrame(frame)
+        self._stats["frames"] += 1
+        if self._engine is not None:
+            self._engine.check_health()
+
+        if self._motion_detector is not None:
+            self.motion = self._motion_detector.update(self._frame)
+            if self.motion:
+                self._stats["motion_frames"] += 1
+        if self.motion or self._motion_detector is None:
+            for name in self._dirty:
+                self._dirty[name] = True
+
+
+    def release_frame(self) -> None:
+        """
+        Drop references to the current frame.\n
+        Must be called before a camera buffer view of the frame is released,
+        detection results and the motion background are kept.
+        """
+        self._frame = None
+        if self._engine is not None:
+            self._engine.release_frame()
+
+
+    def _run_detector(self, name: str, detect: Callable):
+        """
+        Run the detector unless the motion gate allows to reuse its cached result.\n
+        A run is forced after settings.motion_max_skipped_frames skipped frames
+        so that a stale result can't live forever.
+        """
+        if (not self._dirty[name] and self._cached[name] is not None
+                and self._skipped_in_row[name] < settings.motion_max_skipped_frames):
+            self._skipped_in_row[name] += 1
+            self._stats["skipped"][name] += 1
+            return self._cached[name]
+
+        result = detect(self._frame)
+        self._cached[name] = result
+        self._dirty[name] = False
+        self._skipped_in_row[name] = 0
+        self._stats["inferences"][name] += 1
+        return result
 
 
     def detect_squirrel(self) -> bool:
         """
         Run squirrel detection on the current frame.\n
-        Returns True if a squirrel is detected, False otherwise
+        Returns True if a squirrel is considered present after voting, False otherwise.
+        Boxes of the last detection are available in squirrel_detections
         """
-        return self._squirrel_detector.detect(self._frame)
-    
-    
+        if self._tracker is not None:
+            detected = self._run_detector("squirrel", self._detect_squirrel_tracked)
+        else:
+            detected = self._run_detector("squirrel", self._squirrel_detector.detect)
+        return self._decisions["squirrel"].update(bool(detected))
+
+
+    def _detect_squirrel_tracked(self, frame):
+        """
+        Detect squirrel in the region of interest of the tracker if it has one.\n
+        Falls back to full frame detection if the squirrel is not found in the region.
+        """
+        roi = self._tracker.region_of_interest()
+        if roi is not None:
+            detections = self._squirrel_detector.detect_region(frame, roi)
+            self._stats["roi_detections"] += 1
+            if detections:
+                self._tracker.update(detections.squirrel_boxes, detections.squirrel_scores, full_frame=False)
+                return detections
+            self._stats["roi_misses"] += 1
+
+        detections = self._squirrel_detector.detect(frame)
+        self._tracker.update(detections.squirrel_boxes, detections.squirrel_scores, full_frame=True)
+        return detections
+
+
+    def reset_decisions(self, names) -> None:
+        """
+        Forget the votes of the decisions, e.g. of detectors whose results a feeder state doesn't use.\n
+        A decision left active in a state that doesn't vote on it would otherwise still be active
+        when the feeder returns to a state that reads it.
+        """
+        for name in names:
+            self._decisions[name].reset()
+
+
+    @property
+    def squirrel_detections(self):
+        """Structured result of the last squirrel detector run, None before the first run."""
+        return self._cached["squirrel"]
+
+
+    @property
+    def squirrel_confidence(self) -> Optional[float]:
+        """Highest squirrel score of the last detection, 0 if none was found, None if the detector has no scores."""
+        detections = self._cached["squirrel"]
+        if not isinstance(detections, SquirrelDetections):
+            return None
+        scores = detections.squirrel_scores
+        return float(scores.max()) if len(scores) else 0.0
+
+
     def detect_hands(self) -> bool:
         """
         Run hands detection on the current frame.\n
-        Returns True if hands are detected, False otherwise
+        Returns True if hands are considered present after voting, False otherwise
+        """
+        detected = self._run_detector("hands", self._hands_detector.detect)
+        return self._decisions["hands"].update(bool(detected))
+
+
+    def detect_all(self) -> DetectionResult:
+        """
+        Run hands and squirrel detection on the current frame.\n
+        Detectors are run concurrently unless parallel detection is disabled
+        or preview is shown, because opencv windows can't be used from several threads.
+        Returns DetectionResult with the result of every detector
+        """
+        if not settings.parallel_detection or settings.show_preview:
+            return DetectionResult(hands=self.detect_hands(), squirrel=self.detect_squirrel())
+
+        hands    = self._executor.submit(self.detect_hands)
+        squirrel = self._executor.submit(self.detect_squirrel)
+        return DetectionResult(hands=hands.result(), squirrel=squirrel.result())
+
+
+    @property
+    def stats(self) -> dict:
+        """
+        Counters of processed frames, run and skipped inferences, region detections
+        and decision transitions.
         """
-        return self._hands_detector.detect(self._frame)
+        stats = dict(self._stats, decisions={name: decision.stats
+                                             for name, decision in self._decisions.items()})
+        if self._engine is not None:
+            stats["workers"] = self._engine.stats
+        elif hasattr(self._squirrel_detector, "stats"):
+            stats["squirrel_detector"] = self._squirrel_detector.stats
+        return stats
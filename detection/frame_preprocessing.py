@@ -0,0 +1,116 @@
+import cv2
+import threading
+import numpy as np
+from typing import NamedTuple, Optional, Tuple
+
+
+class InputSpec(NamedTuple):
+    """
+    Description of the image a detector expects as input.\n
+    size is (width, height), None keeps the size of the camera frame.
+    """
+    colorspace: str = "BGR"
+    size: Optional[Tuple[int, int]] = None
+    dtype: type = np.uint8
+
+
+_COLOR_CONVERSIONS = {
+    ("BGR", "RGB"): cv2.COLOR_BGR2RGB,
+    ("BGR", "GRAY"): cv2.COLOR_BGR2GRAY,
+}
+
+
+class PreprocessedFrame:
+    """
+    Camera frame together with the variants of it already computed for detectors.\n
+    Each (colorspace, size, dtype) variant is computed only once per frame,
+    so detectors that need the same input share it.
+    Resizing is done before color conversion and intermediate results
+    are cached too, so e.g. RGB and GRAY variants of the same size share one resize.
+    Safe to use from several detector threads at once.
+    """
+    def __init__(self, frame) -> None:
+        self.frame = frame
+        height, width = frame.shape[:2]
+        self._variants = {InputSpec("BGR", (width, height), frame.dtype): frame}
+        self._lock = threading.RLock()
+
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        height, width = self.frame.shape[:2]
+        return width, height
+
+
+    def get(self, spec: InputSpec) -> np.ndarray:
+        """Return the frame converted according to spec, computing it if needed."""
+        spec = InputSpec(spec.colorspace, tuple(spec.size or self.size), np.dtype(spec.dtype))
+        with self._lock:
+            variant = self._variants.get(spec)
+            if variant is not None:
+                return variant
+
+            if spec.dtype != self.frame.dtype:
+                source = self.get(InputSpec(spec.colorspace, spec.size, self.frame.dtype))
+                variant = source.astype(spec.dtype)
+            elif spec.colorspace != "BGR":
+                source = self.get(InputSpec("BGR", spec.size, spec.dtype))
+                variant = cv2.cvtColor(source, _COLOR_CONVERSIONS[("BGR", spec.colorspace)])
+            else:
+                variant = cv2.resize(self.frame, spec.size)
+
+            self._variants[spec] = variant
+            return variant
+
+
+class InputWriter:
+    """
+    Converts BGR images into a detector input buffer without allocating memory.\n
+    Resize and color conversion use buffers allocated on the first call and reused later,
+    the result is written straight into the given output, e.g. the interpreter input tensor.
+    Not thread safe, every detector owns its writer.
+    """
+    def __init__(self, spec: InputSpec) -> None:
+        self.spec = InputSpec(spec.colorspace, spec.size, np.dtype(spec.dtype))
+        self._resized = None
+        self._converted = None
+
+
+    @staticmethod
+    def _reuse(buffer: Optional[np.ndarray], shape: tuple, dtype) -> np.ndarray:
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype)
+        return buffer
+
+
+    def write(self, image: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """
+        Write the image converted according to spec into out.\n
+        Args:
+            image: BGR image of any size, e.g. a camera frame or its crop
+            out: Output buffer with the spec size, colorspace channels and dtype
+        Returns out
+        """
+        height, width = image.shape[:2]
+        size = tuple(self.spec.size or (width, height))
+        if size != (width, height):
+            self._resized = self._reuse(self._resized, (size[1], size[0]) + image.shape[2:], image.dtype)
+            image = cv2.resize(image, size, dst=self._resized)
+
+        if self.spec.colorspace != "BGR":
+            code = _COLOR_CONVERSIONS[("BGR", self.spec.colorspace)]
+            if out.dtype == image.dtype:
+                cv2.cvtColor(image, code, dst=out)
+                return out
+            self._converted = self._reuse(self._converted, out.shape, image.dtype)
+            image = cv2.cvtColor(image, code, dst=self._converted)
+
+        np.copyto(out, image, casting="unsafe")
+        return out
+
+
+def as_preprocessed(frame) -> PreprocessedFrame:
+    """Wrap a raw camera frame, so detectors can be used without DetectorsHandler."""
+    if isinstance(frame, PreprocessedFrame):
+        return frame
+    return PreprocessedFrame(frame)
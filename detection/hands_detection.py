@@ -1,5 +1,6 @@
 import mediapipe
 import cv2
+from .frame_preprocessing import InputSpec, as_preprocessed
 drawingModule = mediapipe.solutions.drawing_utils
 handsModule = mediapipe.solutions.hands
 from settings.config import settings
@@ -9,14 +10,16 @@ class HandsDetector:
     """Class that uses mediapipe.solutions.hands for detecting hands on camera image"""
     def __init__(self) -> None:
         self.hands = handsModule.Hands(static_image_mode=False, min_detection_confidence=0.7, min_tracking_confidence=0.7, max_num_hands=2)
+        # mediapipe scales the image itself, so the frame is used in its own size
+        self.input_spec = InputSpec("RGB")
 
 
     def detect(self, frame) -> bool:
-        frame1 = cv2.resize(frame, (640, 480))
-
-        results = self.hands.process(cv2.cvtColor(frame1, cv2.COLOR_BGR2RGB))
+        frame = as_preprocessed(frame)
+        results = self.hands.process(frame.get(self.input_spec))
 
         if settings.show_preview:
+            frame1 = frame.frame.copy()
             if results.multi_hand_landmarks != None:
                 for handLandmarks in results.multi_hand_landmarks:
                     drawingModule.draw_landmarks(frame1, handLandmarks, handsModule.HAND_CONNECTIONS)
@@ -0,0 +1,54 @@
+import tflite_runtime.interpreter as tflite
+from typing import Optional
+from settings.config import *
+
+
+def resolve_interpreter_options(model_path: str) -> dict:
+    """
+    Get thread count and delegate for the model from settings.\n
+    "auto" values are taken from the configuration saved by --tune-detector,
+    if the model was never tuned tflite defaults (XNNPACK, default thread count) are used.
+    """
+    num_threads = settings.tflite_num_threads
+    delegate = settings.tflite_delegate
+
+    tuned = get_tuned_interpreter_options(model_path) or {}
+    if not num_threads:
+        num_threads = tuned.get("num_threads")
+    if delegate == "auto":
+        delegate = tuned.get("delegate", "xnnpack")
+
+    return {"num_threads": num_threads, "delegate": delegate}
+
+
+def create_interpreter(model_path: str, num_threads: Optional[int]=None,
+                       delegate: Optional[str]=None, fallback: bool=True) -> tflite.Interpreter:
+    """
+    Create a tflite interpreter with tensors already allocated.\n
+    Args:
+        model_path: Path to .tflite model
+        num_threads: Number of threads used by interpreter, taken from settings if None
+        delegate: "xnnpack", "none" or path to a delegate library, taken from settings if None
+        fallback: Use XNNPACK if the delegate library can't be loaded instead of raising
+    """
+    if num_threads is None and delegate is None:
+        options = resolve_interpreter_options(model_path)
+        num_threads, delegate = options["num_threads"], options["delegate"]
+
+    kwargs = {"model_path": model_path, "num_threads": num_threads or None}
+    if delegate == "none":
+        # XNNPACK is applied by default, this resolver turns it off
+        kwargs["experimental_op_resolver_type"] = tflite.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    elif delegate not in (None, "xnnpack"):
+        try:
+            kwargs["experimental_delegates"] = [tflite.load_delegate(delegate)]
+        except (ValueError, OSError):
+            if not fallback:
+                raise
+            log.warning(f"Can't load delegate {delegate}, using XNNPACK", exc_info=True)
+            delegate = "xnnpack"
+
+    interpreter = tflite.Interpreter(**kwargs)
+    interpreter.allocate_tensors()
+    log.info(f"Interpreter for {model_path}: threads={num_threads or 'default'}, delegate={delegate}")
+    return interpreter
@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+from .frame_preprocessing import InputSpec, as_preprocessed
+from settings.config import settings
+
+
+class MotionDetector:
+    """
+    Cheap scene change detector used to gate expensive detectors.\n
+    Keeps a running average background of a small grayscale thumbnail
+    and reports motion when enough thumbnail pixels differ from it.
+    """
+    def __init__(self) -> None:
+        self.input_spec = InputSpec("GRAY", (settings.motion_thumbnail_width,
+                                             settings.motion_thumbnail_height))
+        self.threshold = settings.motion_threshold
+        self.pixel_threshold = settings.motion_pixel_threshold
+        self.learning_rate = settings.motion_learning_rate
+        self._background = None
+        self.last_score = 0.0
+
+
+    def _thumbnail(self, frame) -> np.ndarray:
+        return cv2.GaussianBlur(as_preprocessed(frame).get(self.input_spec), (5, 5), 0)
+
+
+    def update(self, frame) -> bool:
+        """
+        Feed a new frame into the background model.\n
+        Returns True if the frame differs from the background enough to count as motion.
+        The first frame always counts as motion because there is nothing to compare with.
+        """
+        thumbnail = self._thumbnail(frame)
+
+        if self._background is None:
+            self._background = thumbnail.astype(np.float32)
+            self.last_score = 1.0
+            return True
+
+        diff = cv2.absdiff(thumbnail, cv2.convertScaleAbs(self._background))
+        self.last_score = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+        cv2.accumulateWeighted(thumbnail, self._background, self.learning_rate)
+
+        return self.last_score > self.threshold
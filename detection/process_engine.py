@@ -0,0 +1,317 @@
+import multiprocessing
+import signal
+import threading
+import time
+import traceback
+import numpy as np
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Tuple
+from .frame_preprocessing import as_preprocessed
+from settings.config import *
+
+
+class SharedFrameRing:
+    """
+    Ring of frame slots in shared memory.\n
+    Frames are copied into the next slot and workers read them by slot number,
+    so frames are never pickled. A slot is overwritten only after all other slots were used,
+    which is enough because detection of a frame finishes before the next frames are published.
+    """
+    def __init__(self, slots: int, shape: Tuple[int, ...], dtype) -> None:
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.slots = slots
+        self._memory = shared_memory.SharedMemory(create=True, size=self.slot_size * slots)
+        self._next = 0
+
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+
+    def fits(self, frame: np.ndarray) -> bool:
+        return frame.shape == self.shape and frame.dtype == self.dtype
+
+
+    def write(self, frame: np.ndarray) -> int:
+        """Copy the frame into the next slot and return the slot number."""
+        slot = self._next
+        self._next = (self._next + 1) % self.slots
+        np.copyto(self.view(self._memory, slot, self.shape, self.dtype), frame)
+        return slot
+
+
+    @staticmethod
+    def view(memory: shared_memory.SharedMemory, slot: int, shape: tuple, dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        offset = slot * int(np.prod(shape)) * dtype.itemsize
+        return np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+
+
+    def close(self) -> None:
+        self._memory.close()
+        self._memory.unlink()
+
+
+def _worker_main(name: str, factory: Callable, conn) -> None:
+    """
+    Worker process loop: create the detector and answer detection requests.\n
+    Requests are (ring name, slot, shape, dtype, method, args),
+    the answer is (error, result), error is the traceback if the method raised.
+    None stops the worker.
+    """
+    # Shutdown is driven by the parent, Ctrl+C must not kill workers in the middle of a request
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    detector = factory()
+    rings = {}
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+
+        ring_name, slot, shape, dtype, method, args = request
+        if ring_name not in rings:
+            for ring in rings.values():
+                ring.close()
+            rings = {ring_name: shared_memory.SharedMemory(name=ring_name)}
+        frame = SharedFrameRing.view(rings[ring_name], slot, shape, dtype)
+        try:
+            conn.send((None, getattr(detector, method)(frame, *args)))
+        except Exception:
+            conn.send((traceback.format_exc(), None))
+        del frame
+
+    for ring in rings.values():
+        ring.close()
+
+
+class _Worker:
+    """Detector process with the parent end of its pipe."""
+    def __init__(self, context, name: str, factory: Callable) -> None:
+        self.name = name
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(name, factory, child_conn),
+                                       daemon=True, name=f"detector-{name}")
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.started_at = time.monotonic()
+
+
+    def stop(self, timeout: float) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ProcessDetectionEngine:
+    """
+    Runs detectors in worker processes, so they don't share the GIL with the feeder
+    and a crash of a detector (e.g. inside mediapipe) doesn't take the feeder down.\n
+    Frames are passed through a SharedFrameRing, only small requests and results
+    go through pipes. A worker that died or didn't answer in time is restarted
+    and the detector's empty result is returned for that frame.
+    Calls don't wait for a restarted worker to load its models, the empty result
+    is returned until it reports ready.
+    """
+    def __init__(self, detectors: Dict[str, Tuple[Callable, object]]) -> None:
+        """
+        Start a worker process for every detector.\n
+        Args:
+            detectors: Detector name to (factory, empty result). The factory must be picklable,
+                       it creates the detector in the worker process. The empty result
+                       is returned when the worker fails.
+        """
+        self._context = multiprocessing.get_context("spawn") # forking a process with camera threads is unsafe
+        self._detectors = detectors
+        self._workers = {name: _Worker(self._context, name, factory) for name, (factory, _) in detectors.items()}
+        self._locks = {name: threading.Lock() for name in detectors}
+        self._publish_lock = threading.Lock()
+
+        self._ring = None
+        self._published = None # (frame, slot) of the last published frame
+
+        self._stats = {name: {"calls": 0, "failures": 0, "not_ready": 0, "timeouts": 0, "restarts": 0,
+                              "round_trip_time": 0.0} for name in detectors}
+
+
+    def cleanup(self) -> None:
+        for worker in self._workers.values():
+            worker.stop(settings.worker_stop_timeout)
+        with self._publish_lock:
+            self._published = None
+            if self._ring is not None:
+                self._ring.close()
+                self._ring = None
+
+
+    def release_frame(self) -> None:
+        """Forget the last published frame, it may be a camera buffer view that is released."""
+        with self._publish_lock:
+            self._published = None
+
+
+    def proxy(self, name: str) -> "RemoteDetector":
+        return RemoteDetector(self, name)
+
+
+    def _publish(self, frame: np.ndarray) -> tuple:
+        """
+        Put the frame into the ring once, all detectors of the frame read the same slot.\n
+        Returns (ring name, slot, shape, dtype) for the request
+        """
+        with self._publish_lock:
+            if self._published is None or self._published[0] is not frame:
+                if self._ring is None or not self._ring.fits(frame):
+                    if self._ring is not None:
+                        self._ring.close()
+                    self._ring = SharedFrameRing(settings.frame_ring_slots, frame.shape, frame.dtype)
+                self._published = (frame, self._ring.write(frame))
+            return self._ring.name, self._published[1], self._ring.shape, self._ring.dtype.str
+
+
+    def call(self, name: str, method: str, frame: np.ndarray, *args):
+        """
+        Run the detector method in its worker on the frame.\n
+        Returns the result of the method or the empty result of the detector if the worker failed
+        """
+        location = self._publish(frame)
+        stats = self._stats[name]
+        with self._locks[name]:
+            stats["calls"] += 1
+            if not self._check_worker(name):
+                stats["failures"] += 1
+                return self._detectors[name][1]
+            worker = self._workers[name]
+            start = time.monotonic()
+            try:
+                if not self._poll_ready(worker):
+                    # Models are still loading, the feeder doesn't wait for them
+                    stats["failures"] += 1
+                    stats["not_ready"] += 1
+                    return self._detectors[name][1]
+                worker.conn.send((*location, method, args))
+                if not worker.conn.poll(settings.worker_timeout):
+                    stats["timeouts"] += 1
+                    raise TimeoutError(f"{name} detector didn't answer in {settings.worker_timeout} s")
+                error, result = worker.conn.recv()
+            except (OSError, EOFError, TimeoutError) as e:
+                # The worker died or hung, its state can't be trusted anymore
+                stats["failures"] += 1
+                log.error(f"Detector worker {name} failed: {e}")
+                self._restart(name)
+                return self._detectors[name][1]
+
+            if error is not None:
+                stats["failures"] += 1
+                log.error(f"Detector {name} raised in worker:\n{error}")
+                return self._detectors[name][1]
+
+            stats["round_trip_time"] += time.monotonic() - start
+            return result
+
+
+    def _poll_ready(self, worker: _Worker) -> bool:
+        """
+        Check without blocking whether the worker has created its detector.\n
+        Raises TimeoutError if it didn't start in settings.worker_startup_timeout
+        """
+        if worker.ready:
+            return True
+        if worker.conn.poll():
+            worker.conn.recv()
+            worker.ready = True
+        elif time.monotonic() - worker.started_at > settings.worker_startup_timeout:
+            raise TimeoutError(f"{worker.name} detector didn't start in {settings.worker_startup_timeout} s")
+        return worker.ready
+
+
+    def wait_ready(self, timeout: float) -> bool:
+        """
+        Wait until all workers have created their detectors, used at startup.\n
+        Returns False if some worker isn't ready after timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        for name, worker in self._workers.items():
+            with self._locks[name]:
+                if worker.ready or not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                    continue
+                try:
+                    worker.conn.recv()
+                    worker.ready = True
+                except (OSError, EOFError):
+                    pass # died while starting, restarted by check_health
+        return all(worker.ready for worker in self._workers.values())
+
+
+    def check_health(self) -> None:
+        """Restart workers whose process has died."""
+        for name in self._workers:
+            with self._locks[name]:
+                self._check_worker(name)
+
+
+    def _check_worker(self, name: str) -> bool:
+        """
+        Restart the worker if it died.\n
+        A worker that keeps crashing is restarted at most once per worker_restart_delay.
+        Returns False if the worker is dead and can't be restarted yet
+        """
+        worker = self._workers[name]
+        if worker.process.is_alive():
+            return True
+        if time.monotonic() - worker.started_at < settings.worker_restart_delay:
+            return False
+        log.error(f"Detector worker {name} died with exit code {worker.process.exitcode}")
+        self._restart(name)
+        return True
+
+
+    def _restart(self, name: str) -> None:
+        self._workers[name].stop(timeout=0)
+        self._workers[name] = _Worker(self._context, name, self._detectors[name][0])
+        self._stats[name]["restarts"] += 1
+        log.warning(f"Detector worker {name} restarted")
+
+
+    @property
+    def stats(self) -> dict:
+        """
+        Calls, failures, calls before the worker was ready, timeouts, restarts
+        and mean round trip time in ms of every worker.
+        """
+        stats = {}
+        for name, worker_stats in self._stats.items():
+            succeeded = worker_stats["calls"] - worker_stats["failures"]
+            stats[name] = {key: value for key, value in worker_stats.items() if key != "round_trip_time"}
+            stats[name]["mean_round_trip_ms"] = (round(worker_stats["round_trip_time"] / succeeded * 1000, 1)
+                                                 if succeeded else 0.0)
+        return stats
+
+
+class RemoteDetector:
+    """Stand-in for a detector object that runs its methods in the worker process."""
+    def __init__(self, engine: ProcessDetectionEngine, name: str) -> None:
+        self._engine = engine
+        self.name = name
+
+
+    def detect(self, frame):
+        return self._engine.call(self.name, "detect", as_preprocessed(frame).frame)
+
+
+    def detect_region(self, frame, roi: np.ndarray):
+        return self._engine.call(self.name, "detect_region", as_preprocessed(frame).frame, roi)
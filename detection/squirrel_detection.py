@@ -1,17 +1,53 @@
-import tflite_runtime.interpreter as tflite
 import cv2
+import time
 import numpy as np
+from typing import Callable, NamedTuple
+from .frame_preprocessing import InputSpec, InputWriter, as_preprocessed
+from .interpreter import create_interpreter
 from settings.config import *
 
 
+class SquirrelDetections(NamedTuple):
+    """
+    Objects found by SquirrelDetector with confidence above the threshold.\n
+    Boxes are normalized (ymin, xmin, ymax, xmax) rows, as the SSD model outputs them.
+    The object is truthy if at least one squirrel was found.
+    """
+    boxes: np.ndarray
+    scores: np.ndarray
+    class_ids: np.ndarray
+    is_squirrel: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "SquirrelDetections":
+        return cls(boxes=np.empty((0, 4), np.float32), scores=np.empty(0, np.float32),
+                   class_ids=np.empty(0, np.int32), is_squirrel=np.empty(0, bool))
+
+    @property
+    def found(self) -> bool:
+        return bool(self.is_squirrel.any())
+
+    def __bool__(self) -> bool:
+        return self.found
+
+    @property
+    def squirrel_boxes(self) -> np.ndarray:
+        return self.boxes[self.is_squirrel]
+
+    @property
+    def squirrel_scores(self) -> np.ndarray:
+        return self.scores[self.is_squirrel]
+
+
 class SquirrelDetector:
     def __init__(self) -> None:
-        self.interpreter = tflite.Interpreter(model_path=settings.squirrel_model_path)
-        self.interpreter.allocate_tensors()
+        self.interpreter = create_interpreter(settings.squirrel_model_path)
         
         input_details = self.interpreter.get_input_details()
         output_details = self.interpreter.get_output_details()
-        self.width, self.height = input_details[0]["shape"][1:3]
+        self.height, self.width = input_details[0]["shape"][1:3]
+        self.input_spec = InputSpec("RGB", (self.width, self.height))
+        self.input_writer = InputWriter(self.input_spec)
         self.input_index = input_details[0]['index']
         self.boxes_index = output_details[0]['index']
         self.classes_index = output_details[1]['index']
@@ -19,14 +55,44 @@ class SquirrelDetector:
         
         with open(settings.squirrel_labels_path, 'r') as f:
             self.labels = [line.strip() for line in f.readlines()]
+        # Resolve label names once, so detect() only compares class ids
+        self.squirrel_class_ids = np.array([i for i, label in enumerate(self.labels) if label == "squirrel"])
 
 
-    def detect(self, frame) -> bool:
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame_resized = cv2.resize(frame_rgb, (self.width, self.height))
-        input_data = np.expand_dims(frame_resized, axis=0)
+    def detect(self, frame) -> SquirrelDetections:
+        frame = as_preprocessed(frame)
+        detections = self._infer(frame.frame)
+        self._show_preview(frame.frame, detections)
+        return detections
+
+
+    def detect_region(self, frame, roi: np.ndarray) -> SquirrelDetections:
+        """
+        Run detection only on the region of interest of the frame.\n
+        Args:
+            frame: Camera frame
+            roi: Normalized (ymin, xmin, ymax, xmax) region
+        Returns detections with boxes in full frame coordinates
+        """
+        frame = as_preprocessed(frame)
+        height, width = frame.frame.shape[:2]
+        ymin, xmin, ymax, xmax = (roi * [height, width, height, width]).astype(int)
+        crop = frame.frame[ymin:max(ymax, ymin + 1), xmin:max(xmax, xmin + 1)]
+
+        detections = self._infer(crop)
+        # Map boxes from crop coordinates back to the whole frame
+        offset = np.tile(roi[:2], 2)
+        scale = np.tile(roi[2:] - roi[:2], 2)
+        detections = detections._replace(boxes=offset + detections.boxes * scale)
+
+        self._show_preview(frame.frame, detections)
+        return detections
 
-        self.interpreter.set_tensor(self.input_index, input_data)
+
+    def _infer(self, image: np.ndarray) -> SquirrelDetections:
+        """Run the model on a BGR image, it is resized and converted straight into the input tensor."""
+        # The tensor view must be gone before invoke(), tflite refuses to run while its buffers are referenced
+        self.input_writer.write(image, self.interpreter.tensor(self.input_index)()[0])
 
         self.interpreter.invoke()
 
@@ -34,40 +100,46 @@ class SquirrelDetector:
         classes = self.interpreter.get_tensor(self.classes_index)[0]
         scores = self.interpreter.get_tensor(self.scores_index)[0]
 
-        found = False
-        for i in range(len(scores)):
-
-            if ((scores[i] > settings.min_conf_threshhold) and (scores[i] <= 1.0)):
-                if (self.labels[int(classes[i])]) == "squirrel":
-                    found = True
-                    if not settings.show_preview: break
-
-                # if show_preview
-                ymin = int(max(1,(boxes[i][0] * settings.height)))
-                xmin = int(max(1,(boxes[i][1] * settings.width)))
-                ymax = int(min(settings.height,(boxes[i][2] * settings.height)))
-                xmax = int(min(settings.width,(boxes[i][3] * settings.width)))
-                
-                cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), (10, 255, 0), 2)
-
-                object_name = self.labels[int(classes[i])]
-                label = '%s: %d%%' % (object_name, int(scores[i]*100))
-                labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
-                label_ymin = max(ymin, labelSize[1] + 10)
-                cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), (255, 255, 255), cv2.FILLED)
-                cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+        confident = (scores > settings.min_conf_threshhold) & (scores <= 1.0)
+        class_ids = classes[confident].astype(np.int32)
+        return SquirrelDetections(boxes=boxes[confident],
+                                  scores=scores[confident],
+                                  class_ids=class_ids,
+                                  is_squirrel=np.isin(class_ids, self.squirrel_class_ids))
+
 
+    def _show_preview(self, frame, detections: SquirrelDetections) -> None:
         if settings.show_preview:
+            self.draw(frame, detections)
             cv2.imshow('Object detector', frame)
             cv2.waitKey(1)
-        return found
+
+
+    def draw(self, frame, detections: SquirrelDetections) -> None:
+        """Draw boxes and labels of detections on the frame, used for preview."""
+        height, width = frame.shape[:2]
+        for box, score, class_id in zip(detections.boxes, detections.scores, detections.class_ids):
+            ymin = int(max(1,(box[0] * height)))
+            xmin = int(max(1,(box[1] * width)))
+            ymax = int(min(height,(box[2] * height)))
+            xmax = int(min(width,(box[3] * width)))
+
+            cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), (10, 255, 0), 2)
+
+            object_name = self.labels[class_id]
+            label = '%s: %d%%' % (object_name, int(score*100))
+            labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
+            label_ymin = max(ymin, labelSize[1] + 10)
+            cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), (255, 255, 255), cv2.FILLED)
+            cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
 
 
 class CustomSquirrelDetector:
     """Class that uses our own tflite model for detecting squirrels"""
+    threshold = 0.9
+
     def __init__(self) -> None:
-        self.interpreter = tflite.Interpreter(model_path=settings.my_squirrel_model_path)
-        self.interpreter.allocate_tensors()
+        self.interpreter = create_interpreter(settings.my_squirrel_model_path)
 
         self.input_details = self.interpreter.get_input_details()
         self.output_details = self.interpreter.get_output_details()
@@ -77,18 +149,97 @@ class CustomSquirrelDetector:
         self.input_dtype = self.input_details[0]['dtype']
         self.input_index = self.input_details[0]['index']
         self.output_index = self.output_details[0]['index']
+        self.input_spec = InputSpec("RGB", (self.input_width, self.input_height), self.input_dtype)
+        self.input_writer = InputWriter(self.input_spec)
+
+    def score(self, frame) -> float:
+        """Confidence of the classifier that there is a squirrel on the frame."""
+        frame = as_preprocessed(frame)
+        self.input_writer.write(frame.frame, self.interpreter.tensor(self.input_index)()[0])
 
-    def detect(self, frame) -> bool:
-        frame_resized = cv2.resize(frame, (self.input_width, self.input_height))
-        rgb_frame = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
-        input_data = np.expand_dims(rgb_frame, axis=0).astype(self.input_dtype)
-        
-        self.interpreter.set_tensor(self.input_index, input_data)
         self.interpreter.invoke()
         prediction = self.interpreter.get_tensor(self.output_index)
         scores = prediction[0]
         
-        max_score = np.max(scores)
+        max_score = float(np.max(scores))
 
         log.debug(f"Confidence: {max_score}")
-        return max_score > 0.9
+        return max_score
+
+    def detect(self, frame) -> bool:
+        return self.score(frame) > self.threshold
+
+
+class CascadeSquirrelDetector:
+    """
+    Runs the cheap classifier first and the SSD detector only on frames that need it.\n
+    - classifier score below cascade_low_score: no squirrel, the detector is skipped
+    - score above cascade_high_score: squirrel, the detector runs only if boxes are needed,
+      otherwise the whole frame is returned as the squirrel box
+    - score in between: the detector decides
+    Detection in a region of interest always uses the detector, it needs boxes.
+    """
+    def __init__(self, need_boxes: bool=True) -> None:
+        """
+        Args:
+            need_boxes: Whether boxes are used (tracking, preview), so confident classifier
+                        results are escalated to the detector too
+        """
+        self.classifier = CustomSquirrelDetector()
+        self.detector = SquirrelDetector()
+        self.need_boxes = need_boxes
+        self.low_score = settings.cascade_low_score
+        self.high_score = settings.cascade_high_score
+
+        self._stats = {"frames": 0, "rejected": 0, "accepted": 0, "escalated": 0, "detector_found": 0}
+        self._timings = {"classifier": [0, 0.0], "detector": [0, 0.0]} # runs, total seconds
+
+
+    def _timed(self, stage: str, run: Callable, *args):
+        start = time.perf_counter()
+        result = run(*args)
+        self._timings[stage][0] += 1
+        self._timings[stage][1] += time.perf_counter() - start
+        return result
+
+
+    def detect(self, frame) -> SquirrelDetections:
+        frame = as_preprocessed(frame)
+        self._stats["frames"] += 1
+        score = self._timed("classifier", self.classifier.score, frame)
+
+        if score < self.low_score:
+            self._stats["rejected"] += 1
+            return SquirrelDetections.empty()
+
+        if score > self.high_score and not self.need_boxes:
+            self._stats["accepted"] += 1
+            return SquirrelDetections(boxes=np.array([[0.0, 0.0, 1.0, 1.0]], np.float32),
+                                      scores=np.array([score], np.float32),
+                                      class_ids=self.detector.squirrel_class_ids[:1].astype(np.int32),
+                                      is_squirrel=np.array([True]))
+
+        self._stats["escalated"] += 1
+        detections = self._timed("detector", self.detector.detect, frame)
+        if detections:
+            self._stats["detector_found"] += 1
+        return detections
+
+
+    def detect_region(self, frame, roi: np.ndarray) -> SquirrelDetections:
+        return self._timed("detector", self.detector.detect_region, frame, roi)
+
+
+    @property
+    def stats(self) -> dict:
+        """
+        Frames resolved by every stage and mean time of every stage in ms.\n
+        classifier_hit_rate is the fraction of frames decided without the detector.
+        """
+        stats = dict(self._stats)
+        frames = stats["frames"]
+        stats["classifier_hit_rate"] = round((stats["rejected"] + stats["accepted"]) / frames, 3) if frames else 0.0
+        for stage, (runs, total) in self._timings.items():
+            stats[f"{stage}_runs"] = runs
+            stats[f"{stage}_ms"] = round(total / runs * 1000, 1) if runs else 0.0
+        return stats
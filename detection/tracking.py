@@ -0,0 +1,91 @@
+import numpy as np
+from typing import Optional
+from settings.config import settings
+
+
+def iou(box_a: np.ndarray, box_b: np.ndarray) -> float:
+    """Intersection over union of two (ymin, xmin, ymax, xmax) boxes."""
+    ymin, xmin = np.maximum(box_a[:2], box_b[:2])
+    ymax, xmax = np.minimum(box_a[2:], box_b[2:])
+    intersection = max(0.0, ymax - ymin) * max(0.0, xmax - xmin)
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    union = area_a + area_b - intersection
+    return float(intersection / union) if union > 0 else 0.0
+
+
+def centroid_distance(box_a: np.ndarray, box_b: np.ndarray) -> float:
+    center_a = (box_a[:2] + box_a[2:]) / 2
+    center_b = (box_b[:2] + box_b[2:]) / 2
+    return float(np.linalg.norm(center_a - center_b))
+
+
+class SquirrelTracker:
+    """
+    Lightweight tracker of one squirrel between detections.\n
+    Associates new boxes with the tracked one by IoU, or by centroid distance
+    when the squirrel moved too much for the boxes to overlap.
+    Boxes are normalized (ymin, xmin, ymax, xmax) in full frame coordinates.
+    """
+    def __init__(self) -> None:
+        self.box = None
+        self.confidence = 0.0
+        self.frames_since_full = 0
+
+
+    def reset(self) -> None:
+        self.box = None
+        self.confidence = 0.0
+        self.frames_since_full = 0
+
+
+    def update(self, boxes: np.ndarray, scores: np.ndarray, full_frame: bool) -> None:
+        """
+        Update the track with squirrel boxes found on the new frame.\n
+        Args:
+            boxes: Squirrel boxes in full frame coordinates
+            scores: Confidence of every box
+            full_frame: Whether the boxes come from the whole frame or from the region of interest
+        """
+        self.frames_since_full = 0 if full_frame else self.frames_since_full + 1
+
+        if len(boxes) == 0:
+            self.reset()
+            return
+
+        if self.box is None:
+            best = int(np.argmax(scores))
+            self.box, self.confidence = boxes[best], float(scores[best])
+            return
+
+        overlaps = np.array([iou(self.box, box) for box in boxes])
+        best = int(np.argmax(overlaps))
+        if overlaps[best] >= settings.roi_iou_threshold:
+            self.box, self.confidence = boxes[best], float(scores[best])
+            return
+
+        distances = np.array([centroid_distance(self.box, box) for box in boxes])
+        best = int(np.argmin(distances))
+        if distances[best] < settings.roi_max_centroid_distance:
+            # Weaker association, the lower confidence makes full re-detection more likely
+            quality = 1 - distances[best] / settings.roi_max_centroid_distance
+            self.box, self.confidence = boxes[best], float(scores[best]) * quality
+        else:
+            self.reset()
+
+
+    def region_of_interest(self) -> Optional[np.ndarray]:
+        """
+        Get the region around the tracked squirrel to run detection on.\n
+        Returns None when a full frame detection is needed: there is no track,
+        its confidence is too low or full detection wasn't done for too long
+        """
+        if (self.box is None or self.confidence < settings.roi_min_confidence
+                or self.frames_since_full >= settings.roi_full_detection_interval):
+            return None
+
+        height, width = self.box[2:] - self.box[:2]
+        margin_y = max(height * settings.roi_margin, (settings.roi_min_size - height) / 2, 0)
+        margin_x = max(width * settings.roi_margin, (settings.roi_min_size - width) / 2, 0)
+        roi = self.box + np.array([-margin_y, -margin_x, margin_y, margin_x])
+        return np.clip(roi, 0.0, 1.0)
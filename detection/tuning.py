@@ -0,0 +1,121 @@
+import glob
+import os
+import time
+import tracemalloc
+import numpy as np
+from typing import Callable
+from .frame_preprocessing import InputSpec, InputWriter, PreprocessedFrame
+from .interpreter import create_interpreter
+from settings.config import *
+
+
+def benchmark_interpreter(model_path: str, num_threads: int, delegate: str) -> float:
+    """
+    Measure inference time of the model on synthetic frames.\n
+    Returns median time of one invoke() in milliseconds
+    """
+    interpreter = create_interpreter(model_path, num_threads, delegate, fallback=False)
+    input_details = interpreter.get_input_details()[0]
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=input_details["shape"], dtype=np.uint8)
+    interpreter.set_tensor(input_details["index"], frame.astype(input_details["dtype"]))
+
+    for _ in range(settings.tune_warmup_runs):
+        interpreter.invoke()
+
+    timings = []
+    for _ in range(settings.tune_runs):
+        start = time.perf_counter()
+        interpreter.invoke()
+        timings.append(time.perf_counter() - start)
+
+    return float(np.median(timings)) * 1000
+
+
+def _models() -> list:
+    return sorted(glob.glob(os.path.join(os.path.dirname(settings.squirrel_model_path), "*.tflite")))
+
+
+def allocated_per_call(call: Callable, runs: int) -> float:
+    """
+    Measure memory allocated by one call with tracemalloc, numpy and OpenCV arrays are traced.\n
+    The first call is not measured, buffers reused by later calls are allocated there.
+    Returns mean of peak allocated bytes per call
+    """
+    call()
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(runs):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - before
+    finally:
+        tracemalloc.stop()
+    return total / runs
+
+
+def benchmark_input_allocations() -> None:
+    """
+    Compare memory allocated to prepare the model input from a camera frame:
+    converting a copy of the frame and copying it into the interpreter,
+    or writing it with InputWriter straight into the input tensor.
+    """
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(settings.height, settings.width, 3), dtype=np.uint8)
+
+    for model_path in _models():
+        interpreter = create_interpreter(model_path)
+        input_details = interpreter.get_input_details()[0]
+        height, width = input_details["shape"][1:3]
+        spec = InputSpec("RGB", (width, height), input_details["dtype"])
+        writer = InputWriter(spec)
+
+        def copying() -> None:
+            image = PreprocessedFrame(frame).get(spec)
+            interpreter.set_tensor(input_details["index"], np.expand_dims(image, axis=0))
+
+        def direct() -> None:
+            writer.write(frame, interpreter.tensor(input_details["index"])()[0])
+
+        log.info(f"{model_path}: allocated per frame: "
+                 f"copying {allocated_per_call(copying, settings.tune_runs):.0f} bytes, "
+                 f"direct tensor write {allocated_per_call(direct, settings.tune_runs):.0f} bytes")
+
+
+def tune_detectors() -> None:
+    """
+    Benchmark every bundled model with every thread count and delegate
+    and save the fastest configuration.\n
+    Saved configurations are used at startup when tflite_num_threads = 0 and tflite_delegate = "auto".
+    """
+    models = _models()
+    if not models:
+        log.error("No .tflite models found to tune")
+        return
+
+    delegates = ["xnnpack", "none"]
+    if settings.tflite_delegate not in ("auto", "xnnpack", "none"):
+        delegates.append(settings.tflite_delegate)
+
+    for model_path in models:
+        results = {}
+        for delegate in delegates:
+            for num_threads in range(1, (os.cpu_count() or 1) + 1):
+                try:
+                    results[(num_threads, delegate)] = benchmark_interpreter(model_path, num_threads, delegate)
+                except Exception:
+                    log.error(f"Can\'t benchmark {model_path} with {delegate} delegate", exc_info=True)
+                    break
+                log.info(f"{model_path}: threads={num_threads}, delegate={delegate}: "
+                         f"{results[(num_threads, delegate)]:.1f} ms")
+
+        if not results:
+            continue
+        num_threads, delegate = min(results, key=results.get)
+        set_tuned_interpreter_options(model_path, {"num_threads": num_threads, "delegate": delegate})
+        log.info(f"Fastest for {model_path}: threads={num_threads}, delegate={delegate}, "
+                 f"{results[(num_threads, delegate)]:.1f} ms")
@@ -1,10 +1,12 @@
 import time
+from typing import Optional
 
-from camera import Camera
+from camera import Camera, FrameGrabber, FrameView
 from detection import DetectorsHandler
 from servo import Servo
 from video_storage import VideoStorage
 from server_connection import ServerConnection
+from scheduler import DetectionScheduler
 
 from settings.config import *
 
@@ -15,6 +17,9 @@ class SmartFeeder:
     Coordinates interactions between hardware components (camera, servo motor)
     and software systems (computer vision detectors, server connection, video storage).
     """
+    # Detector decisions read in every state, the others are reset when the state is entered
+    STATE_DECISIONS = {"capture": ("squirrel",), "opened": ("hands",), "closed": ("squirrel", "hands")}
+
     def __init__(self) -> None:
         self.camera      = Camera()
 
@@ -27,6 +32,18 @@ class SmartFeeder:
         self.server_conn = ServerConnection(self.camera.start_stream, self.camera.stop_stream)
         self.storage     = VideoStorage(self.server_conn)
         self.detectors   = DetectorsHandler()
+        self.scheduler   = DetectionScheduler()
+
+        # Capture the next frame while the current one is analyzed
+        if settings.pipelined_capture:
+            self.frame_grabber = FrameGrabber(self.camera.get_detection_view, settings.frame_max_age)
+            self.frame_grabber.start()
+        else:
+            self.frame_grabber = None
+
+        self._last_stats_log = time.monotonic()
+        self._last_state = None
+        self._no_frame_delay = 0.0
         log.info("Smart feeder init")
 
 
@@ -35,11 +52,14 @@ class SmartFeeder:
         Release all resources and cleanup components.
         Must be called when the system is shutting down or in case of errors.
         """
+        if self.frame_grabber:
+            self.frame_grabber.stop()
         self.camera.cleanup()
         if self.servo:
             self.servo.cleanup()
         self.storage.cleanup()
         self.server_conn.cleanup()
+        self.detectors.cleanup()
 
 
     def work(self) -> None:
@@ -53,57 +73,138 @@ class SmartFeeder:
         The feeder operates in one of three states:
         1. Capturing video, when a squirrel is detected
         2. Cover opened, not squirrel but hands detected
-        3. Cover closed, default state
+        3. Cover closed, default state\n
+        The frame may be a view of the camera buffer, it is released before waiting.
+        Then waits for the interval chosen by the scheduler for the new state.
         """
-        self.detectors.update_frame(self.camera.get_frame())
-        log.debug("Next iteration")
-        
+        frame = self._next_frame()
+        if frame is None:
+            self._wait_for_frame()
+            return
+        self._no_frame_delay = 0.0
+        try:
+            self.detectors.update_frame(frame.array)
+            log.debug("Next iteration")
+
+            state = self._state()
+            if state != self._last_state:
+                self.detectors.reset_decisions([name for name in ("squirrel", "hands")
+                                                if name not in self.STATE_DECISIONS[state]])
+                self._last_state = state
+            if state == "capture":
+                detected = self._handle_capture()
+            elif state == "opened":
+                detected = self._handle_cover_opened()
+            else:
+                detected = self._handle_cover_closed()
+        finally:
+            self.detectors.release_frame()
+            frame.release()
+
+        self._log_stats()
+        time.sleep(self.scheduler.next_interval(self._state(), detected or self.detectors.motion))
+
+
+    def _state(self) -> str:
+        """Get the current state of the feeder, one of DetectionScheduler.STATES."""
         if self.camera.capturing:
-            self._handle_capture()
-        elif self.servo and self.servo.cover_opened:
-            self._handle_cover_opened()
-        else:
-            self._handle_cover_closed()
+            return "capture"
+        if self.servo and self.servo.cover_opened:
+            return "opened"
+        return "closed"
+
 
-        
+    def _next_frame(self) -> Optional[FrameView]:
+        """Get the newest frame from the frame grabber or capture it directly."""
+        if self.frame_grabber:
+            frame, _ = self.frame_grabber.get_latest(timeout=settings.frame_timeout)
+            return frame
+        return self.camera.get_detection_view()
 
 
-    def _handle_capture(self) -> None:
-        """Handle the state when the system is capturing video."""
-        if not self.detectors.detect_squirrel():
+    def _wait_for_frame(self) -> None:
+        """
+        Back off while there are no frames, e.g. the frame grabber is stopped or the camera fails.\n
+        The delay grows from min_detection_interval up to idle_max_interval, so the loop doesn't spin.
+        """
+        if not self._no_frame_delay:
+            log.warning("No frame from the camera")
+        self._no_frame_delay = min(max(self._no_frame_delay * settings.idle_backoff_factor,
+                                       settings.min_detection_interval),
+                                   settings.idle_max_interval)
+        time.sleep(self._no_frame_delay)
+
+
+    def _log_stats(self) -> None:
+        """Periodically log performance counters of components."""
+        now = time.monotonic()
+        if now - self._last_stats_log < settings.stats_log_interval:
+            return
+        self._last_stats_log = now
+        log.info(f"Detectors stats: {self.detectors.stats}")
+        log.info(f"Scheduler stats: {self.scheduler.stats}")
+        log.info(f"Recording stats: {self.camera.recording_stats}")
+        log.info(f"Upload stats: {self.storage.stats}")
+        if self.frame_grabber:
+            log.info(f"Frame grabber stats: {self.frame_grabber.stats}")
+
+
+    def _handle_capture(self) -> bool:
+        """
+        Handle the state when the system is capturing video.\n
+        Returns True if the squirrel is still detected
+        """
+        squirrel = self.detectors.detect_squirrel()
+        self.storage.add_confidence(self.detectors.squirrel_confidence)
+        if not squirrel:
             self.camera.stop_capture()
             if self.servo:
                 self.servo.close_cover()
             self.storage.go_to_next_video() # Prepare for next video and upload current
-        else:
-            log.info("Capture continues")
-            time.sleep(settings.sleep_time)
+            return False
+
+        if settings.enable_segmented_recording:
+            self.storage.upload_finished_segments()
+        log.info("Capture continues")
+        return True
 
 
-    def _handle_cover_opened(self) -> None:
-        """Handle the state when the feeder cover is open."""
+    def _handle_cover_opened(self) -> bool:
+        """
+        Handle the state when the feeder cover is open.\n
+        Returns True if hands are still detected
+        """
         if not self.detectors.detect_hands():
             if self.servo:
                 self.servo.close_cover()
-        else:
-            log.info("Cover is still open")
-            time.sleep(settings.sleep_time)
+            return False
+
+        log.info("Cover is still open")
+        return True
 
 
-    def _handle_cover_closed(self) -> None:
+    def _handle_cover_closed(self) -> bool:
         """
         Handle the default state when the feeder cover is closed.\n
         If hands are detected it will open the feeder cover.\n
         If a squirrel is detected it will open the feeder cover
-        and start video recording
+        and start video recording.\n
+        Both detectors are run concurrently, hands have priority.
+        Returns True if anything was detected
         """
-        if self.detectors.detect_hands():
+        detected = self.detectors.detect_all()
+        if detected.hands:
             if self.servo:
                 self.servo.open_cover()
-            time.sleep(settings.sleep_time)
 
-        elif self.detectors.detect_squirrel():
+        elif detected.squirrel:
             if self.servo:
                 self.servo.open_cover()
-            self.camera.capture_video(self.storage.get_new_video_name())
-            time.sleep(settings.sleep_time)
+            self.storage.start_visit()
+            self.storage.add_confidence(self.detectors.squirrel_confidence)
+            if settings.enable_segmented_recording:
+                self.camera.capture_video(self.storage.get_segment_pattern(), self.storage.get_manifest_name())
+            else:
+                self.camera.capture_video(self.storage.get_new_video_name())
+
+        return detected.hands or detected.squirrel
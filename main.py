@@ -1,7 +1,7 @@
 import signal
 import sys
 from feeder import SmartFeeder
-from settings.config import log
+from settings.config import log, settings
 
 
 # Keeping it global allows access from the signal handler
@@ -25,6 +25,21 @@ if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
+    if settings.tune_detector:
+        from detection.tuning import tune_detectors
+        tune_detectors()
+        sys.exit(0)
+
+    if settings.benchmark_input:
+        from detection.tuning import benchmark_input_allocations
+        benchmark_input_allocations()
+        sys.exit(0)
+
+    if settings.benchmark_upload:
+        from uploader import benchmark_upload_memory
+        benchmark_upload_memory()
+        sys.exit(0)
+
     try:
         feeder = SmartFeeder()
         feeder.work()
@@ -0,0 +1,51 @@
+from settings.config import *
+
+
+class DetectionScheduler:
+    """
+    Chooses the interval before the next detection based on the feeder state and recent activity.\n
+    - Closed cover: fast polling right after motion or a detection,
+      exponential backoff up to idle_max_interval while nothing happens
+    - Opened cover and capturing: bounded re-check interval
+    """
+    STATES = ("closed", "opened", "capture")
+
+    def __init__(self) -> None:
+        if settings.min_detection_interval <= 0:
+            raise ValueError("min_detection_interval must be positive for backoff to work")
+        self.interval = settings.min_detection_interval
+        self.state = "closed"
+
+
+    def next_interval(self, state: str, activity: bool) -> float:
+        """
+        Get the time to wait before the next detection.\n
+        Args:
+            state: Current feeder state, one of STATES
+            activity: Whether motion or any object was detected on the last frame
+        Returns interval in seconds
+        """
+        if state not in self.STATES:
+            raise ValueError(f"Unknown feeder state: {state}")
+
+        if state == "capture":
+            interval = settings.capture_check_interval
+        elif state == "opened":
+            interval = settings.opened_check_interval
+        elif activity or self.state != "closed":
+            # React fast to whatever happens right after motion or after the cover was closed
+            interval = settings.min_detection_interval
+        else:
+            interval = min(self.interval * settings.idle_backoff_factor, settings.idle_max_interval)
+
+        self.state = state
+        self.interval = max(interval, settings.min_detection_interval)
+        return self.interval
+
+
+    @property
+    def stats(self) -> dict:
+        """Current state, detection interval and rate of detections per second."""
+        return {"state": self.state,
+                "interval": round(self.interval, 3),
+                "rate": round(1 / self.interval, 2)}
@@ -1,17 +1,27 @@
 import RPi.GPIO as GPIO
+import queue
+import threading
 from time import sleep
+from typing import Optional
 
 from settings.config import *
 
 
 class Servo:
-    """Controls the servo motor that operates the feeder cover.\n"""
+    """
+    Controls the servo motor that operates the feeder cover.\n
+    Movements are done by a dedicated motion thread, so open_cover and close_cover
+    return immediately and frames are analyzed while the cover moves.
+    A new command interrupts the current movement, e.g. closing cover is reversed
+    if it is opened again.
+    """
     def __init__(self) -> None:
         self.pin = settings.servo_pin
 
         speed = {"slow": 0.07, "medium": 0.055, "fast": 0.045}
         self.speed = speed[settings.servo_speed]
         self.angle = None
+        self.target_angle = None
         self.cover_opened = None
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(self.pin, GPIO.OUT)
@@ -19,50 +29,104 @@ class Servo:
         self.pwm = GPIO.PWM(self.pin, 50)
         self.pwm.start(0)
 
+        self._commands = queue.Queue()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._lock = threading.Lock() # keeps idle flag consistent with the queue
+
         self.close_cover(True)
 
+        self._thread = threading.Thread(target=self._motion_loop, daemon=True, name="servo")
+        self._thread.start()
+
 
     def cleanup(self) -> None:
         """
-        Release resources of GPIO.\n
+        Stop the motion thread and release resources of GPIO.\n
+        The current movement is finished first, so the cover is left fully opened or closed.
         Must be called when shutting down to prevent issues and to free GPIO resources.
         """
+        self._commands.put(None)
+        self._thread.join(timeout=5)
         self.pwm.stop()
         GPIO.cleanup(self.pin)
 
 
+    @property
+    def moving(self) -> bool:
+        return not self._idle.is_set()
+
+
+    def wait_motion(self, timeout: Optional[float]=None) -> bool:
+        """Wait until the cover stops, returns False on timeout."""
+        return self._idle.wait(timeout)
+
+
     def set_angle(self, angle: int, first: bool=False) -> None:
         """
         Set the servo to a specific angle.\n
-        For the first movement, the servo moves directly to the position.
-        For subsequent movements, the servo moves step by step for smoother motion.\n
+        For the first movement, the servo moves directly to the position and the call blocks.
+        Subsequent movements are sent to the motion thread,
+        where the servo moves step by step for smoother motion.\n
         Args:
             angle: Target angle (0-180 degrees)
             first: Whether this is the first movement (True) or a regular movement (False)
         """
+        self.target_angle = angle
         if first:
             duty_cycle = 2.5 + (angle / 18)
             self.pwm.ChangeDutyCycle(duty_cycle)
             sleep(0.5)
             self.angle = angle
+            self.pwm.ChangeDutyCycle(0)
         else:
-            duty_cycle = 2 + (self.angle / 18)
-            step = 5 if angle > self.angle else -5
-            while self.angle != angle:
-                self.pwm.ChangeDutyCycle(2.5 + (self.angle / 18))
-                sleep(self.speed)
-                self.angle += step
+            with self._lock:
+                self._idle.clear()
+                self._commands.put(angle)
+
+
+    def _motion_loop(self) -> None:
+        """Move the servo towards the latest commanded angle one step at a time."""
+        target = None
+        stopping = False
+        while not (stopping and target is None):
+            try:
+                # Block only when there is nothing to do, otherwise just check for a new command
+                command = self._commands.get(block=target is None)
+            except queue.Empty:
+                pass
+            else:
+                if command is None:
+                    # Finish the current movement before stopping
+                    stopping = True
+                    continue
+                target = command
+
+            if self.angle == target:
+                self.pwm.ChangeDutyCycle(0)
+                target = None
+                with self._lock:
+                    if self._commands.empty():
+                        self._idle.set()
+                continue
+
+            step = min(5, abs(target - self.angle))
+            step = step if target > self.angle else -step
+            self.pwm.ChangeDutyCycle(2.5 + (self.angle / 18))
+            sleep(self.speed)
+            self.angle += step
 
         self.pwm.ChangeDutyCycle(0)
+        self._idle.set()
 
 
     def open_cover(self, first: bool=False) -> None:
         self.set_angle(settings.open_angle, first)
         self.cover_opened = True
-        log.info("Cover opened")
+        log.info("Cover opening" if self.moving else "Cover opened")
 
 
     def close_cover(self, first: bool=False) -> None:
         self.set_angle(settings.close_angle, first)
         self.cover_opened = False
-        log.info("Cover closed")
+        log.info("Cover closing" if self.moving else "Cover closed")
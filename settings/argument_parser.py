@@ -24,6 +24,96 @@ parser.add_argument(
     help='minimum confidence threshhold for squirrel detection model'
 )
 
+parser.add_argument(
+    '--squirrel-detector',
+    choices=["ssd", "classifier", "cascade"],
+    default=settings.squirrel_detector,
+    help='squirrel model: ssd detector, classifier or classifier with ssd for uncertain frames'
+)
+
+parser.add_argument(
+    '--tflite-threads',
+    type=int, default=settings.tflite_num_threads,
+    help='number of threads used by tflite interpreters, 0 for tuned or default value',
+    dest='tflite_num_threads'
+)
+
+parser.add_argument(
+    '--tflite-delegate',
+    type=str, default=settings.tflite_delegate,
+    help='tflite delegate: auto, xnnpack, none or path to a delegate library'
+)
+
+parser.add_argument(
+    '--tune-detector',
+    default=False,
+    action='store_true',
+    help='benchmark detection models with different interpreter options, save the fastest and exit',
+)
+
+parser.add_argument(
+    '--benchmark-input',
+    default=False,
+    action='store_true',
+    help='measure memory allocated to prepare detection model inputs and exit',
+)
+
+parser.add_argument(
+    '--benchmark-upload',
+    default=False,
+    action='store_true',
+    help='measure peak memory of video uploads to a local test server and exit',
+)
+
+parser.add_argument(
+    '--disable-motion-gate',
+    action='store_false',
+    default=settings.enable_motion_gate,
+    help='run detectors on every frame even if nothing moved',
+    dest='enable_motion_gate'
+)
+
+parser.add_argument(
+    '--motion-threshold',
+    type=float, default=settings.motion_threshold,
+    help='fraction of changed thumbnail pixels that counts as motion'
+)
+
+parser.add_argument(
+    '--sequential-detection',
+    action='store_false',
+    default=settings.parallel_detection,
+    help='run hands and squirrel detectors one after another',
+    dest='parallel_detection'
+)
+
+parser.add_argument(
+    '--detection-mode',
+    choices=["threads", "processes"],
+    default=settings.detection_mode,
+    help='run detectors in the feeder process or in worker processes'
+)
+
+parser.add_argument(
+    '--squirrel-exit-votes',
+    type=int, default=settings.squirrel_exit_votes,
+    help='number of negative squirrel detections of the vote window needed to stop recording'
+)
+
+parser.add_argument(
+    '--disable-roi-tracking',
+    action='store_false',
+    default=settings.enable_roi_tracking,
+    help='always run squirrel detection on the whole frame',
+    dest='enable_roi_tracking'
+)
+
+parser.add_argument(
+    '--roi-full-detection-interval',
+    type=int, default=settings.roi_full_detection_interval,
+    help='number of region detections between full frame squirrel detections'
+)
+
 parser.add_argument(
     '--servo-pin',
     type=int, default=settings.servo_pin,
@@ -72,6 +162,39 @@ parser.add_argument(
     dest='online_mode'
 )
 
+parser.add_argument(
+    '--disable-resumable-upload',
+    default=settings.enable_resumable_upload,
+    action='store_false',
+    help='send whole videos in one request instead of resumable chunks',
+    dest='enable_resumable_upload'
+)
+
+parser.add_argument(
+    '--upload-chunk-size',
+    type=int, default=settings.upload_chunk_size,
+    help='bytes sent in one request of a resumable upload'
+)
+
+parser.add_argument(
+    '--upload-workers',
+    type=int, default=settings.upload_workers,
+    help='number of videos uploaded in parallel'
+)
+
+parser.add_argument(
+    '--upload-bandwidth-limit',
+    type=int, default=settings.upload_bandwidth_limit,
+    help='total upload rate in bytes per second, 0 for no limit'
+)
+
+parser.add_argument(
+    '--upload-priority',
+    choices=["newest", "confidence", "smallest", "oldest"],
+    default=settings.upload_priority,
+    help='which recorded videos are uploaded first'
+)
+
 parser.add_argument(
     '--width',
     type=int, default=settings.width,
@@ -84,6 +207,26 @@ parser.add_argument(
     help='height of video frame'
 )
 
+parser.add_argument(
+    '--disable-lores',
+    action='store_false',
+    default=settings.enable_lores_stream,
+    help='run detectors on full resolution frames instead of the lores stream',
+    dest='enable_lores_stream'
+)
+
+parser.add_argument(
+    '--lores-width',
+    type=int, default=settings.lores_width,
+    help='width of lores frame used for detection'
+)
+
+parser.add_argument(
+    '--lores-height',
+    type=int, default=settings.lores_height,
+    help='height of lores frame used for detection'
+)
+
 parser.add_argument(
     "--log-level", default=settings.log_level,
     help="Change log level")
@@ -124,6 +267,83 @@ parser.add_argument(
     help='Framerate of video and stream',
 )
 
+parser.add_argument(
+    '--disable-zero-copy',
+    action='store_false',
+    default=settings.zero_copy_frames,
+    help='copy every detection frame instead of reading the camera buffer',
+    dest='zero_copy_frames'
+)
+
+parser.add_argument(
+    '--idle-max-interval',
+    type=float, default=settings.idle_max_interval,
+    help='maximum interval in seconds between detections while nothing happens'
+)
+
+parser.add_argument(
+    '--capture-check-interval',
+    type=float, default=settings.capture_check_interval,
+    help='interval in seconds between squirrel checks while recording'
+)
+
+parser.add_argument(
+    '--disable-pipeline',
+    action='store_false',
+    default=settings.pipelined_capture,
+    help='capture frames in the main loop instead of a background thread',
+    dest='pipelined_capture'
+)
+
+parser.add_argument(
+    '--preroll-seconds',
+    type=float, default=settings.preroll_seconds,
+    help='seconds of video before the detection added to recordings'
+)
+
+parser.add_argument(
+    '--disable-preroll',
+    action='store_false',
+    default=settings.enable_preroll,
+    help='start recording encoder only when a squirrel is detected',
+    dest='enable_preroll'
+)
+
+parser.add_argument(
+    '--disable-ffmpeg-prewarm',
+    action='store_false',
+    default=settings.enable_ffmpeg_prewarm,
+    help='spawn ffmpeg only when a recording starts',
+    dest='enable_ffmpeg_prewarm'
+)
+
+parser.add_argument(
+    '--writer-queue-bytes',
+    type=int, default=settings.writer_queue_bytes,
+    help='size of the queue of frames written to ffmpeg, 0 to write from the encoder thread'
+)
+
+parser.add_argument(
+    '--writer-full-policy',
+    choices=["block", "drop_non_keyframes", "drop_until_keyframe"],
+    default=settings.writer_full_policy,
+    help='what to do with new frames when the ffmpeg writer queue is full'
+)
+
+parser.add_argument(
+    '--segmented-recording',
+    action='store_true',
+    default=settings.enable_segmented_recording,
+    help='record visits as short segments uploaded while the visit continues',
+    dest='enable_segmented_recording'
+)
+
+parser.add_argument(
+    '--segment-duration',
+    type=float, default=settings.segment_duration,
+    help='duration of recorded segments in seconds'
+)
+
 parser.add_argument(
     '--show-preview',
     default=settings.show_preview,
@@ -51,6 +51,25 @@ def set_feeder_id(feeder_id: str) -> None:
         raise RuntimeError("Ошибка сохранения id")
 
 
+def get_tuned_interpreter_options(model_path: str) -> Optional[dict]:
+    """Get interpreter options saved by --tune-detector for the model."""
+    try:
+        with shelve.open("./settings/detector_tuning") as tuning:
+            return tuning.get(model_path)
+    except Exception:
+        log.error("Error while getting tuned interpreter options", exc_info=True)
+        return None
+
+
+def set_tuned_interpreter_options(model_path: str, options: dict) -> None:
+    try:
+        with shelve.open("./settings/detector_tuning") as tuning:
+            tuning[model_path] = options
+        log.info(f"Saved interpreter options for {model_path}: {options}")
+    except Exception as e:
+        log.error(f"Error while saving tuned interpreter options: {e}")
+
+
 def get_socket_address() -> str:
     """Get the socket address for connections"""
     if settings.mode == "production":
@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 from unittest.mock import MagicMock, patch
 from camera.camera import Camera
 
@@ -20,6 +21,13 @@ def mock_encoder():
         yield mock_encoder
 
 
+@pytest.fixture(autouse=True)
+def mock_ffmpeg_pool():
+    with patch('camera.camera.FfmpegPool') as mock_pool_class:
+        mock_pool = mock_pool_class.return_value
+        yield mock_pool
+
+
 @pytest.fixture
 def mock_mode_controller():
     with patch('camera.camera.CameraModeController') as mock_controller_class:
@@ -38,6 +46,7 @@ def mock_settings():
         mock_settings.format = "RGB888"
         mock_settings.bitrate = 10000000
         mock_settings.enable_camera_mode_control = True
+        mock_settings.enable_preroll = False
         yield mock_settings
 
 
@@ -49,8 +58,8 @@ class TestCamera:
         assert camera._picam == mock_picamera
         assert mock_picamera.start.called
         assert mock_picamera.configure.called
-        assert camera._capture_encoder is not None
-        assert camera._stream_encoder is not None
+        assert camera._encoder is not None
+        assert camera._encoder.output is camera._output
 
 
     @patch('camera.camera.exit', side_effect=RuntimeError)
@@ -95,23 +104,86 @@ class TestCamera:
         assert mock_picamera.capture_array.called
 
 
-    def test_capture_video(self, mock_settings, mock_picamera, mock_encoder):
+    def test_configure_lores_stream(self, mock_settings, mock_picamera):
+        mock_settings.enable_lores_stream = True
+        mock_settings.lores_width = 320
+        mock_settings.lores_height = 240
+        mock_settings.lores_format = "YUV420"
+
+        Camera()
+
+        call_args = mock_picamera.create_video_configuration.call_args
+        assert call_args[1]['lores'] == {"size": [320, 240], "format": "YUV420"}
+
+
+    def test_configure_without_lores_stream(self, mock_settings, mock_picamera):
+        mock_settings.enable_lores_stream = False
+
+        Camera()
+
+        call_args = mock_picamera.create_video_configuration.call_args
+        assert call_args[1]['lores'] is None
+
+
+    def test_get_detection_frame_from_lores(self, mock_settings, mock_picamera, mock_encoder):
+        mock_settings.enable_lores_stream = True
+        mock_settings.lores_format = "YUV420"
+
+        with patch('camera.camera.cv2') as mock_cv2:
+            camera = Camera()
+            frame = camera.get_detection_frame()
+
+            mock_picamera.capture_array.assert_called_once_with("lores")
+            assert mock_cv2.cvtColor.called
+            assert frame == mock_cv2.cvtColor.return_value
+
+
+    def test_get_detection_frame_without_lores(self, mock_settings, mock_picamera, mock_encoder):
+        mock_settings.enable_lores_stream = False
+
+        camera = Camera()
+        frame = camera.get_detection_frame()
+
+        mock_picamera.capture_array.assert_called_once_with()
+        assert frame == mock_picamera.capture_array.return_value
+
+
+    def test_capture_video(self, mock_settings, mock_picamera, mock_encoder, mock_ffmpeg_pool):
+        camera = Camera()
+        camera.capture_video("test.mp4")
+
+        assert mock_ffmpeg_pool.acquire.call_args[0][0] == "test.mp4"
+        assert mock_ffmpeg_pool.acquire.return_value.start.called
+        assert mock_picamera.start_encoder.called
+
+
+    def test_capture_video_segmented(self, mock_settings, mock_picamera, mock_encoder, mock_ffmpeg_pool):
+        mock_settings.segment_duration = 10
+
         with patch('camera.camera.CaptureAndStreamOutput') as mock_output:
             camera = Camera()
-            camera.capture_video("test.mp4")
+            camera.capture_video("videos/0_%03d.mp4", "videos/0.csv")
 
-            assert mock_output.called
-            assert mock_output.call_args[0][0] == "test.mp4"
-            assert mock_picamera.start_encoder.called
+            target = mock_output.call_args[0][0]
+            assert "-f segment -segment_time 10" in target
+            assert "-segment_list videos/0.csv" in target
+            assert target.endswith("videos/0_%03d.mp4")
+            assert not mock_ffmpeg_pool.acquire.called
+            assert camera.capturing
 
 
-    def test_stop_capture(self, mock_settings, mock_picamera, mock_encoder):
-        mock_encoder.running = True
+    def test_stop_capture(self, mock_settings, mock_picamera, mock_encoder, mock_ffmpeg_pool):
+        output = mock_ffmpeg_pool.acquire.return_value
 
         camera = Camera()
+        camera.capture_video("test.mp4")
+        mock_encoder.running = True
         camera.stop_capture()
 
+        assert output.stop.called
+        mock_ffmpeg_pool.release.assert_called_once_with(output)
         assert mock_picamera.stop_encoder.called
+        assert not camera.capturing
 
 
     def test_start_stream(self, mock_settings, mock_picamera, mock_encoder):
@@ -130,9 +202,106 @@ class TestCamera:
 
 
     def test_stop_stream_when_running(self, mock_settings, mock_picamera, mock_encoder):
+        with patch('camera.camera.CaptureAndStreamOutput'):
+            camera = Camera()
+            camera.start_stream(8554, "test_path")
+            mock_encoder.running = True
+            camera.stop_stream()
+
+            assert mock_picamera.stop_encoder.called
+            assert not camera.streaming
+
+
+    def test_cleanup_stops_ffmpeg_pool(self, mock_settings, mock_picamera, mock_encoder, mock_ffmpeg_pool):
+        camera = Camera()
+        camera.cleanup()
+
+        assert mock_ffmpeg_pool.cleanup.called
+
+
+    def test_stream_during_capture_shares_encoder(self, mock_settings, mock_picamera, mock_encoder):
+        mock_settings.server_host = "192.168.1.1"
+
+        with patch('camera.camera.CaptureAndStreamOutput'):
+            camera = Camera()
+            camera.capture_video("test.mp4")
+            mock_encoder.running = True
+            camera.start_stream(8554, "test_path")
+
+            assert mock_picamera.start_encoder.call_count == 1
+            assert camera.capturing and camera.streaming
+
+            camera.stop_stream()
+
+            assert not mock_picamera.stop_encoder.called
+            assert camera.capturing
+
+
+    def test_preroll_starts_encoder_on_init(self, mock_settings, mock_picamera, mock_encoder):
+        mock_settings.enable_preroll = True
+        mock_settings.preroll_seconds = 3
+
+        camera = Camera()
+
+        assert mock_picamera.start_encoder.called
+        assert not camera.capturing
+
+
+    def test_capture_video_with_preroll(self, mock_settings, mock_picamera, mock_encoder, mock_ffmpeg_pool):
+        mock_settings.enable_preroll = True
+        mock_settings.preroll_seconds = 3
+        mock_settings.audio_sync = -0.3
+        mock_settings.fps = 20
+        output = mock_ffmpeg_pool.acquire.return_value
+
+        camera = Camera()
         mock_encoder.running = True
+        mock_picamera.start_encoder.reset_mock()
+        camera.capture_video("test.mp4")
+
+        assert mock_ffmpeg_pool.acquire.call_args[0][0] == "test.mp4"
+        assert mock_ffmpeg_pool.acquire.call_args[1]['framerate'] == 20
+        assert output.start.called
+        assert not mock_picamera.start_encoder.called
+        assert camera.capturing
+
+        camera.stop_capture()
+
+        assert output.stop.called
+        assert not mock_picamera.stop_encoder.called
+        assert not camera.capturing
+
+
+    def test_get_detection_view_zero_copy(self, mock_settings, mock_picamera, mock_encoder):
+        mock_settings.zero_copy_frames = True
+        mock_settings.show_preview = False
+        mock_settings.enable_lores_stream = False
+        request = mock_picamera.capture_request.return_value
+
+        with patch('camera.frame_view.MappedArray') as mock_mapped:
+            mock_mapped.return_value.__enter__.return_value.array = np.zeros((480, 640, 4), dtype=np.uint8)
+            camera = Camera()
+            view = camera.get_detection_view()
+
+            mock_mapped.assert_called_once_with(request, "main")
+            assert view.zero_copy
+            assert view.array.shape == (480, 640, 3)
+            assert not request.release.called
+
+            view.release()
+            view.release()
+
+            request.release.assert_called_once()
+
+
+    def test_get_detection_view_copies_for_preview(self, mock_settings, mock_picamera, mock_encoder):
+        mock_settings.zero_copy_frames = True
+        mock_settings.show_preview = True
+        mock_settings.enable_lores_stream = False
 
         camera = Camera()
-        camera.stop_stream()
+        view = camera.get_detection_view()
 
-        assert mock_picamera.stop_encoder.called
+        assert not view.zero_copy
+        assert not mock_picamera.capture_request.called
+        assert view.array is mock_picamera.capture_array.return_value
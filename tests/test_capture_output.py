@@ -0,0 +1,116 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+from camera.picamera2_fix.CaptureAndStreamOutput import CaptureAndStreamOutput
+
+
+class StalledStdin:
+    """ffmpeg stdin that blocks writes until released."""
+    def __init__(self):
+        self.released = threading.Event()
+        self.frames = []
+
+    def write(self, frame):
+        self.released.wait(timeout=5)
+        self.frames.append(frame)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.released.set()
+
+
+def started_output(policy, max_queue_bytes=10):
+    output = CaptureAndStreamOutput("test.mp4", max_queue_bytes=max_queue_bytes, full_policy=policy)
+    output.ffmpeg = MagicMock()
+    output.ffmpeg.stdin = StalledStdin()
+    output.start()
+    return output
+
+
+class TestCaptureAndStreamOutputWriter:
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            CaptureAndStreamOutput("test.mp4", full_policy="unknown")
+
+
+    def test_direct_write_without_queue(self):
+        output = CaptureAndStreamOutput("test.mp4")
+        output.ffmpeg = MagicMock()
+        output.start()
+
+        output.outputframe(b"frame", keyframe=True, timestamp=0)
+
+        output.ffmpeg.stdin.write.assert_called_once_with(b"frame")
+        assert output.stats["written_frames"] == 1
+        assert output.first_frame_latency is not None
+
+
+    def test_queued_frames_are_flushed_on_stop(self):
+        output = started_output("block", max_queue_bytes=100)
+        stdin = output.ffmpeg.stdin
+        stdin.released.set()
+
+        for i in range(5):
+            output.outputframe(b"frame%d" % i, keyframe=(i == 0), timestamp=i)
+        output.stop()
+
+        assert stdin.frames == [b"frame%d" % i for i in range(5)]
+
+
+    def test_drop_until_keyframe_when_stalled(self):
+        output = started_output("drop_until_keyframe")
+        stdin = output.ffmpeg.stdin
+
+        # The first frame is taken by the stalled writer, the next ones fill the queue
+        output.outputframe(b"key00", keyframe=True, timestamp=0)
+        while output._queue:
+            pass
+        output.outputframe(b"frm01", keyframe=False, timestamp=1)
+        output.outputframe(b"frm02", keyframe=False, timestamp=2)
+        output.outputframe(b"frm03", keyframe=False, timestamp=3)
+        stdin.released.set()
+        while output._queue:
+            pass
+        # Queue has space again, but frames referencing the dropped one are skipped
+        output.outputframe(b"frm04", keyframe=False, timestamp=4)
+        output.outputframe(b"key05", keyframe=True, timestamp=5)
+        output.stop()
+
+        assert stdin.frames == [b"key00", b"frm01", b"frm02", b"key05"]
+        assert output.stats["dropped_frames"] == 2
+
+
+    def test_drop_non_keyframes_keeps_keyframes(self):
+        output = started_output("drop_non_keyframes")
+        stdin = output.ffmpeg.stdin
+
+        output.outputframe(b"key00", keyframe=True, timestamp=0)
+        while output._queue:
+            pass
+        output.outputframe(b"frm01", keyframe=False, timestamp=1)
+        output.outputframe(b"frm02", keyframe=False, timestamp=2)
+        output.outputframe(b"frm03", keyframe=False, timestamp=3)
+        output.outputframe(b"key04", keyframe=True, timestamp=4)
+
+        assert output.stats["max_queued_bytes"] == 15
+        stdin.released.set()
+        output.stop()
+
+        assert stdin.frames == [b"key00", b"frm01", b"frm02", b"key04"]
+        assert output.stats["dropped_frames"] == 1
+
+
+    def test_broken_pipe_stops_writer(self):
+        output = started_output("block", max_queue_bytes=100)
+        output.ffmpeg.stdin = MagicMock()
+        output.ffmpeg.stdin.write.side_effect = BrokenPipeError
+        output.error_callback = MagicMock()
+
+        output.outputframe(b"frame", keyframe=True, timestamp=0)
+        output.stop()
+
+        assert output.error_callback.called
+        assert output.ffmpeg is None
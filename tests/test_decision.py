@@ -0,0 +1,52 @@
+import pytest
+from detection.decision import VotingDecision
+
+
+class TestVotingDecision:
+
+    def test_enter_after_enough_positive_votes(self):
+        decision = VotingDecision(window=5, enter_votes=2, exit_votes=3)
+
+        assert not decision.update(True)
+        assert decision.update(True)
+        assert decision.enters == 1
+
+
+    def test_single_negative_does_not_exit(self):
+        decision = VotingDecision(window=5, enter_votes=1, exit_votes=3)
+        decision.update(True)
+
+        assert decision.update(False)
+        assert decision.update(True)
+        assert decision.update(False)
+        assert decision.exits == 0
+        assert decision.suppressed == 2
+
+
+    def test_exit_after_enough_negative_votes(self):
+        decision = VotingDecision(window=5, enter_votes=1, exit_votes=3)
+        decision.update(True)
+
+        results = [decision.update(False) for _ in range(3)]
+
+        assert results == [True, True, False]
+        assert decision.stats == {"enters": 1, "exits": 1, "suppressed": 2}
+
+
+    def test_votes_are_reset_on_transition(self):
+        decision = VotingDecision(window=5, enter_votes=1, exit_votes=2)
+        decision.update(True)
+        decision.update(True)
+        decision.update(False)
+        assert not decision.update(False)
+
+        # the positive vote before the exit must not enter again
+        assert not decision.update(False)
+        assert decision.enters == 1
+
+
+    def test_invalid_votes(self):
+        with pytest.raises(ValueError):
+            VotingDecision(window=3, enter_votes=4, exit_votes=1)
+        with pytest.raises(ValueError):
+            VotingDecision(window=3, enter_votes=1, exit_votes=0)
@@ -0,0 +1,288 @@
+import threading
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from detection.detectors_handler import DetectionResult, DetectorsHandler
+from detection.frame_preprocessing import InputSpec, PreprocessedFrame
+from detection.squirrel_detection import SquirrelDetections
+
+
+def squirrel(found: bool, box=(0.2, 0.2, 0.4, 0.4), score=0.8) -> SquirrelDetections:
+    if not found:
+        return SquirrelDetections.empty()
+    return SquirrelDetections(boxes=np.array([box], np.float32), scores=np.array([score], np.float32),
+                              class_ids=np.array([0], np.int32), is_squirrel=np.array([True]))
+
+
+@pytest.fixture
+def mock_settings():
+    with patch('detection.detectors_handler.settings') as mock_settings:
+        mock_settings.detection_mode = "threads"
+        mock_settings.show_preview = False
+        mock_settings.parallel_detection = False
+        mock_settings.squirrel_detector = "ssd"
+        mock_settings.enable_roi_tracking = False
+        mock_settings.enable_motion_gate = False
+        mock_settings.motion_max_skipped_frames = 3
+        mock_settings.squirrel_vote_window = 5
+        mock_settings.squirrel_enter_votes = 1
+        mock_settings.squirrel_exit_votes = 3
+        mock_settings.hands_vote_window = 3
+        mock_settings.hands_enter_votes = 1
+        mock_settings.hands_exit_votes = 2
+        yield mock_settings
+
+
+@pytest.fixture
+def mock_squirrel_detector():
+    detector = MagicMock()
+    detector.detect.return_value = squirrel(False)
+    with patch('detection.detectors_handler.squirrel_detector_factory',
+               return_value=(lambda: detector, SquirrelDetections.empty())):
+        yield detector
+
+
+@pytest.fixture
+def mock_hands_detector():
+    with patch('detection.detectors_handler.HandsDetector') as mock_class:
+        mock_class.return_value.detect.return_value = False
+        yield mock_class.return_value
+
+
+@pytest.fixture
+def handler(mock_settings, mock_squirrel_detector, mock_hands_detector):
+    handler = DetectorsHandler()
+    yield handler
+    handler.cleanup()
+
+
+def new_frame():
+    return np.zeros((48, 64, 3), np.uint8)
+
+
+@pytest.fixture
+def mock_sleep():
+    with patch('feeder.time.sleep') as mock_sleep:
+        yield mock_sleep
+
+
+@pytest.fixture
+def feeder(handler, mock_sleep):
+    """SmartFeeder with the real handler and scheduler, a servo mock that tracks the cover state and new frames."""
+    from feeder import SmartFeeder
+    with patch('feeder.Camera') as mock_camera, patch('feeder.Servo') as mock_servo, \
+         patch('feeder.ServerConnection'), patch('feeder.VideoStorage'), patch('feeder.FrameGrabber') as mock_grabber, \
+         patch('feeder.DetectorsHandler', return_value=handler):
+        mock_camera.return_value.capturing = False
+        servo = mock_servo.return_value
+        servo.cover_opened = False
+        servo.open_cover.side_effect = lambda: setattr(servo, "cover_opened", True)
+        servo.close_cover.side_effect = lambda: setattr(servo, "cover_opened", False)
+        mock_grabber.return_value.get_latest.side_effect = lambda timeout=None: (MagicMock(array=new_frame()), 0.0)
+        yield SmartFeeder()
+
+
+class TestDecisions:
+
+    def test_reset_decisions(self, handler, mock_squirrel_detector):
+        mock_squirrel_detector.detect.return_value = squirrel(True)
+        handler.update_frame(new_frame())
+        assert handler.detect_squirrel()
+
+        handler.reset_decisions(["squirrel"])
+
+        mock_squirrel_detector.detect.return_value = squirrel(False)
+        handler.update_frame(new_frame())
+        assert not handler.detect_squirrel()
+
+
+    def test_hands_with_squirrel_then_cover_closes(self, feeder, mock_squirrel_detector, mock_hands_detector):
+        """Hands and a squirrel seen together, the cover opens for hands, then closes with nothing in view."""
+        camera, servo = feeder.camera, feeder.servo
+
+        # Closed: hands win, only the cover opens
+        mock_hands_detector.detect.return_value = True
+        mock_squirrel_detector.detect.return_value = squirrel(True)
+        feeder.work_iteration()
+        assert servo.cover_opened
+        assert not camera.capture_video.called
+
+        # Opened: the squirrel leaves, then hands leave and the cover closes
+        mock_squirrel_detector.detect.return_value = squirrel(False)
+        mock_hands_detector.detect.return_value = False
+        while servo.cover_opened:
+            feeder.work_iteration()
+
+        # Closed again with nothing in view: no recording is started
+        for _ in range(3):
+            feeder.work_iteration()
+        assert not camera.capture_video.called
+
+
+class TestWithoutMotionGate:
+
+    def test_detectors_run_on_every_frame(self, handler, mock_squirrel_detector):
+        for _ in range(3):
+            handler.update_frame(new_frame())
+            handler.detect_squirrel()
+
+        assert not handler.motion
+        assert mock_squirrel_detector.detect.call_count == 3
+
+
+    def test_idle_feeder_backs_off(self, feeder, mock_sleep):
+        """Without the motion gate an empty scene is not activity, so the scheduler backs off."""
+        for _ in range(4):
+            feeder.work_iteration()
+
+        intervals = [call.args[0] for call in mock_sleep.call_args_list]
+        assert intervals == sorted(intervals)
+        assert intervals[-1] >= 8 * intervals[0]
+
+
+class TestRoiTracking:
+
+    @pytest.fixture
+    def tracking_handler(self, mock_settings, mock_squirrel_detector, mock_hands_detector):
+        mock_settings.enable_roi_tracking = True
+        handler = DetectorsHandler()
+        yield handler
+        handler.cleanup()
+
+
+    def test_first_detection_uses_full_frame(self, tracking_handler, mock_squirrel_detector):
+        mock_squirrel_detector.detect.return_value = squirrel(True)
+        tracking_handler.update_frame(new_frame())
+
+        assert tracking_handler.detect_squirrel()
+
+        assert mock_squirrel_detector.detect.called
+        assert not mock_squirrel_detector.detect_region.called
+
+
+    def test_tracked_squirrel_detected_in_region(self, tracking_handler, mock_squirrel_detector):
+        mock_squirrel_detector.detect.return_value = squirrel(True)
+        tracking_handler.update_frame(new_frame())
+        tracking_handler.detect_squirrel()
+        mock_squirrel_detector.detect.reset_mock()
+        mock_squirrel_detector.detect_region.return_value = squirrel(True, box=(0.22, 0.22, 0.42, 0.42))
+
+        tracking_handler.update_frame(new_frame())
+        assert tracking_handler.detect_squirrel()
+
+        roi = mock_squirrel_detector.detect_region.call_args[0][1]
+        assert (roi[:2] <= 0.2).all() and (roi[2:] >= 0.4).all()
+        assert not mock_squirrel_detector.detect.called
+        assert tracking_handler.stats["roi_detections"] == 1
+
+
+    def test_region_miss_falls_back_to_full_frame(self, tracking_handler, mock_squirrel_detector):
+        mock_squirrel_detector.detect.return_value = squirrel(True)
+        tracking_handler.update_frame(new_frame())
+        tracking_handler.detect_squirrel()
+        mock_squirrel_detector.detect.reset_mock()
+        mock_squirrel_detector.detect_region.return_value = squirrel(False)
+        mock_squirrel_detector.detect.return_value = squirrel(True, box=(0.3, 0.3, 0.5, 0.5))
+
+        tracking_handler.update_frame(new_frame())
+        assert tracking_handler.detect_squirrel()
+
+        assert mock_squirrel_detector.detect_region.called
+        assert mock_squirrel_detector.detect.called
+        assert tracking_handler.stats["roi_misses"] == 1
+        assert np.allclose(tracking_handler._tracker.box, [0.3, 0.3, 0.5, 0.5])
+
+
+class TestMotionGate:
+
+    @pytest.fixture
+    def mock_motion_detector(self):
+        with patch('detection.detectors_handler.MotionDetector') as mock_class:
+            mock_class.return_value.update.return_value = True
+            yield mock_class.return_value
+
+
+    @pytest.fixture
+    def gated_handler(self, mock_settings, mock_squirrel_detector, mock_hands_detector, mock_motion_detector):
+        mock_settings.enable_motion_gate = True
+        handler = DetectorsHandler()
+        yield handler
+        handler.cleanup()
+
+
+    def test_still_scene_reuses_result(self, gated_handler, mock_squirrel_detector, mock_motion_detector):
+        mock_squirrel_detector.detect.return_value = squirrel(True)
+        gated_handler.update_frame(new_frame())
+        assert gated_handler.detect_squirrel()
+
+        mock_motion_detector.update.return_value = False
+        mock_squirrel_detector.detect.return_value = squirrel(False)
+        for _ in range(2):
+            gated_handler.update_frame(new_frame())
+            assert gated_handler.detect_squirrel()
+
+        assert mock_squirrel_detector.detect.call_count == 1
+        assert gated_handler.squirrel_detections.found
+        assert gated_handler.stats["skipped"]["squirrel"] == 2
+        assert gated_handler.stats["motion_frames"] == 1
+
+
+    def test_motion_reruns_detector(self, gated_handler, mock_squirrel_detector, mock_motion_detector):
+        gated_handler.update_frame(new_frame())
+        gated_handler.detect_squirrel()
+        mock_motion_detector.update.return_value = False
+        gated_handler.update_frame(new_frame())
+        gated_handler.detect_squirrel()
+
+        mock_motion_detector.update.return_value = True
+        gated_handler.update_frame(new_frame())
+        gated_handler.detect_squirrel()
+
+        assert mock_squirrel_detector.detect.call_count == 2
+
+
+    def test_forced_rerun_after_max_skipped_frames(self, gated_handler, mock_squirrel_detector, mock_motion_detector):
+        gated_handler.update_frame(new_frame())
+        gated_handler.detect_squirrel()
+        mock_motion_detector.update.return_value = False
+
+        # motion_max_skipped_frames is 3
+        for _ in range(4):
+            gated_handler.update_frame(new_frame())
+            gated_handler.detect_squirrel()
+
+        assert mock_squirrel_detector.detect.call_count == 2
+        assert gated_handler.stats["skipped"]["squirrel"] == 3
+        assert gated_handler.stats["inferences"]["squirrel"] == 2
+
+
+class TestParallelDetection:
+
+    def test_detectors_run_concurrently_on_shared_frame(self, mock_settings, handler,
+                                                        mock_squirrel_detector, mock_hands_detector):
+        mock_settings.parallel_detection = True
+        # Both detectors must be inside detect() at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+        seen = {}
+
+        def detect(name, result):
+            def run(frame):
+                barrier.wait()
+                seen[name] = (frame, frame.get(InputSpec("RGB", (32, 24))), threading.current_thread())
+                return result
+            return run
+        mock_squirrel_detector.detect.side_effect = detect("squirrel", squirrel(True))
+        mock_hands_detector.detect.side_effect = detect("hands", True)
+        handler.update_frame(new_frame())
+
+        result = handler.detect_all()
+
+        assert result == DetectionResult(hands=True, squirrel=True)
+        squirrel_frame, squirrel_rgb, squirrel_thread = seen["squirrel"]
+        hands_frame, hands_rgb, hands_thread = seen["hands"]
+        assert isinstance(squirrel_frame, PreprocessedFrame)
+        assert squirrel_frame is hands_frame
+        # The converted input is computed once and shared
+        assert squirrel_rgb is hands_rgb
+        assert squirrel_thread is not hands_thread
+        assert threading.current_thread() not in (squirrel_thread, hands_thread)
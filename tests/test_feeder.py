@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import MagicMock, patch, Mock
 from feeder import SmartFeeder
+from detection import DetectionResult
 
 
 @pytest.fixture
@@ -51,9 +52,18 @@ def mock_detectors():
         yield detectors_instance
 
 
+@pytest.fixture
+def mock_frame_grabber():
+    with patch('feeder.FrameGrabber') as mock_grabber_class:
+        grabber_instance = MagicMock()
+        grabber_instance.get_latest.return_value = (MagicMock(), 0.0)
+        mock_grabber_class.return_value = grabber_instance
+        yield grabber_instance
+
+
 @pytest.fixture
 def feeder_with_mocks(mock_camera, mock_servo, mock_server_connection, 
-                    mock_video_storage, mock_detectors):
+                    mock_video_storage, mock_detectors, mock_frame_grabber):
     """Create a SmartFeeder instance with all dependencies mocked"""
     with patch('feeder.time.sleep'):
         return SmartFeeder()
@@ -85,6 +95,8 @@ class TestSmartFeeder:
         assert mock_servo.cleanup.called
         assert mock_video_storage.cleanup.called
         assert mock_server_connection.cleanup.called
+        assert feeder.detectors.cleanup.called
+        assert feeder.frame_grabber.stop.called
 
 
     def test_handle_capture_with_squirrel(self, mock_sleep, feeder_with_mocks, mock_detectors):
@@ -92,13 +104,15 @@ class TestSmartFeeder:
 
         feeder = feeder_with_mocks
         mock_detectors.detect_squirrel.return_value = True
-        feeder._handle_capture()
+        detected = feeder._handle_capture()
 
         assert mock_detectors.detect_squirrel.called
         assert not feeder.camera.stop_capture.called
         assert not feeder.servo.close_cover.called
         assert not feeder.storage.go_to_next_video.called
-        assert mock_sleep.called
+        feeder.storage.add_confidence.assert_called_once_with(mock_detectors.squirrel_confidence)
+        assert detected
+        assert not mock_sleep.called
 
 
     def test_handle_capture_without_squirrel(self, feeder_with_mocks, mock_detectors):
@@ -107,8 +121,9 @@ class TestSmartFeeder:
         feeder = feeder_with_mocks
         mock_detectors.detect_squirrel.return_value = False
 
-        feeder._handle_capture()
+        detected = feeder._handle_capture()
 
+        assert not detected
         assert mock_detectors.detect_squirrel.called
         assert feeder.camera.stop_capture.called
         assert feeder.servo.close_cover.called
@@ -121,11 +136,12 @@ class TestSmartFeeder:
         feeder = feeder_with_mocks
         mock_detectors.detect_hands.return_value = True
 
-        feeder._handle_cover_opened()
+        detected = feeder._handle_cover_opened()
 
         assert mock_detectors.detect_hands.called
         assert not feeder.servo.close_cover.called
-        assert mock_sleep.called
+        assert detected
+        assert not mock_sleep.called
 
 
     def test_handle_cover_opened_without_hands(self, feeder_with_mocks, mock_detectors):
@@ -134,8 +150,9 @@ class TestSmartFeeder:
         feeder = feeder_with_mocks
         mock_detectors.detect_hands.return_value = False
 
-        feeder._handle_cover_opened()
+        detected = feeder._handle_cover_opened()
 
+        assert not detected
         assert mock_detectors.detect_hands.called
         assert feeder.servo.close_cover.called
 
@@ -144,13 +161,14 @@ class TestSmartFeeder:
         """Test _handle_cover_closed when hands are detected"""
 
         feeder = feeder_with_mocks
-        mock_detectors.detect_hands.return_value = True
+        mock_detectors.detect_all.return_value = DetectionResult(hands=True, squirrel=True)
 
-        feeder._handle_cover_closed()
+        detected = feeder._handle_cover_closed()
 
-        assert mock_detectors.detect_hands.called
+        assert mock_detectors.detect_all.called
         assert feeder.servo.open_cover.called
-        assert mock_sleep.called
+        assert detected
+        assert not mock_sleep.called
         assert not feeder.camera.capture_video.called
 
 
@@ -159,29 +177,43 @@ class TestSmartFeeder:
         """Test _handle_cover_closed when squirrel is detected"""
 
         feeder = feeder_with_mocks
-        mock_detectors.detect_hands.return_value = False
-        mock_detectors.detect_squirrel.return_value = True
+        mock_detectors.detect_all.return_value = DetectionResult(hands=False, squirrel=True)
 
-        feeder._handle_cover_closed()
+        detected = feeder._handle_cover_closed()
 
-        assert mock_detectors.detect_hands.called
-        assert mock_detectors.detect_squirrel.called
+        assert mock_detectors.detect_all.called
         assert feeder.servo.open_cover.called
         assert feeder.camera.capture_video.called
-        assert mock_sleep.called
+        assert feeder.storage.start_visit.called
+        feeder.storage.add_confidence.assert_called_once_with(mock_detectors.squirrel_confidence)
+        assert detected
+        assert not mock_sleep.called
+
+
+    def test_handle_cover_closed_segmented_recording(self, feeder_with_mocks, mock_detectors, mock_video_storage):
+        """Test _handle_cover_closed starts segmented recording with the visit manifest"""
+
+        feeder = feeder_with_mocks
+        mock_detectors.detect_all.return_value = DetectionResult(hands=False, squirrel=True)
+
+        with patch('feeder.settings') as mock_settings:
+            mock_settings.enable_segmented_recording = True
+            feeder._handle_cover_closed()
+
+        feeder.camera.capture_video.assert_called_once_with(mock_video_storage.get_segment_pattern.return_value,
+                                                            mock_video_storage.get_manifest_name.return_value)
 
 
     def test_handle_cover_closed_no_detection(self, feeder_with_mocks, mock_detectors):
         """Test _handle_cover_closed when neither hands nor squirrel are detected"""
 
         feeder = feeder_with_mocks
-        mock_detectors.detect_hands.return_value = False
-        mock_detectors.detect_squirrel.return_value = False
+        mock_detectors.detect_all.return_value = DetectionResult(hands=False, squirrel=False)
 
-        feeder._handle_cover_closed()
+        detected = feeder._handle_cover_closed()
 
-        assert mock_detectors.detect_hands.called
-        assert mock_detectors.detect_squirrel.called
+        assert not detected
+        assert mock_detectors.detect_all.called
         assert not feeder.servo.open_cover.called
         assert not feeder.camera.capture_video.called
 
@@ -238,3 +270,104 @@ class TestSmartFeeder:
         assert not feeder._handle_capture.called
         assert not feeder._handle_cover_opened.called
         assert feeder._handle_cover_closed.called
+
+
+    def test_work_uses_latest_grabbed_frame(self, mock_sleep, feeder_with_mocks, mock_frame_grabber, mock_camera):
+        """Test that frames are taken from the frame grabber in pipelined mode"""
+
+        feeder = feeder_with_mocks
+        frame = MagicMock()
+        mock_frame_grabber.get_latest.return_value = (frame, 0.0)
+        feeder._handle_cover_closed = Mock()
+
+        feeder.work_iteration()
+
+        mock_frame_grabber.start.assert_called_once()
+        feeder.detectors.update_frame.assert_called_once_with(frame.array)
+        assert not mock_camera.get_detection_view.called
+
+
+    def test_work_releases_frame(self, mock_sleep, feeder_with_mocks, mock_frame_grabber):
+        """Test that the camera buffer is released even if a handler fails"""
+
+        feeder = feeder_with_mocks
+        frame = MagicMock()
+        mock_frame_grabber.get_latest.return_value = (frame, 0.0)
+        feeder._handle_cover_closed = Mock(side_effect=RuntimeError)
+
+        with pytest.raises(RuntimeError):
+            feeder.work_iteration()
+
+        assert feeder.detectors.release_frame.called
+        assert frame.release.called
+
+
+    def test_work_skips_iteration_without_frame(self, mock_sleep, feeder_with_mocks, mock_frame_grabber):
+        """Test that nothing is detected when the frame grabber is stopped"""
+
+        feeder = feeder_with_mocks
+        mock_frame_grabber.get_latest.return_value = (None, None)
+        feeder._handle_cover_closed = Mock()
+
+        feeder.work_iteration()
+
+        assert not feeder.detectors.update_frame.called
+        assert not feeder._handle_cover_closed.called
+
+
+    def test_work_sleeps_scheduled_interval(self, mock_sleep, feeder_with_mocks, mock_camera, mock_servo):
+        """Test that work waits for the interval chosen by the scheduler for the new state"""
+
+        feeder = feeder_with_mocks
+        mock_camera.capturing = False
+        mock_servo.cover_opened = False
+        feeder.scheduler = MagicMock()
+        feeder.scheduler.next_interval.return_value = 0.5
+        feeder.detectors.motion = False
+
+        def open_cover():
+            mock_servo.cover_opened = True
+            return True
+        feeder._handle_cover_closed = Mock(side_effect=open_cover)
+
+        feeder.work_iteration()
+
+        feeder.scheduler.next_interval.assert_called_once_with("opened", True)
+        mock_sleep.assert_called_once_with(0.5)
+
+
+    def test_work_backs_off_without_frames(self, mock_sleep, feeder_with_mocks, mock_frame_grabber):
+        """Test that a stopped frame grabber doesn't make the work loop spin"""
+
+        feeder = feeder_with_mocks
+        mock_frame_grabber.get_latest.return_value = (None, None)
+
+        with patch('feeder.settings') as mock_settings:
+            mock_settings.frame_timeout = 1
+            mock_settings.min_detection_interval = 0.05
+            mock_settings.idle_backoff_factor = 2
+            mock_settings.idle_max_interval = 0.3
+            for _ in range(5):
+                feeder.work_iteration()
+
+        mock_frame_grabber.get_latest.assert_called_with(timeout=1)
+        assert [call.args[0] for call in mock_sleep.call_args_list] == [0.05, 0.1, 0.2, 0.3, 0.3]
+
+
+    def test_work_back_off_resets_with_frame(self, mock_sleep, feeder_with_mocks, mock_frame_grabber):
+
+        feeder = feeder_with_mocks
+        feeder.scheduler = MagicMock()
+        feeder.scheduler.next_interval.return_value = 0.5
+        mock_frame_grabber.get_latest.return_value = (None, None)
+        feeder.work_iteration()
+        feeder.work_iteration()
+
+        mock_frame_grabber.get_latest.return_value = (MagicMock(), 0.0)
+        feeder.work_iteration()
+        mock_frame_grabber.get_latest.return_value = (None, None)
+        mock_sleep.reset_mock()
+        feeder.work_iteration()
+
+        mock_sleep.assert_called_once_with(feeder._no_frame_delay)
+        assert feeder._no_frame_delay == pytest.approx(0.05)
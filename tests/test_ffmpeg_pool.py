@@ -0,0 +1,158 @@
+import os
+import pytest
+from unittest.mock import MagicMock, patch
+from camera.ffmpeg_pool import FfmpegPool
+
+
+class SyncThread:
+    """Runs the thread target on start, so the pool refills deterministically."""
+    def __init__(self, target, **kwargs):
+        self.target = target
+
+    def start(self):
+        self.target()
+
+
+@pytest.fixture
+def mock_settings(tmp_path):
+    with patch('camera.ffmpeg_pool.settings') as mock_settings:
+        mock_settings.enable_ffmpeg_prewarm = True
+        mock_settings.enable_audio = False
+        mock_settings.video_folder = str(tmp_path)
+        mock_settings.video_file_ext = "mp4"
+        yield mock_settings
+
+
+@pytest.fixture
+def mock_output_class():
+    with patch('camera.ffmpeg_pool.CaptureAndStreamOutput') as mock_output_class, \
+         patch('camera.ffmpeg_pool.threading.Thread', SyncThread):
+        # ffmpeg creates its output file only after the first frames, not when it is spawned
+        mock_output_class.side_effect = lambda filename, **kwargs: MagicMock(output_filename=filename,
+                                                                             final_filename=None, alive=True)
+        yield mock_output_class
+
+
+class TestFfmpegPool:
+
+    def test_spawns_idle_process_on_init(self, mock_settings, mock_output_class):
+        FfmpegPool(framerate=20)
+
+        assert mock_output_class.call_count == 1
+        assert mock_output_class.call_args[1]['framerate'] == 20
+        assert "/.prewarm-" in mock_output_class.call_args[0][0]
+
+
+    def test_acquire_reuses_prespawned_process(self, mock_settings, mock_output_class):
+        pool = FfmpegPool(framerate=20)
+
+        video = os.path.join(mock_settings.video_folder, "0.mp4")
+
+        output = pool.acquire(video, framerate=20)
+
+        assert output.spawn.called
+        assert output.output_filename != video
+        assert mock_output_class.call_count == 2 # the next one is spawned in advance
+        assert pool.stats["warm_starts"] == 1
+
+
+    def test_acquire_journals_video_name(self, mock_settings, mock_output_class):
+        pool = FfmpegPool(framerate=20)
+        video = os.path.join(mock_settings.video_folder, "0.mp4")
+
+        output = pool.acquire(video, framerate=20)
+
+        # ffmpeg renames its temporary file when it exits
+        assert output.final_filename == video
+        with open(output.output_filename + ".target") as f:
+            assert f.read() == video
+
+
+    def test_release_removes_journaled_name(self, mock_settings, mock_output_class):
+        pool = FfmpegPool(framerate=20)
+        output = pool.acquire(os.path.join(mock_settings.video_folder, "0.mp4"), framerate=20)
+        output.first_frame_latency = None
+
+        pool.release(output)
+
+        assert not os.path.exists(output.output_filename + ".target")
+
+
+    def test_recovers_interrupted_recording_on_start(self, mock_settings, mock_output_class):
+        folder = mock_settings.video_folder
+        video = os.path.join(folder, "4.mp4")
+        with open(os.path.join(folder, ".prewarm-1-0.mp4"), "wb") as f:
+            f.write(b"video")
+        with open(os.path.join(folder, ".prewarm-1-0.mp4.target"), "w") as f:
+            f.write(video)
+        # ffmpeg of this recording never got frames
+        with open(os.path.join(folder, ".prewarm-1-1.mp4.target"), "w") as f:
+            f.write(os.path.join(folder, "5.mp4"))
+        mock_settings.enable_ffmpeg_prewarm = False
+
+        FfmpegPool()
+
+        assert os.listdir(folder) == ["4.mp4"]
+        with open(video, "rb") as f:
+            assert f.read() == b"video"
+
+
+    def test_removes_stale_temporary_files_on_start(self, mock_settings, mock_output_class):
+        folder = mock_settings.video_folder
+        for name in [".prewarm-1-0.mp4", ".prewarm-1-1.mp4", "3.mp4"]:
+            open(os.path.join(folder, name), "wb").close()
+        mock_settings.enable_ffmpeg_prewarm = False
+
+        FfmpegPool()
+
+        assert os.listdir(folder) == ["3.mp4"]
+
+
+    def test_acquire_with_audio_starts_new_process(self, mock_settings, mock_output_class):
+        pool = FfmpegPool(framerate=20)
+
+        output = pool.acquire("videos/0.mp4", audio=True, framerate=20)
+
+        assert not output.spawn.called
+        assert mock_output_class.call_args[0][0] == "videos/0.mp4"
+        assert pool.stats["cold_starts"] == 1
+
+
+    def test_disabled_with_audio_setting(self, mock_settings, mock_output_class):
+        mock_settings.enable_audio = True
+
+        pool = FfmpegPool()
+
+        assert not pool.enabled
+        assert not mock_output_class.called
+
+
+    def test_dead_process_is_replaced(self, mock_settings, mock_output_class):
+        pool = FfmpegPool()
+        pool._idle.alive = False
+
+        output = pool.acquire("videos/0.mp4")
+
+        assert output.output_filename == "videos/0.mp4"
+        assert pool.stats["cold_starts"] == 1
+
+
+    def test_release_records_latency(self, mock_settings, mock_output_class):
+        pool = FfmpegPool()
+        output = pool.acquire(os.path.join(mock_settings.video_folder, "0.mp4"))
+        output.first_frame_latency = 0.05
+
+        pool.release(output)
+
+        assert pool.stats["last_first_frame_latency"] == 0.05
+
+
+    def test_cleanup_kills_idle_process(self, mock_settings, mock_output_class):
+        pool = FfmpegPool()
+        idle = pool._idle
+        ffmpeg = idle.ffmpeg
+
+        pool.cleanup()
+
+        assert ffmpeg.kill.called
+        assert pool._idle is None
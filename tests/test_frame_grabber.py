@@ -0,0 +1,111 @@
+import pytest
+import threading
+import time
+from unittest.mock import MagicMock, patch
+from camera.frame_grabber import FrameGrabber
+
+
+@pytest.fixture
+def mock_log():
+    with patch('camera.frame_grabber.log') as mock_log:
+        yield mock_log
+
+
+class TestFrameGrabber:
+
+    def test_get_latest_returns_newest_frame(self, mock_log):
+        frames = iter(range(1000000))
+        release = threading.Event()
+
+        def capture():
+            release.wait()
+            return next(frames)
+
+        grabber = FrameGrabber(capture)
+        grabber.start()
+        release.set()
+
+        first, first_timestamp = grabber.get_latest(timeout=1)
+        second, second_timestamp = grabber.get_latest(timeout=1)
+        grabber.stop()
+
+        assert second > first
+        assert second_timestamp >= first_timestamp
+
+
+    def test_captures_one_frame_ahead(self, mock_log):
+        capture = MagicMock(return_value="frame")
+        grabber = FrameGrabber(capture)
+        grabber.start()
+
+        grabber.get_latest(timeout=1)
+        time.sleep(0.1)
+
+        # The frame after the taken one is ready, nothing more is captured while nobody asks
+        assert capture.call_count == 2
+        grabber.get_latest(timeout=1)
+        time.sleep(0.1)
+        grabber.stop()
+        assert capture.call_count == 3
+        assert grabber.stats["dropped"] == 0
+
+
+    def test_old_frame_is_replaced(self, mock_log):
+        frames = [MagicMock(), MagicMock(), MagicMock()]
+        frame_iter = iter(frames)
+        grabber = FrameGrabber(lambda: next(frame_iter), max_age=0.05)
+        grabber.start()
+        assert grabber.get_latest(timeout=1)[0] is frames[0]
+        time.sleep(0.1)
+
+        frame, timestamp = grabber.get_latest(timeout=1)
+        grabber.stop()
+
+        assert frame is frames[2]
+        assert time.monotonic() - timestamp < 0.1
+        assert frames[1].release.called
+        assert not frames[2].release.called
+        assert grabber.stats["dropped"] == 1
+
+
+    def test_fresh_frame_is_kept(self, mock_log):
+        frames = iter(range(1000))
+        grabber = FrameGrabber(lambda: next(frames), max_age=10)
+        grabber.start()
+        grabber.get_latest(timeout=1)
+        time.sleep(0.05)
+
+        frame, _ = grabber.get_latest(timeout=1)
+        grabber.stop()
+
+        assert frame == 1
+        assert grabber.stats["dropped"] == 0
+
+
+    def test_pending_frame_returned_after_stop(self, mock_log):
+        grabber = FrameGrabber(MagicMock(return_value="frame"))
+        grabber.start()
+        while grabber.stats["captured"] < 1:
+            pass
+        grabber.stop()
+
+        assert grabber.get_latest(timeout=0)[0] == "frame"
+        assert grabber.get_latest(timeout=0) == (None, None)
+
+
+    def test_get_latest_timeout(self, mock_log):
+        grabber = FrameGrabber(MagicMock())
+
+        assert grabber.get_latest(timeout=0.01) == (None, None)
+
+
+    def test_capture_error_is_logged(self, mock_log):
+        capture = MagicMock(side_effect=[RuntimeError(), "frame"] + ["frame"] * 100000)
+        grabber = FrameGrabber(capture)
+        grabber.start()
+
+        frame, _ = grabber.get_latest(timeout=1)
+        grabber.stop()
+
+        assert frame == "frame"
+        assert mock_log.error.called
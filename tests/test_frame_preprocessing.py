@@ -0,0 +1,114 @@
+import cv2
+import numpy as np
+import pytest
+from unittest.mock import patch
+from detection.frame_preprocessing import InputSpec, InputWriter, PreprocessedFrame
+from detection.tuning import allocated_per_call
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(240, 320, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def cv2_calls():
+    with patch('detection.frame_preprocessing.cv2.resize', wraps=cv2.resize) as resize, \
+         patch('detection.frame_preprocessing.cv2.cvtColor', wraps=cv2.cvtColor) as cvt_color:
+        yield resize, cvt_color
+
+
+class TestPreprocessedFrame:
+
+    def test_variant_computed_once(self, frame, cv2_calls):
+        resize, cvt_color = cv2_calls
+        preprocessed = PreprocessedFrame(frame)
+
+        first = preprocessed.get(InputSpec("RGB", (96, 64)))
+        second = preprocessed.get(InputSpec("RGB", (96, 64)))
+
+        assert second is first
+        assert resize.call_count == 1
+        assert cvt_color.call_count == 1
+        assert np.array_equal(first, cv2.cvtColor(cv2.resize(frame, (96, 64)), cv2.COLOR_BGR2RGB))
+
+
+    def test_colorspaces_share_resize(self, frame, cv2_calls):
+        resize, cvt_color = cv2_calls
+        preprocessed = PreprocessedFrame(frame)
+
+        rgb = preprocessed.get(InputSpec("RGB", (96, 64)))
+        gray = preprocessed.get(InputSpec("GRAY", (96, 64)))
+
+        assert resize.call_count == 1
+        assert cvt_color.call_count == 2
+        resized = preprocessed.get(InputSpec("BGR", (96, 64)))
+        assert cvt_color.call_args_list[0].args[0] is resized
+        assert cvt_color.call_args_list[1].args[0] is resized
+        assert np.array_equal(rgb, cv2.cvtColor(resized, cv2.COLOR_BGR2RGB))
+        assert np.array_equal(gray, cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY))
+
+
+    def test_dtype_derived_from_cached_variant(self, frame, cv2_calls):
+        resize, cvt_color = cv2_calls
+        preprocessed = PreprocessedFrame(frame)
+        rgb = preprocessed.get(InputSpec("RGB", (96, 64)))
+
+        rgb_float = preprocessed.get(InputSpec("RGB", (96, 64), np.float32))
+
+        assert resize.call_count == 1
+        assert cvt_color.call_count == 1
+        assert rgb_float.dtype == np.float32
+        assert np.array_equal(rgb_float, rgb.astype(np.float32))
+        assert preprocessed.get(InputSpec("RGB", (96, 64), np.float32)) is rgb_float
+
+
+    def test_full_size_is_original_frame(self, frame, cv2_calls):
+        resize, cvt_color = cv2_calls
+
+        assert PreprocessedFrame(frame).get(InputSpec("BGR", (320, 240))) is frame
+        assert not resize.called
+
+
+class TestInputWriter:
+
+    def test_writes_same_image_as_preprocessed_frame(self, frame):
+        spec = InputSpec("RGB", (96, 64))
+        out = np.empty((64, 96, 3), dtype=np.uint8)
+
+        result = InputWriter(spec).write(frame, out)
+
+        assert result is out
+        assert np.array_equal(out, PreprocessedFrame(frame).get(spec))
+
+
+    def test_converts_dtype(self, frame):
+        spec = InputSpec("RGB", (96, 64), np.float32)
+        out = np.empty((64, 96, 3), dtype=np.float32)
+
+        InputWriter(spec).write(frame, out)
+
+        expected = cv2.cvtColor(cv2.resize(frame, (96, 64)), cv2.COLOR_BGR2RGB).astype(np.float32)
+        assert np.array_equal(out, expected)
+
+
+    def test_writes_crop(self, frame):
+        spec = InputSpec("RGB", (32, 32))
+        out = np.empty((32, 32, 3), dtype=np.uint8)
+        crop = frame[10:100, 20:150]
+
+        InputWriter(spec).write(crop, out)
+
+        assert np.array_equal(out, cv2.cvtColor(cv2.resize(crop, (32, 32)), cv2.COLOR_BGR2RGB))
+
+
+    @pytest.mark.parametrize("dtype", [np.uint8, np.float32])
+    def test_no_image_allocations_after_first_call(self, frame, dtype):
+        writer = InputWriter(InputSpec("RGB", (96, 64), dtype))
+        out = np.empty((64, 96, 3), dtype=dtype)
+
+        allocated = allocated_per_call(lambda: writer.write(frame, out), runs=5)
+
+        # Only small Python objects, not a single image row
+        assert allocated < 96 * 3
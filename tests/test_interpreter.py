@@ -0,0 +1,104 @@
+import pytest
+from unittest.mock import patch
+from detection.interpreter import create_interpreter, resolve_interpreter_options
+from settings.config import set_tuned_interpreter_options
+
+
+@pytest.fixture
+def mock_settings():
+    with patch('detection.interpreter.settings') as mock_settings:
+        mock_settings.tflite_num_threads = 0
+        mock_settings.tflite_delegate = "auto"
+        yield mock_settings
+
+
+@pytest.fixture
+def mock_tuned():
+    with patch('detection.interpreter.get_tuned_interpreter_options') as mock_get:
+        mock_get.return_value = {"num_threads": 3, "delegate": "none"}
+        yield mock_get
+
+
+@pytest.fixture
+def mock_tflite():
+    with patch('detection.interpreter.tflite') as mock_tflite:
+        yield mock_tflite
+
+
+class TestResolveInterpreterOptions:
+
+    def test_auto_uses_tuned_options(self, mock_settings, mock_tuned):
+        assert resolve_interpreter_options("model.tflite") == {"num_threads": 3, "delegate": "none"}
+        mock_tuned.assert_called_once_with("model.tflite")
+
+
+    def test_settings_override_tuned_options(self, mock_settings, mock_tuned):
+        mock_settings.tflite_num_threads = 2
+        mock_settings.tflite_delegate = "xnnpack"
+
+        assert resolve_interpreter_options("model.tflite") == {"num_threads": 2, "delegate": "xnnpack"}
+
+
+    def test_settings_override_each_option(self, mock_settings, mock_tuned):
+        mock_settings.tflite_num_threads = 2
+
+        assert resolve_interpreter_options("model.tflite") == {"num_threads": 2, "delegate": "none"}
+
+
+    def test_defaults_without_tuning(self, mock_settings, mock_tuned):
+        mock_tuned.return_value = None
+
+        assert resolve_interpreter_options("model.tflite") == {"num_threads": None, "delegate": "xnnpack"}
+
+
+    def test_options_saved_by_tuning(self, mock_settings, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "settings").mkdir()
+        set_tuned_interpreter_options("ssd.tflite", {"num_threads": 4, "delegate": "none"})
+
+        assert resolve_interpreter_options("ssd.tflite") == {"num_threads": 4, "delegate": "none"}
+        assert resolve_interpreter_options("other.tflite") == {"num_threads": None, "delegate": "xnnpack"}
+
+
+class TestCreateInterpreter:
+
+    def test_options_from_settings(self, mock_settings, mock_tuned, mock_tflite):
+        interpreter = create_interpreter("model.tflite")
+
+        kwargs = mock_tflite.Interpreter.call_args[1]
+        assert kwargs["model_path"] == "model.tflite"
+        assert kwargs["num_threads"] == 3
+        assert kwargs["experimental_op_resolver_type"] == mock_tflite.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        assert interpreter.allocate_tensors.called
+
+
+    def test_xnnpack_uses_default_resolver(self, mock_settings, mock_tuned, mock_tflite):
+        create_interpreter("model.tflite", num_threads=0, delegate="xnnpack")
+
+        mock_tflite.Interpreter.assert_called_once_with(model_path="model.tflite", num_threads=None)
+        assert not mock_tuned.called
+
+
+    def test_delegate_library(self, mock_settings, mock_tuned, mock_tflite):
+        create_interpreter("model.tflite", num_threads=2, delegate="libedgetpu.so.1")
+
+        mock_tflite.load_delegate.assert_called_once_with("libedgetpu.so.1")
+        assert mock_tflite.Interpreter.call_args[1]["experimental_delegates"] == [mock_tflite.load_delegate.return_value]
+
+
+    @pytest.mark.parametrize("error", [ValueError, OSError])
+    def test_missing_delegate_falls_back_to_xnnpack(self, mock_settings, mock_tuned, mock_tflite, error):
+        mock_tflite.load_delegate.side_effect = error("missing")
+
+        interpreter = create_interpreter("model.tflite", num_threads=2, delegate="libmissing.so")
+
+        mock_tflite.Interpreter.assert_called_once_with(model_path="model.tflite", num_threads=2)
+        assert interpreter is mock_tflite.Interpreter.return_value
+
+
+    def test_missing_delegate_without_fallback(self, mock_settings, mock_tuned, mock_tflite):
+        mock_tflite.load_delegate.side_effect = ValueError("missing")
+
+        with pytest.raises(ValueError):
+            create_interpreter("model.tflite", num_threads=2, delegate="libmissing.so", fallback=False)
+        assert not mock_tflite.Interpreter.called
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from unittest.mock import patch
+from detection.motion_detection import MotionDetector
+
+
+@pytest.fixture
+def mock_settings():
+    with patch('detection.motion_detection.settings') as mock_settings:
+        mock_settings.motion_thumbnail_width = 64
+        mock_settings.motion_thumbnail_height = 48
+        mock_settings.motion_threshold = 0.01
+        mock_settings.motion_pixel_threshold = 25
+        mock_settings.motion_learning_rate = 0.05
+        yield mock_settings
+
+
+def gray_frame(value: int=100) -> np.ndarray:
+    return np.full((96, 128, 3), value, np.uint8)
+
+
+def frame_with_square(size: int) -> np.ndarray:
+    """Gray frame with a white square of size pixels in the middle."""
+    frame = gray_frame()
+    top, left = 48 - size // 2, 64 - size // 2
+    frame[top:top + size, left:left + size] = 255
+    return frame
+
+
+class TestMotionDetector:
+
+    def test_first_frame_is_motion(self, mock_settings):
+        detector = MotionDetector()
+
+        assert detector.update(gray_frame())
+        assert detector.last_score == 1.0
+
+
+    def test_still_scene(self, mock_settings):
+        detector = MotionDetector()
+        detector.update(gray_frame())
+
+        assert not detector.update(gray_frame())
+        assert detector.last_score == 0.0
+
+
+    def test_noise_below_pixel_threshold(self, mock_settings):
+        detector = MotionDetector()
+        detector.update(gray_frame(100))
+
+        assert not detector.update(gray_frame(120))
+        assert detector.last_score == 0.0
+
+
+    def test_score_is_fraction_of_changed_pixels(self, mock_settings):
+        detector = MotionDetector()
+        detector.update(gray_frame())
+
+        assert detector.update(frame_with_square(48))
+        # The blur spreads the square edges a bit
+        assert detector.last_score == pytest.approx(48 * 48 / (96 * 128), abs=0.04)
+
+
+    def test_small_change_below_threshold(self, mock_settings):
+        mock_settings.motion_threshold = 0.3
+        detector = MotionDetector()
+        detector.update(gray_frame())
+
+        assert not detector.update(frame_with_square(48))
+        assert 0 < detector.last_score < 0.3
+
+
+    def test_background_adapts_to_new_scene(self, mock_settings):
+        mock_settings.motion_learning_rate = 0.5
+        detector = MotionDetector()
+        detector.update(gray_frame())
+        frame = frame_with_square(48)
+
+        assert detector.update(frame)
+        for _ in range(10):
+            detector.update(frame)
+
+        assert not detector.update(frame)
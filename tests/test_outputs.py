@@ -0,0 +1,92 @@
+import pytest
+from unittest.mock import MagicMock
+from camera.outputs import FanOutOutput
+
+
+SECOND = 1000000
+
+
+def feed(output, count, start=0, keyframe_every=10, fps=10):
+    for i in range(start, start + count):
+        output.outputframe(f"frame{i}", keyframe=(i % keyframe_every == 0), timestamp=i * SECOND // fps)
+
+
+def received(sink):
+    return [c.args[0] for c in sink.outputframe.call_args_list]
+
+
+class TestFanOutOutput:
+
+    def test_preroll_keeps_seconds_from_keyframe(self):
+        output = FanOutOutput(preroll_seconds=2)
+        feed(output, 50)
+
+        sink = MagicMock()
+        output.add_sink("capture", sink, preroll=True)
+
+        frames = received(sink)
+        assert frames[0] == "frame20"
+        assert frames[-1] == "frame49"
+        assert sink.outputframe.call_args_list[0].args[1] is True
+
+
+    def test_buffered_seconds(self):
+        output = FanOutOutput(preroll_seconds=2)
+        feed(output, 25)
+
+        assert output.buffered_seconds() == pytest.approx(2.4)
+
+
+    def test_without_preroll_nothing_is_buffered(self):
+        output = FanOutOutput()
+        feed(output, 25)
+
+        assert output.buffered_seconds() == 0.0
+
+
+    def test_new_sink_waits_for_keyframe(self):
+        output = FanOutOutput()
+        feed(output, 5)
+        sink = MagicMock()
+        output.add_sink("stream", sink)
+
+        feed(output, 10, start=5)
+
+        assert received(sink) == ["frame10", "frame11", "frame12", "frame13", "frame14"]
+
+
+    def test_frames_are_sent_to_every_sink(self):
+        output = FanOutOutput(preroll_seconds=2)
+        feed(output, 10)
+        capture, stream = MagicMock(), MagicMock()
+        output.add_sink("capture", capture, preroll=True)
+        output.add_sink("stream", stream)
+        capture.reset_mock()
+
+        feed(output, 11, start=10)
+
+        assert received(capture) == received(stream)
+        assert sorted(output.sink_names) == ["capture", "stream"]
+
+
+    def test_remove_sink(self):
+        output = FanOutOutput()
+        sink = MagicMock()
+        output.add_sink("capture", sink)
+
+        assert output.remove_sink("capture") is sink
+        assert not output.has_sink("capture")
+        feed(output, 3)
+        assert not sink.outputframe.called
+        assert output.remove_sink("capture") is None
+
+
+    def test_no_keyframe_nothing_flushed(self):
+        output = FanOutOutput(preroll_seconds=1)
+        feed(output, 5, start=1, keyframe_every=100)
+        sink = MagicMock()
+
+        output.add_sink("capture", sink, preroll=True)
+
+        assert not sink.outputframe.called
+        assert output.buffered_seconds() == 0.0
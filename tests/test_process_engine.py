@@ -0,0 +1,142 @@
+import os
+import time
+import numpy as np
+import pytest
+from unittest.mock import patch
+from detection.process_engine import ProcessDetectionEngine, SharedFrameRing
+
+
+class SumDetector:
+    """Returns the sum of the frame, so tests can check the worker saw the right pixels."""
+    def detect(self, frame):
+        return int(frame.sum())
+
+    def detect_region(self, frame, roi):
+        return int(frame[roi[0]:roi[1]].sum())
+
+
+class CrashingDetector:
+    def detect(self, frame):
+        if frame[0, 0] == 1:
+            os._exit(1)
+        return "ok"
+
+
+class SlowStartDetector:
+    """Takes a while to load, like a detector loading its model."""
+    def __init__(self):
+        time.sleep(1)
+
+    def detect(self, frame):
+        return "ok"
+
+
+class RaisingDetector:
+    def detect(self, frame):
+        raise ValueError("broken model")
+
+
+@pytest.fixture
+def mock_settings():
+    with patch('detection.process_engine.settings') as mock_settings:
+        mock_settings.frame_ring_slots = 2
+        mock_settings.worker_timeout = 10
+        mock_settings.worker_startup_timeout = 30
+        mock_settings.worker_stop_timeout = 2
+        mock_settings.worker_restart_delay = 0
+        yield mock_settings
+
+
+@pytest.fixture
+def make_engine(mock_settings):
+    engines = []
+    def make(detectors, wait: bool=True):
+        engine = ProcessDetectionEngine(detectors)
+        engines.append(engine)
+        if wait:
+            assert engine.wait_ready(30)
+        return engine
+    yield make
+    for engine in engines:
+        engine.cleanup()
+
+
+class TestSharedFrameRing:
+
+    def test_slots_are_reused_round_robin(self):
+        ring = SharedFrameRing(2, (4, 4, 3), np.uint8)
+        try:
+            slots = [ring.write(np.full((4, 4, 3), i, np.uint8)) for i in range(3)]
+
+            assert slots == [0, 1, 0]
+            assert SharedFrameRing.view(ring._memory, 0, ring.shape, ring.dtype)[0, 0, 0] == 2
+            assert SharedFrameRing.view(ring._memory, 1, ring.shape, ring.dtype)[0, 0, 0] == 1
+        finally:
+            ring.close()
+
+
+class TestProcessDetectionEngine:
+
+    def test_detector_runs_in_worker(self, make_engine):
+        engine = make_engine({"sum": (SumDetector, None)})
+        detector = engine.proxy("sum")
+        frame = np.ones((8, 8, 3), np.uint8)
+
+        assert detector.detect(frame) == 8 * 8 * 3
+        assert detector.detect_region(frame, (0, 2)) == 2 * 8 * 3
+        assert engine.stats["sum"]["calls"] == 2
+        assert engine.stats["sum"]["failures"] == 0
+
+
+    def test_frame_is_published_once(self, make_engine):
+        engine = make_engine({"sum": (SumDetector, None)})
+        frame = np.ones((8, 8, 3), np.uint8)
+
+        engine.call("sum", "detect", frame)
+        engine.call("sum", "detect", frame)
+
+        assert engine._ring._next == 1
+
+
+    def test_crashed_worker_is_restarted(self, make_engine):
+        engine = make_engine({"crash": (CrashingDetector, "empty")})
+        frame = np.zeros((4, 4), np.uint8)
+
+        crash_frame = frame.copy()
+        crash_frame[0, 0] = 1
+
+        assert engine.call("crash", "detect", crash_frame) == "empty"
+        assert engine.wait_ready(30)
+        assert engine.call("crash", "detect", frame) == "ok"
+        assert engine.stats["crash"]["restarts"] == 1
+
+
+    def test_starting_worker_does_not_block(self, make_engine):
+        engine = make_engine({"slow": (SlowStartDetector, "empty")}, wait=False)
+        frame = np.zeros((4, 4), np.uint8)
+
+        start = time.monotonic()
+        assert engine.call("slow", "detect", frame) == "empty"
+        assert time.monotonic() - start < 0.5
+        assert engine.stats["slow"]["not_ready"] == 1
+
+        assert engine.wait_ready(30)
+        assert engine.call("slow", "detect", frame) == "ok"
+        assert engine.stats["slow"]["restarts"] == 0
+
+
+    def test_worker_not_starting_in_time_is_restarted(self, make_engine, mock_settings):
+        mock_settings.worker_startup_timeout = 0
+        engine = make_engine({"slow": (SlowStartDetector, "empty")}, wait=False)
+        time.sleep(0.05)
+
+        assert engine.call("slow", "detect", np.zeros((4, 4), np.uint8)) == "empty"
+        assert engine.stats["slow"]["restarts"] == 1
+
+
+    def test_exception_in_detector_keeps_worker(self, make_engine):
+        engine = make_engine({"raise": (RaisingDetector, False)})
+
+        assert engine.call("raise", "detect", np.zeros((4, 4), np.uint8)) is False
+        assert engine.stats["raise"]["failures"] == 1
+        assert engine.stats["raise"]["restarts"] == 0
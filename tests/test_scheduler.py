@@ -0,0 +1,68 @@
+import pytest
+from unittest.mock import patch
+from scheduler import DetectionScheduler
+
+
+@pytest.fixture
+def mock_settings():
+    with patch('scheduler.settings') as mock_settings:
+        mock_settings.min_detection_interval = 0.1
+        mock_settings.idle_max_interval = 2
+        mock_settings.idle_backoff_factor = 2
+        mock_settings.opened_check_interval = 1
+        mock_settings.capture_check_interval = 0.5
+        yield mock_settings
+
+
+class TestDetectionScheduler:
+
+    def test_fast_polling_on_activity(self, mock_settings):
+        scheduler = DetectionScheduler()
+
+        assert scheduler.next_interval("closed", activity=True) == 0.1
+
+
+    def test_idle_backoff(self, mock_settings):
+        scheduler = DetectionScheduler()
+
+        intervals = [scheduler.next_interval("closed", activity=False) for _ in range(6)]
+
+        assert intervals == [0.2, 0.4, 0.8, 1.6, 2, 2]
+
+
+    def test_activity_resets_backoff(self, mock_settings):
+        scheduler = DetectionScheduler()
+        for _ in range(5):
+            scheduler.next_interval("closed", activity=False)
+
+        assert scheduler.next_interval("closed", activity=True) == 0.1
+        assert scheduler.next_interval("closed", activity=False) == 0.2
+
+
+    def test_fast_polling_after_cover_closed(self, mock_settings):
+        scheduler = DetectionScheduler()
+        scheduler.next_interval("capture", activity=True)
+
+        assert scheduler.next_interval("closed", activity=False) == 0.1
+
+
+    def test_state_intervals(self, mock_settings):
+        scheduler = DetectionScheduler()
+
+        assert scheduler.next_interval("capture", activity=False) == 0.5
+        assert scheduler.next_interval("opened", activity=True) == 1
+        assert scheduler.stats == {"state": "opened", "interval": 1, "rate": 1.0}
+
+
+    def test_unknown_state(self, mock_settings):
+        scheduler = DetectionScheduler()
+
+        with pytest.raises(ValueError):
+            scheduler.next_interval("sleeping", activity=False)
+
+
+    def test_non_positive_min_interval(self, mock_settings):
+        mock_settings.min_detection_interval = 0
+
+        with pytest.raises(ValueError):
+            DetectionScheduler()
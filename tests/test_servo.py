@@ -0,0 +1,125 @@
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from servo import Servo
+
+
+@pytest.fixture
+def mock_settings():
+    with patch('servo.settings') as mock_settings:
+        mock_settings.servo_pin = 14
+        mock_settings.servo_speed = "fast"
+        mock_settings.open_angle = 180
+        mock_settings.close_angle = 0
+        yield mock_settings
+
+
+@pytest.fixture
+def mock_gpio():
+    with patch('servo.GPIO') as mock_gpio:
+        yield mock_gpio
+
+
+@pytest.fixture
+def steps():
+    """Step sleeps of the motion thread wait on this semaphore, so the test decides when the servo moves."""
+    semaphore = threading.Semaphore(0)
+    def sleep(seconds):
+        if threading.current_thread().name == "servo":
+            assert semaphore.acquire(timeout=5), "servo step not released"
+    with patch('servo.sleep', side_effect=sleep):
+        yield semaphore
+
+
+@pytest.fixture
+def servo(mock_settings, mock_gpio, steps):
+    servo = Servo()
+    yield servo
+    steps.release(100)
+    servo.cleanup()
+
+
+def angles(mock_gpio):
+    """Angles the servo was driven to, from the duty cycles without the idle zeros."""
+    pwm = mock_gpio.PWM.return_value
+    return [round((call.args[0] - 2.5) * 18) for call in pwm.ChangeDutyCycle.call_args_list if call.args[0]]
+
+
+def wait_for(condition, timeout: float=5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met"
+        time.sleep(0.001)
+
+
+class TestServo:
+
+    def test_starts_closed(self, servo, mock_gpio):
+        assert servo.angle == 0
+        assert not servo.cover_opened
+        assert not servo.moving
+        assert angles(mock_gpio) == [0]
+
+
+    def test_open_cover_does_not_block(self, servo, steps):
+        servo.open_cover()
+
+        # No step was allowed yet, still the call returned
+        assert servo.cover_opened
+        assert servo.moving
+        assert not servo.wait_motion(timeout=0.05)
+
+        steps.release(36)
+        assert servo.wait_motion(timeout=5)
+        assert not servo.moving
+        assert servo.angle == 180
+
+
+    def test_close_cover_does_not_block(self, servo, steps):
+        servo.open_cover()
+        steps.release(36)
+        servo.wait_motion(timeout=5)
+
+        servo.close_cover()
+
+        assert not servo.cover_opened
+        assert servo.moving
+        steps.release(36)
+        assert servo.wait_motion(timeout=5)
+        assert servo.angle == 0
+
+
+    def test_reversal_mid_move_goes_back(self, servo, mock_gpio, steps):
+        servo.open_cover()
+        steps.release(10)
+        wait_for(lambda: servo.angle == 50)
+
+        servo.close_cover()
+        steps.release(100)
+        assert servo.wait_motion(timeout=5)
+
+        path = angles(mock_gpio)[1:]
+        turn = path.index(max(path))
+        assert max(path) < 180
+        assert path[:turn + 1] == list(range(0, max(path) + 1, 5))
+        assert path[turn + 1:] == list(range(max(path) - 5, 0, -5))
+        assert servo.angle == 0
+
+
+    def test_cleanup_finishes_movement(self, mock_settings, mock_gpio, steps):
+        servo = Servo()
+        servo.open_cover()
+        steps.release(3)
+        wait_for(lambda: servo.angle == 15)
+
+        # The stop command is queued while the cover is still moving
+        threading.Timer(0.05, steps.release, args=(100,)).start()
+        servo.cleanup()
+
+        assert not servo._thread.is_alive()
+        assert servo.angle == 180
+        assert not servo.moving
+        pwm = mock_gpio.PWM.return_value
+        assert pwm.stop.called
+        mock_gpio.cleanup.assert_called_once_with(14)
@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from detection.squirrel_detection import CascadeSquirrelDetector, SquirrelDetections, SquirrelDetector
+
+
+@pytest.fixture
+def mock_settings():
+    with patch('detection.squirrel_detection.settings') as mock_settings:
+        mock_settings.cascade_low_score = 0.5
+        mock_settings.cascade_high_score = 0.9
+        mock_settings.min_conf_threshhold = 0.5
+        mock_settings.show_preview = False
+        yield mock_settings
+
+
+@pytest.fixture
+def labels(mock_settings, tmp_path):
+    path = tmp_path / "labelmap.txt"
+    path.write_text("person\nbird\nsquirrel\ncat\n")
+    mock_settings.squirrel_labels_path = str(path)
+    return path
+
+
+@pytest.fixture
+def mock_interpreter():
+    """SSD interpreter with a 32x32 RGB input returning the outputs set in interpreter.outputs."""
+    with patch('detection.squirrel_detection.create_interpreter') as mock_create:
+        interpreter = mock_create.return_value
+        interpreter.get_input_details.return_value = [{"index": 0, "shape": [1, 32, 32, 3]}]
+        interpreter.get_output_details.return_value = [{"index": 1}, {"index": 2}, {"index": 3}]
+        interpreter.input = np.zeros((1, 32, 32, 3), np.uint8)
+        interpreter.tensor.return_value = lambda: interpreter.input
+        interpreter.outputs = {}
+        interpreter.get_tensor.side_effect = lambda index: interpreter.outputs[index]
+        yield interpreter
+
+
+def set_outputs(interpreter, boxes, classes, scores) -> None:
+    interpreter.outputs = {1: np.array([boxes], np.float32),
+                           2: np.array([classes], np.float32),
+                           3: np.array([scores], np.float32)}
+
+
+@pytest.fixture
+def mock_classifier():
+    with patch('detection.squirrel_detection.CustomSquirrelDetector') as mock_class:
+        yield mock_class.return_value
+
+
+@pytest.fixture
+def mock_detector():
+    with patch('detection.squirrel_detection.SquirrelDetector') as mock_class:
+        detector = mock_class.return_value
+        detector.squirrel_class_ids = np.array([3])
+        detector.detect.return_value = SquirrelDetections(boxes=np.array([[0.1, 0.1, 0.5, 0.5]]),
+                                                          scores=np.array([0.8]),
+                                                          class_ids=np.array([3]),
+                                                          is_squirrel=np.array([True]))
+        yield detector
+
+
+@pytest.fixture
+def frame():
+    return np.zeros((48, 64, 3), np.uint8)
+
+
+class TestCascadeSquirrelDetector:
+
+    def test_low_score_skips_detector(self, mock_settings, mock_classifier, mock_detector, frame):
+        mock_classifier.score.return_value = 0.1
+        cascade = CascadeSquirrelDetector(need_boxes=True)
+
+        detections = cascade.detect(frame)
+
+        assert not detections
+        assert not mock_detector.detect.called
+        assert cascade.stats["rejected"] == 1
+        assert cascade.stats["classifier_hit_rate"] == 1.0
+
+
+    def test_uncertain_score_escalates(self, mock_settings, mock_classifier, mock_detector, frame):
+        mock_classifier.score.return_value = 0.7
+        cascade = CascadeSquirrelDetector(need_boxes=False)
+
+        detections = cascade.detect(frame)
+
+        assert detections is mock_detector.detect.return_value
+        assert cascade.stats["escalated"] == 1
+        assert cascade.stats["detector_found"] == 1
+        assert cascade.stats["detector_runs"] == 1
+
+
+    def test_confident_score_without_boxes(self, mock_settings, mock_classifier, mock_detector, frame):
+        mock_classifier.score.return_value = 0.95
+        cascade = CascadeSquirrelDetector(need_boxes=False)
+
+        detections = cascade.detect(frame)
+
+        assert detections
+        assert np.array_equal(detections.squirrel_boxes, [[0.0, 0.0, 1.0, 1.0]])
+        assert not mock_detector.detect.called
+        assert cascade.stats["accepted"] == 1
+
+
+    def test_confident_score_escalates_when_boxes_needed(self, mock_settings, mock_classifier, mock_detector, frame):
+        mock_classifier.score.return_value = 0.95
+        cascade = CascadeSquirrelDetector(need_boxes=True)
+
+        cascade.detect(frame)
+
+        assert mock_detector.detect.called
+        assert cascade.stats["classifier_hit_rate"] == 0.0
+
+
+    def test_region_uses_detector(self, mock_settings, mock_classifier, mock_detector, frame):
+        cascade = CascadeSquirrelDetector()
+        roi = np.array([0.0, 0.0, 0.5, 0.5])
+
+        cascade.detect_region(frame, roi)
+
+        mock_detector.detect_region.assert_called_once_with(frame, roi)
+        assert not mock_classifier.score.called
+
+
+
+class TestSquirrelDetector:
+
+    def test_region_boxes_mapped_to_frame(self, mock_settings, labels, mock_interpreter):
+        detector = SquirrelDetector()
+        frame = np.zeros((48, 64, 3), np.uint8)
+        frame[12:36, 32:64] = 255
+        set_outputs(mock_interpreter, [[0.0, 0.0, 0.5, 0.5], [0.5, 0.5, 1.0, 1.0]], [2, 2], [0.9, 0.8])
+
+        detections = detector.detect_region(frame, np.array([0.25, 0.5, 0.75, 1.0]))
+
+        # Only the region was given to the model
+        assert (mock_interpreter.input == 255).all()
+        assert np.allclose(detections.squirrel_boxes, [[0.25, 0.5, 0.5, 0.75], [0.5, 0.75, 0.75, 1.0]])
+        assert np.allclose(detections.squirrel_scores, [0.9, 0.8])
+
+
+    def test_detect_filters_confident_squirrels(self, mock_settings, labels, mock_interpreter):
+        detector = SquirrelDetector()
+        set_outputs(mock_interpreter,
+                    [[0.1, 0.1, 0.3, 0.3], [0.2, 0.2, 0.4, 0.4], [0.5, 0.5, 0.9, 0.9], [0.0, 0.0, 1.0, 1.0], [0.6, 0.6, 0.7, 0.7]],
+                    [2, 2, 1, 2, 2],
+                    [0.9, 0.3, 0.8, 1.5, 0.6])
+
+        detections = detector.detect(np.zeros((48, 64, 3), np.uint8))
+
+        assert detections
+        # Low and invalid scores are dropped, the bird is kept but is not a squirrel
+        assert np.allclose(detections.scores, [0.9, 0.8, 0.6])
+        assert np.array_equal(detections.class_ids, [2, 1, 2])
+        assert np.allclose(detections.squirrel_boxes, [[0.1, 0.1, 0.3, 0.3], [0.6, 0.6, 0.7, 0.7]])
+        assert np.allclose(detections.squirrel_scores, [0.9, 0.6])
+
+
+    def test_detect_without_squirrels(self, mock_settings, labels, mock_interpreter):
+        detector = SquirrelDetector()
+        set_outputs(mock_interpreter, [[0.1, 0.1, 0.3, 0.3]], [1], [0.9])
+
+        detections = detector.detect(np.zeros((48, 64, 3), np.uint8))
+
+        assert not detections
+        assert len(detections.boxes) == 1
+        assert detections.squirrel_boxes.shape == (0, 4)
+
+
+    def test_labelmap_without_squirrel(self, mock_settings, labels, mock_interpreter):
+        labels.write_text("person\nbird\n")
+        detector = SquirrelDetector()
+        set_outputs(mock_interpreter, [[0.1, 0.1, 0.3, 0.3], [0.5, 0.5, 0.9, 0.9]], [0, 1], [0.9, 0.8])
+
+        detections = detector.detect(np.zeros((48, 64, 3), np.uint8))
+
+        assert len(detector.squirrel_class_ids) == 0
+        assert not detections
+        assert len(detections.squirrel_scores) == 0
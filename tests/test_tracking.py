@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+from unittest.mock import patch
+from detection.tracking import SquirrelTracker, centroid_distance, iou
+
+
+@pytest.fixture
+def mock_settings():
+    with patch('detection.tracking.settings') as mock_settings:
+        mock_settings.roi_margin = 0.5
+        mock_settings.roi_min_size = 0.3
+        mock_settings.roi_iou_threshold = 0.3
+        mock_settings.roi_max_centroid_distance = 0.25
+        mock_settings.roi_min_confidence = 0.6
+        mock_settings.roi_full_detection_interval = 3
+        yield mock_settings
+
+
+@pytest.fixture
+def tracker(mock_settings):
+    return SquirrelTracker()
+
+
+def boxes(*rows):
+    return np.array(rows, np.float32)
+
+
+class TestGeometry:
+
+    def test_iou(self):
+        box = np.array([0.0, 0.0, 0.4, 0.4])
+
+        assert iou(box, box) == pytest.approx(1.0)
+        assert iou(box, np.array([0.0, 0.2, 0.4, 0.6])) == pytest.approx(1 / 3)
+        assert iou(box, np.array([0.5, 0.5, 0.9, 0.9])) == 0.0
+
+
+    def test_iou_of_empty_boxes(self):
+        box = np.array([0.2, 0.2, 0.2, 0.2])
+
+        assert iou(box, box) == 0.0
+
+
+    def test_centroid_distance(self):
+        assert centroid_distance(np.array([0.0, 0.0, 0.2, 0.2]), np.array([0.3, 0.4, 0.5, 0.6])) == pytest.approx(0.5)
+
+
+class TestSquirrelTracker:
+
+    def test_first_detection_takes_best_box(self, tracker):
+        tracker.update(boxes([0.1, 0.1, 0.3, 0.3], [0.5, 0.5, 0.7, 0.7]), np.array([0.7, 0.9]), full_frame=True)
+
+        assert np.allclose(tracker.box, [0.5, 0.5, 0.7, 0.7])
+        assert tracker.confidence == pytest.approx(0.9)
+
+
+    def test_associates_by_iou(self, tracker):
+        tracker.update(boxes([0.4, 0.4, 0.6, 0.6]), np.array([0.9]), full_frame=True)
+
+        # The more confident box is far away, the overlapping one keeps the track
+        tracker.update(boxes([0.0, 0.0, 0.1, 0.1], [0.42, 0.42, 0.62, 0.62]), np.array([0.95, 0.8]), full_frame=False)
+
+        assert np.allclose(tracker.box, [0.42, 0.42, 0.62, 0.62])
+        assert tracker.confidence == pytest.approx(0.8)
+
+
+    def test_associates_by_centroid_with_lower_confidence(self, tracker):
+        tracker.update(boxes([0.4, 0.4, 0.5, 0.5]), np.array([0.9]), full_frame=True)
+
+        # No overlap, centroid moved by 0.1 of the 0.25 limit
+        tracker.update(boxes([0.5, 0.4, 0.6, 0.5]), np.array([0.9]), full_frame=False)
+
+        assert np.allclose(tracker.box, [0.5, 0.4, 0.6, 0.5])
+        assert tracker.confidence == pytest.approx(0.9 * (1 - 0.1 / 0.25))
+
+
+    def test_lost_when_too_far(self, tracker):
+        tracker.update(boxes([0.0, 0.0, 0.1, 0.1]), np.array([0.9]), full_frame=True)
+
+        tracker.update(boxes([0.8, 0.8, 0.9, 0.9]), np.array([0.9]), full_frame=False)
+
+        assert tracker.box is None
+        assert tracker.region_of_interest() is None
+
+
+    def test_lost_without_boxes(self, tracker):
+        tracker.update(boxes([0.4, 0.4, 0.6, 0.6]), np.array([0.9]), full_frame=True)
+
+        tracker.update(np.empty((0, 4)), np.empty(0), full_frame=False)
+
+        assert tracker.box is None
+
+
+class TestRegionOfInterest:
+
+    def test_no_region_without_track(self, tracker):
+        assert tracker.region_of_interest() is None
+
+
+    def test_region_adds_margin(self, tracker):
+        tracker.update(boxes([0.2, 0.3, 0.6, 0.7]), np.array([0.9]), full_frame=True)
+
+        assert np.allclose(tracker.region_of_interest(), [0.0, 0.1, 0.8, 0.9])
+
+
+    def test_small_box_grows_to_min_size(self, tracker):
+        tracker.update(boxes([0.45, 0.45, 0.5, 0.5]), np.array([0.9]), full_frame=True)
+
+        roi = tracker.region_of_interest()
+
+        assert np.allclose(roi[2:] - roi[:2], [0.3, 0.3])
+        assert np.allclose((roi[:2] + roi[2:]) / 2, [0.475, 0.475])
+
+
+    def test_region_clamped_to_frame(self, tracker):
+        tracker.update(boxes([0.0, 0.8, 0.2, 1.0]), np.array([0.9]), full_frame=True)
+
+        roi = tracker.region_of_interest()
+
+        assert np.allclose(roi, [0.0, 0.7, 0.3, 1.0])
+
+
+    def test_full_detection_forced_every_interval(self, tracker):
+        box = boxes([0.4, 0.4, 0.6, 0.6])
+        tracker.update(box, np.array([0.9]), full_frame=True)
+
+        for _ in range(2):
+            assert tracker.region_of_interest() is not None
+            tracker.update(box, np.array([0.9]), full_frame=False)
+        tracker.update(box, np.array([0.9]), full_frame=False)
+
+        assert tracker.region_of_interest() is None
+        tracker.update(box, np.array([0.9]), full_frame=True)
+        assert tracker.region_of_interest() is not None
+
+
+    def test_full_detection_forced_on_low_confidence(self, tracker):
+        tracker.update(boxes([0.4, 0.4, 0.6, 0.6]), np.array([0.5]), full_frame=True)
+
+        assert tracker.region_of_interest() is None
@@ -0,0 +1,85 @@
+import pytest
+from unittest.mock import patch
+from detection.tuning import benchmark_interpreter, tune_detectors
+
+
+@pytest.fixture
+def mock_settings():
+    with patch('detection.tuning.settings') as mock_settings:
+        mock_settings.tflite_delegate = "auto"
+        mock_settings.tune_warmup_runs = 1
+        mock_settings.tune_runs = 3
+        yield mock_settings
+
+
+@pytest.fixture
+def mock_models():
+    with patch('detection.tuning._models', return_value=["ssd.tflite"]) as mock_models, \
+         patch('detection.tuning.os.cpu_count', return_value=2):
+        yield mock_models
+
+
+@pytest.fixture
+def mock_set_tuned():
+    with patch('detection.tuning.set_tuned_interpreter_options') as mock_set:
+        yield mock_set
+
+
+@pytest.fixture
+def mock_benchmark():
+    timings = {(1, "xnnpack"): 30.0, (2, "xnnpack"): 20.0, (1, "none"): 40.0, (2, "none"): 35.0}
+    with patch('detection.tuning.benchmark_interpreter') as mock_benchmark:
+        mock_benchmark.side_effect = lambda model_path, num_threads, delegate: timings[(num_threads, delegate)]
+        mock_benchmark.timings = timings
+        yield mock_benchmark
+
+
+class TestTuneDetectors:
+
+    def test_saves_fastest_options(self, mock_settings, mock_models, mock_set_tuned, mock_benchmark):
+        tune_detectors()
+
+        assert mock_benchmark.call_count == 4
+        mock_set_tuned.assert_called_once_with("ssd.tflite", {"num_threads": 2, "delegate": "xnnpack"})
+
+
+    def test_configured_delegate_is_benchmarked(self, mock_settings, mock_models, mock_set_tuned, mock_benchmark):
+        mock_settings.tflite_delegate = "libedgetpu.so.1"
+        mock_benchmark.timings.update({(1, "libedgetpu.so.1"): 5.0, (2, "libedgetpu.so.1"): 6.0})
+
+        tune_detectors()
+
+        mock_set_tuned.assert_called_once_with("ssd.tflite", {"num_threads": 1, "delegate": "libedgetpu.so.1"})
+
+
+    def test_missing_delegate_is_skipped(self, mock_settings, mock_models, mock_set_tuned, mock_benchmark):
+        mock_settings.tflite_delegate = "libmissing.so"
+        timings = mock_benchmark.timings
+        def benchmark(model_path, num_threads, delegate):
+            if delegate == "libmissing.so":
+                raise ValueError("missing")
+            return timings[(num_threads, delegate)]
+        mock_benchmark.side_effect = benchmark
+
+        tune_detectors()
+
+        mock_set_tuned.assert_called_once_with("ssd.tflite", {"num_threads": 2, "delegate": "xnnpack"})
+
+
+    def test_nothing_saved_without_models(self, mock_settings, mock_models, mock_set_tuned, mock_benchmark):
+        mock_models.return_value = []
+
+        tune_detectors()
+
+        assert not mock_benchmark.called
+        assert not mock_set_tuned.called
+
+
+    def test_benchmark_does_not_fall_back(self, mock_settings):
+        with patch('detection.tuning.create_interpreter') as mock_create:
+            mock_create.return_value.get_input_details.return_value = [{"index": 0, "shape": [1, 8, 8, 3], "dtype": "uint8"}]
+
+            benchmark_interpreter("ssd.tflite", 2, "libedgetpu.so.1")
+
+        mock_create.assert_called_once_with("ssd.tflite", 2, "libedgetpu.so.1", fallback=False)
+        assert mock_create.return_value.invoke.call_count == 4
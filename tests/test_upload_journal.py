@@ -0,0 +1,153 @@
+import threading
+import pytest
+
+from upload_journal import UploadJournal, Visit
+
+
+class TestUploadJournal:
+
+    @pytest.fixture
+    def journal(self, tmp_path):
+        journal = UploadJournal(str(tmp_path / "journal.sqlite3"))
+        yield journal
+        journal.close()
+
+
+    def test_states_and_order(self, journal):
+        journal.add("b", 0, "ready", 10)
+        journal.add("a", 1)
+        journal.add("b", 5) # already journaled
+
+        assert journal.next_visit() == 2
+        assert [clip.name for clip in journal.clips("ready")] == ["b"]
+        assert journal.clips("recording", visit=0) == []
+
+        journal.set_state("a", "ready", size=3)
+        assert [clip.name for clip in journal.clips("ready")] == ["b", "a"]
+        assert journal.stats == {"ready": {"files": 2, "bytes": 13}}
+
+
+    def test_upload_attempts(self, journal):
+        journal.add("a", 0, "ready")
+        journal.set_state("a", "uploading")
+        journal.set_state("a", "ready", error="timeout")
+        journal.set_state("a", "uploading")
+
+        clip = journal.get("a")
+        assert clip.attempts == 2
+        assert clip.last_error is None
+
+
+    def test_unknown_state(self, journal):
+        with pytest.raises(ValueError):
+            journal.add("a", 0, "sent")
+
+
+    def test_recover(self, journal, tmp_path):
+        existing = str(tmp_path / "0.mp4")
+        with open(existing, "wb") as f:
+            f.write(b"1234")
+        journal.add(existing, 0, "uploading")
+        journal.add("missing.mp4", 1)
+        journal.add("old.mp4", 2, "uploaded")
+        journal.add("new.mp4", 3, "uploaded")
+        journal._execute("UPDATE clips SET updated = 0 WHERE name = 'old.mp4'")
+
+        journal.recover(keep_uploaded_seconds=3600)
+
+        assert journal.get(existing).state == "ready"
+        assert journal.get(existing).size == 4
+        assert journal.get("missing.mp4") is None
+        assert journal.get("old.mp4") is None
+        assert journal.get("new.mp4").state == "uploaded"
+
+
+    def test_upload_url(self, journal):
+        journal.add("a", 0, "ready")
+        journal.set_upload_url("a", "http://server/uploads/1")
+
+        assert journal.get("a").upload_url == "http://server/uploads/1"
+
+
+    def test_visits(self, journal):
+        journal.set_visit(Visit(4, 100.0, 12.5, 0.9, 0.7))
+
+        assert journal.get_visit(4) == Visit(4, 100.0, 12.5, 0.9, 0.7)
+        assert journal.get_visit(5) is None
+        # A visit without files still takes its number
+        assert journal.next_visit() == 5
+
+
+    @pytest.mark.parametrize("order, expected", [
+        ("oldest",     ["0_000", "0_001", "1", "2"]),
+        ("newest",     ["2", "1", "0_000", "0_001"]),
+        ("confidence", ["1", "0_000", "0_001", "2"]),
+        ("smallest",   ["2", "1", "0_000", "0_001"]),
+    ])
+    def test_orders(self, journal, order, expected):
+        journal.add("0_000", 0, "ready", 300)
+        journal.add("0_001", 0, "ready", 100)
+        journal.add("1", 1, "ready", 200)
+        journal.add("2", 2, "ready", 50)
+        journal.set_visit(Visit(0, 100.0, 20, 0.8, 0.6))
+        journal.set_visit(Visit(1, 200.0, 10, 0.95, 0.9))
+        journal.set_visit(Visit(2, 300.0, 5, None, None))
+
+        assert [clip.name for clip in journal.clips("ready", order=order)] == expected
+
+
+    @pytest.mark.parametrize("order", ["newest", "confidence", "smallest"])
+    def test_orders_keep_files_of_visit_in_order(self, journal, order):
+        # The last segment of a visit is short and visit 1 has no metadata
+        journal.add("0_000", 0, "ready", 500)
+        journal.add("0_001", 0, "ready", 500)
+        journal.add("0_002", 0, "ready", 10)
+        journal.add("1_000", 1, "ready", 600)
+        journal.add("1_001", 1, "ready", 20)
+        journal.set_visit(Visit(0, 100.0, 30, 0.8, 0.6))
+
+        names = [clip.name for clip in journal.clips("ready", order=order)]
+
+        assert [name for name in names if name.startswith("0_")] == ["0_000", "0_001", "0_002"]
+        assert [name for name in names if name.startswith("1_")] == ["1_000", "1_001"]
+        # Files of a visit are not interleaved with other visits
+        assert names in (["0_000", "0_001", "0_002", "1_000", "1_001"],
+                         ["1_000", "1_001", "0_000", "0_001", "0_002"])
+
+
+    def test_unknown_order(self, journal):
+        with pytest.raises(ValueError):
+            journal.clips("ready", order="random")
+
+
+    def test_pending(self, journal):
+        journal.add("0_000", 0, "uploaded")
+        journal.add("0_001", 0, "uploading")
+        journal.add("0", 0, "ready")
+        journal.add("1", 1, "ready")
+
+        assert [clip.name for clip in journal.pending(0)] == ["0_001", "0"]
+
+
+    def test_concurrent_threads(self, journal):
+        errors = []
+        def work(worker):
+            try:
+                for i in range(200):
+                    name = f"{worker}_{i}"
+                    journal.add(name, worker, "ready", i)
+                    journal.set_state(name, "uploading")
+                    assert journal.get(name).state == "uploading"
+                    journal.clips("ready", order="smallest")
+                    journal.next_visit()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert journal.stats == {"uploading": {"files": 800, "bytes": 4 * sum(range(200))}}
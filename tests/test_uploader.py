@@ -0,0 +1,225 @@
+import pytest
+import requests
+import time
+from unittest.mock import patch
+
+from uploader import (Backoff, MultipartFile, PeakRss, ResumableUploader, TokenBucket, UploadError,
+                      UploadNotSupported, encode_metadata)
+from upload_server import UploadServer, decode_metadata
+
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "3.mp4"
+    path.write_bytes(DATA)
+    return str(path)
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = UploadServer(str(tmp_path / "received"), seed=0).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def uploader(server):
+    return ResumableUploader(server.url, chunk_size=1000, timeout=5)
+
+
+def received(server, tmp_path):
+    return (tmp_path / "received" / "feeder" / "3.mp4").read_bytes()
+
+
+def upload_until_done(uploader, video, attempts=100):
+    """Retry the upload the way VideoStorage does, keeping the upload URL."""
+    url = None
+    def created(new_url):
+        nonlocal url
+        url = new_url
+    for _ in range(attempts):
+        try:
+            return uploader.upload(video, {"filename": "3.mp4", "id": "feeder"}, url, on_created=created)
+        except (UploadError, requests.RequestException):
+            pass
+    raise AssertionError("upload didn't finish")
+
+
+class TestResumableUploader:
+
+    def test_metadata_round_trip(self):
+        metadata = {"filename": "1_002.mp4", "id": "feeder id"}
+        assert decode_metadata(encode_metadata(metadata)) == metadata
+
+
+    def test_upload(self, server, uploader, video, tmp_path):
+        created = []
+
+        url = uploader.upload(video, {"filename": "3.mp4", "id": "feeder"}, on_created=created.append)
+
+        assert created == [url]
+        assert received(server, tmp_path) == DATA
+        assert uploader.stats["chunks"] == 11
+        assert uploader.stats["bytes_sent"] == len(DATA)
+
+
+    def test_resume_after_dropped_connections(self, server, uploader, video, tmp_path):
+        server.drop_rate = 0.3
+
+        upload_until_done(uploader, video)
+
+        assert received(server, tmp_path) == DATA
+        assert server.stats["dropped"] > 0
+        assert server.stats["created"] == 1
+        # Only dropped chunks were sent again
+        assert uploader.stats["bytes_sent"] == len(DATA)
+        assert uploader.stats["bytes_resumed"] > 0
+
+
+    def test_corrupted_and_failed_chunks_are_sent_again(self, server, uploader, video, tmp_path):
+        server.corrupt_rate = 0.4
+        server.fail_rate = 0.2
+
+        upload_until_done(uploader, video)
+
+        assert received(server, tmp_path) == DATA
+        assert uploader.stats["checksum_mismatches"] == server.stats["corrupted"] > 0
+
+
+    def test_resume_saved_upload(self, server, uploader, video, tmp_path):
+        url = uploader.create(len(DATA), {"filename": "3.mp4", "id": "feeder"})
+        with open(video, "rb") as f:
+            uploader._send_chunk(url, 0, f.read(3000))
+
+        # e.g. after a restart with the URL from the journal
+        uploader = ResumableUploader(server.url, chunk_size=1000, timeout=5)
+        uploader.upload(video, {}, url)
+
+        assert received(server, tmp_path) == DATA
+        assert uploader.stats["bytes_resumed"] == 3000
+        assert uploader.stats["bytes_sent"] == len(DATA) - 3000
+
+
+    def test_unknown_upload_starts_again(self, server, uploader, video, tmp_path):
+        created = []
+
+        uploader.upload(video, {"filename": "3.mp4", "id": "feeder"}, f"{server.url}/uploads/lost",
+                        on_created=created.append)
+
+        assert len(created) == 1
+        assert received(server, tmp_path) == DATA
+
+
+    def test_lost_answer_is_resynchronized(self, server, uploader, video, tmp_path):
+        url = uploader.create(len(DATA), {"filename": "3.mp4", "id": "feeder"})
+        with open(video, "rb") as f:
+            uploader._send_chunk(url, 0, f.read(1000))
+
+        # The answer to the first chunk was lost, the client sends it again
+        assert uploader._send_chunk(url, 0, DATA[:1000]) == 1000
+        assert uploader.stats["offset_conflicts"] == 1
+
+
+    def test_not_supported(self, uploader, video):
+        with patch.object(uploader.session, 'post') as mock_post:
+            mock_post.return_value.status_code = 404
+            with pytest.raises(UploadNotSupported):
+                uploader.upload(video, {})
+
+
+    def test_server_statistics(self, server, uploader, video):
+        uploader.upload(video, {"filename": "3.mp4", "id": "feeder"})
+
+        stats = requests.get(f"{server.url}/stats", timeout=5).json()
+        assert stats["completed"] == 1
+        assert stats["bytes"] == len(DATA)
+
+
+    def test_connections_are_kept_alive(self, server, uploader, video):
+        uploader.upload(video, {"filename": "3.mp4", "id": "feeder"})
+
+        assert server.stats["chunks"] == 11
+        assert server.stats["connections"] == 1
+
+
+    def test_bandwidth_limit(self, server, video):
+        uploader = ResumableUploader(server.url, chunk_size=1000, timeout=5, bucket=TokenBucket(20000, burst=1000))
+
+        start = time.monotonic()
+        uploader.upload(video, {"filename": "3.mp4", "id": "feeder"})
+
+        # 10240 bytes at 20000 bytes per second after the first 1000
+        assert time.monotonic() - start >= 0.45
+        assert uploader.stats["throttled_seconds"] > 0
+
+
+class TestRetryHelpers:
+
+    def test_token_bucket_rate(self):
+        bucket = TokenBucket(100000, burst=10000)
+        start = time.monotonic()
+
+        for _ in range(4):
+            bucket.consume(10000)
+
+        elapsed = time.monotonic() - start
+        assert 0.28 <= elapsed < 1
+        assert bucket.throttled == pytest.approx(0.3, abs=0.05)
+
+
+    def test_unlimited_token_bucket(self):
+        bucket = TokenBucket(0)
+        bucket.consume(10 ** 12)
+        assert bucket.throttled == 0
+
+
+    def test_backoff_is_jittered_and_capped(self):
+        backoff = Backoff(base=1, maximum=10)
+
+        delays = [backoff.delay(attempt) for attempt in range(20) for _ in range(20)]
+
+        assert all(0 <= delay <= 10 for delay in delays)
+        assert len(set(delays)) > 1
+        assert max(backoff.delay(0) for _ in range(100)) <= 1
+
+
+class TestMultipartFile:
+
+    def test_same_body_as_requests(self, video):
+        with open(video, "rb") as f:
+            prepared = requests.Request("POST", "http://server/upload", data={"id": "feeder"},
+                                        files={"video": f}).prepare()
+        boundary = prepared.headers["Content-Type"].partition("boundary=")[2]
+
+        with MultipartFile({"id": "feeder"}, "video", video, boundary) as body:
+            assert len(body) == len(prepared.body)
+            assert body.content_type == prepared.headers["Content-Type"]
+            blocks = iter(lambda: body.read(1000), b"")
+            assert b"".join(blocks) == prepared.body
+
+
+    def test_streamed_upload(self, server, video, tmp_path):
+        with MultipartFile({"id": "feeder"}, "video", video) as body:
+            prepared = requests.Request("POST", f"{server.url}/upload", data=body).prepare()
+            # Sent with a length, not with chunked transfer encoding
+            assert prepared.headers["Content-Length"] == str(len(body))
+            assert prepared.body is body
+
+            r = requests.post(f"{server.url}/upload", data=body, headers={"Content-Type": body.content_type},
+                              timeout=5)
+
+        assert r.status_code == 200
+        assert received(server, tmp_path) == DATA
+
+
+    def test_peak_rss(self):
+        with PeakRss() as peak:
+            block = bytearray(32 * 1024 * 1024)
+            block[::4096] = b"x" * len(block[::4096]) # touch every page
+            time.sleep(0.05)
+        del block
+
+        assert peak.peak >= 30 * 1024 * 1024
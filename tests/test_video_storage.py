@@ -1,18 +1,14 @@
 import pytest
 import os
-from unittest.mock import patch, MagicMock, call, mock_open
+import threading
+import time
+from unittest.mock import patch, MagicMock
 
 from video_storage import VideoStorage
 from server_connection import ServerConnection
-
-
-@pytest.fixture
-def mock_os():
-    with patch('video_storage.os') as mock_os:
-        mock_os.path.exists.return_value = False
-        mock_os.path.join = os.path.join
-        mock_os.listdir.return_value = []
-        yield mock_os
+from upload_server import UploadServer
+from upload_journal import Visit
+from uploader import ThrottledReader
 
 
 @pytest.fixture
@@ -21,17 +17,21 @@ def mock_threading():
         mock_thread = MagicMock()
         mock_threading.Thread.return_value = mock_thread
         mock_lock = MagicMock()
+        mock_lock.locked.return_value = False
         mock_threading.Lock.return_value = mock_lock
+        mock_threading.Event.return_value.is_set.return_value = False
+        mock_threading.Event.return_value.wait.return_value = False
         yield mock_threading
 
 
 @pytest.fixture
-def mock_requests():
-    with patch('video_storage.requests') as mock_requests:
+def mock_session():
+    with patch('video_storage.create_session') as mock_create_session:
+        mock_session = mock_create_session.return_value
         mock_response = MagicMock()
         mock_response.status_code = 200
-        mock_requests.post.return_value = mock_response
-        yield mock_requests
+        mock_session.post.return_value = mock_response
+        yield mock_session
 
 
 @pytest.fixture
@@ -43,11 +43,23 @@ def mock_server_connection():
 
 
 @pytest.fixture
-def mock_settings():
+def mock_settings(tmp_path):
     with patch('video_storage.settings') as mock_settings:
-        mock_settings.video_folder = "test_videos"
+        mock_settings.video_folder = str(tmp_path / "test_videos")
         mock_settings.video_file_ext = "mp4"
         mock_settings.connection_timeout = 5
+        mock_settings.enable_segmented_recording = False
+        mock_settings.segment_duration = 10
+        mock_settings.upload_journal_path = str(tmp_path / "journal.sqlite3")
+        mock_settings.journal_keep_uploaded_days = 7
+        mock_settings.enable_resumable_upload = False
+        mock_settings.upload_chunk_size = 4
+        mock_settings.upload_workers = 1
+        mock_settings.upload_bandwidth_limit = 0
+        mock_settings.upload_max_attempts = 3
+        mock_settings.upload_backoff_base = 2
+        mock_settings.upload_backoff_max = 120
+        mock_settings.upload_priority = "newest"
         yield mock_settings
 
 
@@ -64,46 +76,106 @@ def mock_get_socket_address():
         yield mock_get_addr
 
 
+@pytest.fixture
+def mock_backoff_wait(mock_threading):
+    """Backoff wait of retried uploads, returns at once."""
+    yield mock_threading.Event.return_value.wait
+
+
+def video_path(settings, name):
+    return os.path.join(settings.video_folder, name)
+
+
+def record(storage, settings, data=b"video"):
+    """Record a file of the current visit and finish the visit."""
+    name = storage.get_new_video_name()
+    with open(name, "wb") as f:
+        f.write(data)
+    storage.go_to_next_video()
+    return name
+
+
 class TestVideoStorage:
     
-    def test_init_creates_directory(self, mock_os, mock_threading, mock_settings):
+    def test_init_creates_directory(self, mock_threading, mock_settings):
         storage = VideoStorage()
 
-        mock_os.path.exists.assert_called_once_with(mock_settings.video_folder)
-        mock_os.makedirs.assert_called_once_with(mock_settings.video_folder)
-
+        assert os.path.isdir(mock_settings.video_folder)
         assert storage.last_id == 0
         assert storage.server_connection is None
         assert storage.lock == mock_threading.Lock.return_value
 
 
-    def test_init_with_existing_directory(self, mock_os, mock_threading, mock_settings):
-        mock_os.path.exists.return_value = True
-        storage = VideoStorage()
-
-        mock_os.path.exists.assert_called_once_with(mock_settings.video_folder)
-        mock_os.makedirs.assert_not_called()
-
-
-    def test_init_with_server_connection(self, mock_os, mock_threading, mock_server_connection):
+    def test_init_with_server_connection(self, mock_threading, mock_settings, mock_server_connection):
         storage = VideoStorage(mock_server_connection)
         assert storage.server_connection == mock_server_connection
 
 
-    def test_go_to_next_video(self, mock_threading):
+    def test_go_to_next_video(self, mock_threading, mock_settings):
         storage = VideoStorage()
         initial_id = storage.last_id
 
-        storage.go_to_next_video()
+        name = record(storage, mock_settings)
 
         assert storage.last_id == initial_id + 1
+        clip = storage.journal.get(name)
+        assert clip.state == "ready"
+        assert clip.size == 5
         mock_threading.Thread.assert_called_once_with(
             target=storage.send_to_server, 
             daemon=True)
         mock_threading.Thread.return_value.start.assert_called_once()
 
 
-    def test_cleanup_waits_for_lock(self, mock_threading):
+    def test_go_to_next_video_without_file(self, mock_threading, mock_settings):
+        storage = VideoStorage()
+        name = storage.get_new_video_name()
+
+        storage.go_to_next_video()
+
+        assert storage.journal.get(name) is None
+
+
+    def test_visit_numbers_continue_after_restart(self, mock_threading, mock_settings):
+        storage = VideoStorage()
+        record(storage, mock_settings)
+        record(storage, mock_settings)
+        storage.cleanup()
+
+        storage = VideoStorage()
+
+        assert storage.last_id == 2
+        assert [clip.name for clip in storage.journal.clips("ready")] == \
+               [video_path(mock_settings, "0.mp4"), video_path(mock_settings, "1.mp4")]
+
+
+    def test_interrupted_recording_is_recovered(self, mock_threading, mock_settings):
+        storage = VideoStorage()
+        name = storage.get_new_video_name()
+        with open(name, "wb") as f:
+            f.write(b"partial")
+        storage.cleanup()
+
+        storage = VideoStorage()
+
+        assert storage.journal.get(name).state == "ready"
+        assert storage.last_id == 1
+
+
+    def test_existing_files_are_adopted(self, mock_threading, mock_settings):
+        os.makedirs(mock_settings.video_folder)
+        for name in ["4.mp4", ".prewarm-1-0.mp4", "7_000.mp4"]:
+            with open(video_path(mock_settings, name), "wb") as f:
+                f.write(b"video")
+
+        storage = VideoStorage()
+
+        assert [clip.name for clip in storage.journal.clips("ready")] == \
+               [video_path(mock_settings, "4.mp4"), video_path(mock_settings, "7_000.mp4")]
+        assert storage.last_id == 8
+
+
+    def test_cleanup_waits_for_lock(self, mock_threading, mock_settings):
         storage = VideoStorage()
         mock_threading.Lock.return_value.locked.side_effect = [True, False]
 
@@ -112,7 +184,7 @@ class TestVideoStorage:
         assert mock_threading.Lock.return_value.locked.call_count == 2
 
 
-    def test_send_to_server_no_connection(self, mock_server_connection, mock_threading):
+    def test_send_to_server_no_connection(self, mock_server_connection, mock_threading, mock_settings):
         mock_server_connection.connected = False
         storage = VideoStorage(mock_server_connection)
         
@@ -121,7 +193,7 @@ class TestVideoStorage:
         mock_threading.Lock.return_value.__enter__.assert_not_called()
 
 
-    def test_send_to_server_already_locked(self, mock_threading, mock_server_connection):
+    def test_send_to_server_already_locked(self, mock_threading, mock_settings, mock_server_connection):
         storage = VideoStorage(mock_server_connection)
 
         mock_threading.Lock.return_value.locked.return_value = True
@@ -131,81 +203,338 @@ class TestVideoStorage:
         mock_threading.Lock.return_value.__enter__.assert_not_called()
 
 
-    def test_send_to_server_no_files(self, mock_os, mock_server_connection, mock_log):
-        mock_os.listdir.return_value = []
+    def test_send_to_server_no_files(self, mock_settings, mock_server_connection, mock_log):
         storage = VideoStorage(mock_server_connection)
         storage.send_to_server()
 
-        mock_os.listdir.assert_called_once()
         mock_log.debug.assert_called_with("Sending files: ")
 
 
-    def test_send_to_server_skip_current_recording(self, mock_os, mock_server_connection, 
-                                                mock_settings, mock_requests):
-        mock_os.listdir.return_value = ["1.mp4", "2.mp4", "0.mp4"]
-        mock_settings.video_file_ext = "mp4"
+    def test_send_to_server_skip_current_recording(self, mock_threading, mock_settings,
+                                                   mock_server_connection, mock_session):
         storage = VideoStorage(mock_server_connection)
+        record(storage, mock_settings)
+        current = storage.get_new_video_name()
+        with open(current, "wb") as f:
+            f.write(b"recording")
 
-        with patch('builtins.open', mock_open(read_data='test data')) as mock_file:
-            storage.send_to_server()
+        storage.send_to_server()
 
-            assert mock_file.call_count == 2
-            mock_file.assert_has_calls([
-                call(os.path.join(mock_settings.video_folder, "1.mp4"), "rb"),
-                call(os.path.join(mock_settings.video_folder, "2.mp4"), "rb"),
-            ], any_order=True)
+        assert mock_session.post.call_count == 1
+        assert os.path.exists(current)
+        assert storage.journal.get(current).state == "recording"
 
 
-    def test_send_to_server_successful_upload(self, mock_os, mock_server_connection, 
-                                            mock_settings, mock_requests, mock_log,
-                                            mock_get_socket_address):
-        mock_os.listdir.return_value = ["1.mp4", "2.mp4"]
-        mock_settings.video_file_ext = "mp4"
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_requests.post.return_value = mock_response
+    def test_send_to_server_successful_upload(self, mock_threading, mock_settings, mock_server_connection,
+                                              mock_session, mock_log, mock_get_socket_address):
         storage = VideoStorage(mock_server_connection)
+        names = [record(storage, mock_settings), record(storage, mock_settings)]
 
-        with patch('builtins.open', mock_open(read_data='test data')) as mock_file:
-            storage.send_to_server()
-        
+        storage.send_to_server()
 
-            assert mock_file.call_count == 2
-            assert mock_requests.post.call_count == 2
-            assert mock_os.remove.call_count == 2
-            mock_os.remove.assert_has_calls([
-                call(os.path.join(mock_settings.video_folder, "1.mp4")),
-                call(os.path.join(mock_settings.video_folder, "2.mp4"))
-            ], any_order=True)
+        assert mock_session.post.call_count == 2
+        for name in names:
+            assert not os.path.exists(name)
+            assert storage.journal.get(name).state == "uploaded"
+        assert storage.journal.get(names[0]).attempts == 1
 
 
-    def test_send_to_server_upload_failure(self, mock_os, mock_server_connection, 
-                                          mock_settings, mock_requests, mock_log,
-                                          mock_get_socket_address):
-        mock_os.listdir.return_value = ["1.mp4"]
-        mock_settings.video_file_ext = "mp4"
+    def test_send_to_server_upload_failure(self, mock_threading, mock_settings, mock_server_connection,
+                                           mock_session, mock_log, mock_get_socket_address, mock_backoff_wait):
         mock_response = MagicMock()
         mock_response.status_code = 400
-        mock_requests.post.return_value = mock_response
-        
+        mock_session.post.return_value = mock_response
         storage = VideoStorage(mock_server_connection)
+        name = record(storage, mock_settings)
 
-        with patch('builtins.open', mock_open(read_data='test data')) as mock_file:
-            storage.send_to_server()
+        storage.send_to_server()
 
-        mock_os.remove.assert_not_called()
-        mock_log.error.assert_called_once()
+        # Retried until the retry budget ran out
+        assert os.path.exists(name)
+        assert mock_session.post.call_count == 3
+        assert mock_log.error.call_count == 3
+        assert mock_backoff_wait.call_count == 2
+        mock_log.warning.assert_called_once()
+        clip = storage.journal.get(name)
+        assert clip.state == "ready"
+        assert clip.attempts == 3
+        assert clip.last_error == "Status code: 400"
 
     
-    def test_send_to_server_general_exception(self, mock_os, mock_server_connection, 
-                                             mock_settings, mock_requests, mock_log):
-        mock_os.listdir.return_value = ["1.mp4"]
-        mock_settings.video_file_ext = "mp4"
-        mock_requests.post.side_effect = Exception()
+    def test_send_to_server_general_exception(self, mock_threading, mock_settings, mock_server_connection,
+                                              mock_session, mock_log, mock_backoff_wait):
+        mock_session.post.side_effect = Exception()
+        mock_backoff_wait.side_effect = lambda _: setattr(mock_server_connection, "connected", False)
         storage = VideoStorage(mock_server_connection)
+        name = record(storage, mock_settings)
 
-        with patch('builtins.open', mock_open(read_data='test data')) as mock_file:
-            storage.send_to_server()
+        storage.send_to_server()
 
-        mock_os.remove.assert_not_called()
+        # The connection was lost while waiting to retry
+        assert os.path.exists(name)
         mock_log.error.assert_called_once()
+        assert storage.journal.get(name).state == "ready"
+
+
+    def test_backoff_delays(self, mock_threading, mock_settings, mock_server_connection,
+                            mock_session, mock_backoff_wait):
+        mock_settings.upload_max_attempts = 8
+        mock_session.post.side_effect = Exception()
+        storage = VideoStorage(mock_server_connection)
+        record(storage, mock_settings)
+
+        with patch('uploader.random.uniform', side_effect=lambda low, high: high):
+            storage.send_to_server()
+
+        delays = [c.args[0] for c in mock_backoff_wait.call_args_list]
+        assert delays == [2, 4, 8, 16, 32, 64, 120]
+
+
+    def test_cleanup_stops_retries(self, mock_settings, mock_server_connection, mock_session):
+        mock_settings.upload_backoff_base = 1000
+        mock_session.post.side_effect = Exception()
+        storage = VideoStorage(mock_server_connection)
+        record(storage, mock_settings)
+        sender = threading.Thread(target=storage.send_to_server)
+        sender.start()
+        while mock_session.post.call_count == 0:
+            time.sleep(0.01)
+
+        storage.cleanup()
+
+        sender.join(timeout=5)
+        assert not sender.is_alive()
+        assert mock_session.post.call_count == 1
+
+
+    def test_parallel_uploads(self, mock_threading, mock_settings, mock_server_connection, mock_session):
+        mock_settings.upload_workers = 3
+        threads = set()
+        def post(*args, **kwargs):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.05)
+            return MagicMock(status_code=200)
+        mock_session.post.side_effect = post
+        storage = VideoStorage(mock_server_connection)
+        names = [record(storage, mock_settings) for _ in range(6)]
+
+        storage.send_to_server()
+
+        assert len(threads) == 3
+        assert all(storage.journal.get(name).state == "uploaded" for name in names)
+
+
+    def test_send_to_server_missing_file(self, mock_threading, mock_settings, mock_server_connection,
+                                         mock_session, mock_log):
+        storage = VideoStorage(mock_server_connection)
+        name = record(storage, mock_settings)
+        os.remove(name)
+
+        storage.send_to_server()
+
+        mock_session.post.assert_not_called()
+        assert storage.journal.get(name) is None
+
+
+    def test_segment_names(self, mock_settings):
+        storage = VideoStorage()
+        storage.last_id = 3
+
+        assert storage.get_segment_pattern() == video_path(mock_settings, "3_%03d.mp4")
+        assert storage.get_manifest_name() == video_path(mock_settings, "3.csv")
+
+
+    def test_finished_segments_from_manifest(self, mock_settings):
+        storage = VideoStorage()
+        with open(storage.get_manifest_name(), "w") as f:
+            f.write("0_000.mp4,0.0,10.0\n0_001.mp4,10.0,20.1\n")
+
+        assert storage._finished_segments() == ["0_000.mp4", "0_001.mp4"]
+
+
+    def test_upload_finished_segments(self, mock_threading, mock_settings, mock_server_connection, mock_session):
+        mock_settings.enable_segmented_recording = True
+        storage = VideoStorage(mock_server_connection)
+        for name in ["0_000.mp4", "0_001.mp4", "0_002.mp4"]:
+            with open(video_path(mock_settings, name), "wb") as f:
+                f.write(b"segment")
+        with open(storage.get_manifest_name(), "w") as f:
+            f.write("0_000.mp4,0.0,10.0\n0_001.mp4,10.0,20.0\n")
+
+        storage.upload_finished_segments()
+
+        # The segment still written by ffmpeg is not in the manifest yet
+        assert [clip.name for clip in storage.journal.clips("ready")] == \
+               [video_path(mock_settings, "0_000.mp4"), video_path(mock_settings, "0_001.mp4")]
+
+        with open(storage.get_manifest_name(), "a") as f:
+            f.write("0_002.mp4,20.0,25.0\n")
+        storage.go_to_next_video()
+
+        # The manifest is sent after the segments it lists
+        assert [clip.name for clip in storage.journal.clips("ready")] == \
+               [video_path(mock_settings, name) for name in ["0_000.mp4", "0_001.mp4", "0_002.mp4", "0.csv"]]
+
+
+    def test_upload_finished_segments_is_throttled(self, mock_threading, mock_settings):
+        storage = VideoStorage()
+
+        storage.upload_finished_segments()
+        storage.upload_finished_segments()
+
+        assert mock_threading.Thread.call_count == 1
+
+
+    def test_send_to_server_resumable(self, tmp_path, mock_threading, mock_settings, mock_server_connection):
+        server = UploadServer(str(tmp_path / "received"), drop_rate=0.3, seed=1).start()
+        mock_settings.enable_resumable_upload = True
+        mock_settings.upload_max_attempts = 50
+        try:
+            with patch('video_storage.get_socket_address', return_value=server.url[len("http://"):]):
+                storage = VideoStorage(mock_server_connection)
+                name = record(storage, mock_settings, data=b"0123456789" * 10)
+
+                storage.send_to_server()
+        finally:
+            server.stop()
+
+        with open(tmp_path / "received" / "test_feeder_id" / "0.mp4", "rb") as f:
+            assert f.read() == b"0123456789" * 10
+        assert not os.path.exists(name)
+        assert storage.journal.get(name).state == "uploaded"
+        assert server.stats["dropped"] > 0
+        assert storage.stats["upload"]["bytes_sent"] == 100
+
+
+    def test_send_to_server_resumable_not_supported(self, mock_threading, mock_settings,
+                                                    mock_server_connection, mock_session, mock_log):
+        mock_settings.enable_resumable_upload = True
+        mock_session.post.side_effect = [MagicMock(status_code=404), MagicMock(status_code=200)]
+        storage = VideoStorage(mock_server_connection)
+        name = record(storage, mock_settings)
+
+        storage.send_to_server()
+
+        assert storage.uploader is None
+        body = mock_session.post.call_args.kwargs["data"]
+        assert isinstance(body, ThrottledReader)
+        assert mock_session.post.call_args.kwargs["headers"]["Content-Type"].startswith("multipart/form-data")
+        assert storage.journal.get(name).state == "uploaded"
+
+
+    def test_visit_metadata(self, mock_threading, mock_settings):
+        storage = VideoStorage()
+        with patch('video_storage.time') as mock_time:
+            mock_time.time.side_effect = [100.0, 112.5]
+            storage.start_visit()
+            storage.add_confidence(0.6)
+            storage.add_confidence(None)
+            storage.add_confidence(0.9)
+            name = record(storage, mock_settings)
+
+        assert storage.journal.get_visit(0) == Visit(0, 100.0, 12.5, 0.9, 0.75)
+        # The next visit starts without metadata
+        record(storage, mock_settings)
+        assert storage.journal.get_visit(1) == Visit(1, None, None, None, None)
+        assert storage.journal.get(name).visit == 0
+
+
+    def test_visit_metadata_is_sent(self, mock_threading, mock_settings, mock_server_connection, mock_session):
+        mock_settings.enable_resumable_upload = True
+        storage = VideoStorage(mock_server_connection)
+        storage.start_visit()
+        storage.add_confidence(0.8)
+        record(storage, mock_settings)
+
+        with patch.object(storage.uploader, "upload") as mock_upload:
+            storage.send_to_server()
+
+        metadata = mock_upload.call_args.args[1]
+        assert metadata["max_confidence"] == 0.8
+        assert metadata["mean_confidence"] == 0.8
+        assert "started" in metadata and "duration" in metadata
+
+
+    @pytest.mark.parametrize("priority, expected", [
+        ("newest",     ["2.mp4", "1.mp4", "0.mp4"]),
+        ("oldest",     ["0.mp4", "1.mp4", "2.mp4"]),
+        ("confidence", ["1.mp4", "2.mp4", "0.mp4"]),
+        ("smallest",   ["2.mp4", "0.mp4", "1.mp4"]),
+    ])
+    def test_upload_priority(self, mock_threading, mock_settings, mock_server_connection, priority, expected):
+        mock_settings.upload_priority = priority
+        storage = VideoStorage(mock_server_connection)
+        for confidence, size in [(0.6, 20), (0.9, 30), (0.7, 10)]:
+            storage.start_visit()
+            storage.add_confidence(confidence)
+            record(storage, mock_settings, data=b"x" * size)
+            time.sleep(0.01)
+
+        sent = []
+        with patch.object(storage, "_upload", side_effect=lambda clip: sent.append(os.path.basename(clip.name))):
+            storage.send_to_server()
+
+        assert sent == expected
+
+
+    def test_new_visit_jumps_the_backlog(self, mock_threading, mock_settings, mock_server_connection, mock_session):
+        storage = VideoStorage(mock_server_connection)
+        backlog = [record(storage, mock_settings) for _ in range(3)]
+        sent = []
+        def post(*args, **kwargs):
+            sent.append(len(sent))
+            if len(sent) == 1:
+                # A visit ends while the first file of the backlog is uploaded
+                record(storage, mock_settings)
+            return MagicMock(status_code=200)
+        mock_session.post.side_effect = post
+
+        with patch.object(storage.journal, "set_state", wraps=storage.journal.set_state) as set_state:
+            storage.send_to_server()
+
+        uploaded = [c.args[0] for c in set_state.call_args_list if c.args[1] == "uploaded"]
+        assert uploaded == [backlog[2], video_path(mock_settings, "3.mp4"), backlog[1], backlog[0]]
+
+
+    def test_manifest_waits_for_segments(self, mock_threading, mock_settings, mock_server_connection, mock_session):
+        storage = VideoStorage(mock_server_connection)
+        for name in ["0_000.mp4", "0.csv"]:
+            with open(video_path(mock_settings, name), "wb") as f:
+                f.write(b"data")
+            storage.journal.add(video_path(mock_settings, name), 0, "ready", 4)
+        mock_session.post.side_effect = [MagicMock(status_code=500)] * 3
+
+        storage.send_to_server()
+
+        # The segment failed, so the manifest is not sent before it
+        assert mock_session.post.call_count == 3
+        assert storage.journal.get(video_path(mock_settings, "0.csv")).state == "ready"
+
+
+    def test_segmented_visit_is_reserved(self, mock_threading, mock_settings):
+        storage = VideoStorage()
+        storage.start_visit()
+        storage.get_segment_pattern()
+
+        # Restart before any segment was journaled
+        storage = VideoStorage()
+
+        assert storage.last_id == 1
+
+
+    def test_interrupted_segmented_visit_is_recovered(self, mock_threading, mock_settings):
+        storage = VideoStorage()
+        storage.start_visit()
+        storage.get_segment_pattern()
+        for name in ["0_000.mp4", "0_001.mp4", "0_002.mp4"]:
+            with open(video_path(mock_settings, name), "wb") as f:
+                f.write(b"segment")
+        with open(storage.get_manifest_name(), "w") as f:
+            f.write("0_000.mp4,0.0,10.0\n0_001.mp4,10.0,20.0\n")
+        storage.journal.close()
+
+        storage = VideoStorage()
+
+        assert [clip.name for clip in storage.journal.clips("ready")] == \
+               [video_path(mock_settings, name) for name in ["0_000.mp4", "0_001.mp4", "0.csv"]]
+        assert storage.last_id == 1
@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional
+from settings.config import *
+
+
+class Clip(NamedTuple):
+    """One journaled file: a whole visit video, a segment of it or a segment manifest."""
+    name: str
+    visit: int
+    state: str
+    size: Optional[int]
+    attempts: int
+    created: float
+    updated: float
+    last_error: Optional[str]
+    upload_url: Optional[str]
+
+
+class Visit(NamedTuple):
+    """Metadata of a visit shared by all its files, None if unknown."""
+    visit: int
+    started: Optional[float]
+    duration: Optional[float]
+    max_confidence: Optional[float]
+    mean_confidence: Optional[float]
+
+
+class UploadJournal:
+    """
+    Persistent journal of recorded files and their upload state.\n
+    Every file goes through the states recording -> ready -> uploading -> uploaded,
+    the order of upload is the order files were added. Visit numbers are taken from
+    the journal, so they keep growing across restarts and new recordings never overwrite
+    files that were not uploaded yet.
+    Visits keep the metadata of their files (start time, duration and squirrel confidence),
+    which decides the upload order with the priority policies in ORDERS.
+    Stored in SQLite, startup recovery only queries the journal and never reads video files.
+    Safe to use from several threads.
+    """
+    STATES = ("recording", "ready", "uploading", "uploaded")
+    # Policies compare visits, files of one visit stay together in the order they were added
+    ORDERS = {
+        "oldest":     "c.id",
+        "newest":     "COALESCE(v.started, (SELECT MIN(created) FROM clips WHERE visit = c.visit)) DESC, "
+                      "c.visit DESC, c.id",
+        "confidence": "COALESCE(v.max_confidence, -1) DESC, COALESCE(v.mean_confidence, -1) DESC, c.visit, c.id",
+        "smallest":   "(SELECT SUM(COALESCE(size, 0)) FROM clips WHERE visit = c.visit), c.visit, c.id",
+    }
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS clips (
+                                id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                                name       TEXT UNIQUE NOT NULL,
+                                visit      INTEGER NOT NULL,
+                                state      TEXT NOT NULL,
+                                size       INTEGER,
+                                attempts   INTEGER NOT NULL DEFAULT 0,
+                                created    REAL NOT NULL,
+                                updated    REAL NOT NULL,
+                                last_error TEXT,
+                                upload_url TEXT)""")
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(clips)")]
+        if "upload_url" not in columns: # journal of an older version
+            self._db.execute("ALTER TABLE clips ADD COLUMN upload_url TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS clips_state ON clips (state, id)")
+        # Visits are never removed, so visit numbers are never reused
+        self._db.execute("""CREATE TABLE IF NOT EXISTS visits (
+                                visit           INTEGER PRIMARY KEY,
+                                started         REAL,
+                                duration        REAL,
+                                max_confidence  REAL,
+                                mean_confidence REAL)""")
+
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+    def _execute(self, query: str, parameters: tuple=()) -> list:
+        """Run the statement and return all its rows, the connection is shared by threads."""
+        with self._lock:
+            return self._db.execute(query, parameters).fetchall()
+
+
+    def next_visit(self) -> int:
+        """Number of the next visit, one more than any visit ever journaled."""
+        (visit,) = self._execute("SELECT COALESCE(MAX(visit) + 1, 0) FROM "
+                                 "(SELECT visit FROM clips UNION ALL SELECT visit FROM visits)")[0]
+        return visit
+
+
+    def set_visit(self, visit: Visit) -> None:
+        self._execute("INSERT OR REPLACE INTO visits (visit, started, duration, max_confidence, mean_confidence) "
+                      "VALUES (?, ?, ?, ?, ?)", tuple(visit))
+
+
+    def get_visit(self, visit: int) -> Optional[Visit]:
+        rows = self._execute(f"SELECT {', '.join(Visit._fields)} FROM visits WHERE visit = ?", (visit,))
+        return Visit(*rows[0]) if rows else None
+
+
+    def add(self, name: str, visit: int, state: str="recording", size: Optional[int]=None) -> None:
+        """Add the file to the journal, does nothing if it is already there."""
+        if state not in self.STATES:
+            raise ValueError(f"Unknown clip state: {state}")
+        now = time.time()
+        self._execute("INSERT OR IGNORE INTO clips (name, visit, state, size, created, updated) "
+                      "VALUES (?, ?, ?, ?, ?, ?)", (name, visit, state, size, now, now))
+
+
+    def set_state(self, name: str, state: str, size: Optional[int]=None, error: Optional[str]=None) -> None:
+        """Move the file to the state, uploading also counts an upload attempt."""
+        if state not in self.STATES:
+            raise ValueError(f"Unknown clip state: {state}")
+        self._execute("UPDATE clips SET state = ?, size = COALESCE(?, size), last_error = ?, "
+                      "attempts = attempts + ?, updated = ? WHERE name = ?",
+                      (state, size, error, int(state == "uploading"), time.time(), name))
+
+
+    def set_upload_url(self, name: str, url: Optional[str]) -> None:
+        """Remember the resumable upload of the file, so it is continued after a restart."""
+        self._execute("UPDATE clips SET upload_url = ?, updated = ? WHERE name = ?", (url, time.time(), name))
+
+
+    def remove(self, name: str) -> None:
+        self._execute("DELETE FROM clips WHERE name = ?", (name,))
+
+
+    def get(self, name: str) -> Optional[Clip]:
+        rows = self._execute(f"SELECT {', '.join(Clip._fields)} FROM clips WHERE name = ?", (name,))
+        return Clip(*rows[0]) if rows else None
+
+
+    def clips(self, state: str, visit: Optional[int]=None, order: str="oldest") -> List[Clip]:
+        """
+        Files in the state, only of the visit if it is given.\n
+        Args:
+            state: One of STATES
+            visit: Visit number or None for all visits
+            order: Priority policy from ORDERS, files of a visit always keep the order they were added
+        """
+        if order not in self.ORDERS:
+            raise ValueError(f"Unknown upload order: {order}")
+        query = (f"SELECT {', '.join('c.' + field for field in Clip._fields)} FROM clips c "
+                 "LEFT JOIN visits v ON v.visit = c.visit WHERE c.state = ?")
+        parameters = (state,)
+        if visit is not None:
+            query += " AND c.visit = ?"
+            parameters += (visit,)
+        return [Clip(*row) for row in self._execute(f"{query} ORDER BY {self.ORDERS[order]}", parameters)]
+
+
+    def pending(self, visit: int) -> List[Clip]:
+        """Files of the visit that are not uploaded yet."""
+        rows = self._execute(f"SELECT {', '.join(Clip._fields)} FROM clips WHERE visit = ? "
+                             "AND state != 'uploaded' ORDER BY id", (visit,))
+        return [Clip(*row) for row in rows]
+
+
+    def recover(self, keep_uploaded_seconds: float) -> None:
+        """
+        Repair the journal after a restart.\n
+        Recordings and uploads interrupted by the restart become ready to upload again,
+        or are dropped if the file doesn't exist. Old uploaded entries are removed.
+        """
+        for clip in self.clips("recording") + self.clips("uploading"):
+            if os.path.exists(clip.name):
+                self.set_state(clip.name, "ready", size=os.path.getsize(clip.name))
+            else:
+                log.warning(f"Journaled file {clip.name} doesn't exist, removed from the journal")
+                self.remove(clip.name)
+        self._execute("DELETE FROM clips WHERE state = 'uploaded' AND updated < ?",
+                      (time.time() - keep_uploaded_seconds,))
+
+
+    @property
+    def stats(self) -> dict:
+        """Number of files and bytes in every state."""
+        rows = self._execute("SELECT state, COUNT(*), COALESCE(SUM(size), 0) FROM clips GROUP BY state")
+        return {state: {"files": files, "bytes": size} for state, files, size in rows}
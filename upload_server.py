@@ -0,0 +1,330 @@
+"""
+Stand-in upload server for testing the feeder offline.\n
+Implements the server side of the resumable upload protocol used by uploader.ResumableUploader
+and the single request POST /upload of the original server, and can inject faults of a flaky mobile link: failed requests, connections dropped in the middle
+of a chunk and corrupted chunks. Completed files are saved to the storage folder.
+Uses only the standard library, so it runs on any machine:
+
+    python upload_server.py --port 5000 --storage received --drop-rate 0.2
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+TUS_VERSION = "1.0.0"
+
+
+class _Upload:
+    def __init__(self, length: int, metadata: dict, path: str) -> None:
+        self.length = length
+        self.metadata = metadata
+        self.path = path
+        self.offset = 0
+        self.lock = threading.Lock()
+
+
+class UploadServer:
+    """
+    Resumable upload server running in a background thread.\n
+    Fault rates are probabilities per PATCH request.
+    Args:
+        storage: Folder for partial and completed uploads
+        host, port: Address to listen on, port 0 picks a free port
+        fail_rate: Answer 500 without storing the chunk
+        drop_rate: Read a part of the chunk and close the connection without an answer
+        corrupt_rate: Flip a byte of the chunk, which fails its checksum
+        seed: Seed of the fault generator for reproducible runs
+    """
+    def __init__(self, storage: str, host: str="127.0.0.1", port: int=0, fail_rate: float=0,
+                 drop_rate: float=0, corrupt_rate: float=0, seed=None) -> None:
+        self.storage = storage
+        os.makedirs(os.path.join(storage, ".partial"), exist_ok=True)
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self._random = random.Random(seed)
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self.stats = {"connections": 0, "created": 0, "completed": 0, "chunks": 0, "bytes": 0,
+                      "failed": 0, "dropped": 0, "corrupted": 0, "conflicts": 0}
+
+        server = self
+        class Handler(_Handler):
+            upload_server = server
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def start(self) -> "UploadServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, args=(0.05,),
+                                        daemon=True, name="upload-server")
+        self._thread.start()
+        return self
+
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+
+    def fault(self, rate: float) -> bool:
+        with self._lock:
+            return self._random.random() < rate
+
+
+    def count(self, key: str, value: int=1) -> None:
+        with self._lock:
+            self.stats[key] += value
+
+
+    def create(self, length: int, metadata: dict) -> str:
+        upload_id = uuid.uuid4().hex
+        upload = _Upload(length, metadata, os.path.join(self.storage, ".partial", upload_id))
+        open(upload.path, "wb").close()
+        with self._lock:
+            self._uploads[upload_id] = upload
+        self.count("created")
+        if length == 0:
+            self.complete(upload)
+        return upload_id
+
+
+    def get(self, upload_id: str):
+        with self._lock:
+            return self._uploads.get(upload_id)
+
+
+    def complete(self, upload: _Upload) -> None:
+        """Move the finished file to the storage folder under its name and the feeder id."""
+        name = os.path.basename(upload.metadata.get("filename", os.path.basename(upload.path)))
+        folder = os.path.join(self.storage, os.path.basename(upload.metadata.get("id", "unknown")))
+        os.makedirs(folder, exist_ok=True)
+        os.replace(upload.path, os.path.join(folder, name))
+        self.count("completed")
+
+
+def decode_metadata(header: str) -> dict:
+    metadata = {}
+    for pair in filter(None, (pair.strip() for pair in header.split(","))):
+        key, _, value = pair.partition(" ")
+        metadata[key] = base64.b64decode(value).decode()
+    return metadata
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    upload_server: UploadServer = None
+
+    def setup(self) -> None:
+        super().setup()
+        self.upload_server.count("connections")
+
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+    def _answer(self, status: int, headers: dict=None, body: bytes=b"") -> None:
+        self.send_response(status)
+        self.send_header("Tus-Resumable", TUS_VERSION)
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _upload(self):
+        """Upload of the request path /uploads/<id>, answers 404 if there is none."""
+        prefix, _, upload_id = self.path.rpartition("/")
+        upload = self.upload_server.get(upload_id) if prefix == "/uploads" else None
+        if upload is None:
+            self.close_connection = True # a PATCH body is not read
+            self._answer(404)
+        return upload
+
+
+    def do_GET(self) -> None:
+        if self.path == "/stats":
+            self._answer(200, {"Content-Type": "application/json"},
+                         json.dumps(self.upload_server.stats).encode())
+        else:
+            self._answer(404)
+
+
+    def do_POST(self) -> None:
+        if self.path == "/upload":
+            self._receive_form()
+            return
+        if self.path != "/uploads":
+            self._answer(404)
+            return
+        try:
+            length = int(self.headers["Upload-Length"])
+            metadata = decode_metadata(self.headers.get("Upload-Metadata", ""))
+        except (TypeError, ValueError):
+            self._answer(400)
+            return
+        upload_id = self.upload_server.create(length, metadata)
+        self._answer(201, {"Location": f"/uploads/{upload_id}"})
+
+
+    def _receive_form(self) -> None:
+        """
+        Single request upload of the original server: form with the id field and the video file.\n
+        The body is streamed to disk, so the server can receive files larger than its memory.
+        Only forms with the file as the last field are supported, as sent by the feeder.
+        """
+        server = self.upload_server
+        _, _, boundary = self.headers.get("Content-Type", "").partition("boundary=")
+        length = int(self.headers.get("Content-Length", 0))
+        if not boundary:
+            self.close_connection = True
+            self._answer(400)
+            return
+
+        path = os.path.join(server.storage, ".partial", uuid.uuid4().hex)
+        with open(path, "w+b") as f:
+            remaining = length
+            while remaining:
+                block = self.rfile.read(min(remaining, 65536))
+                if not block:
+                    break
+                f.write(block)
+                remaining -= len(block)
+
+            f.seek(0)
+            head = f.read(65536)
+            delimiter = b"--" + boundary.encode()
+            fields, filename, start = {}, None, None
+            position = head.find(delimiter)
+            while position >= 0 and filename is None:
+                headers_end = head.find(b"\r\n\r\n", position)
+                if headers_end < 0:
+                    break
+                headers = head[position:headers_end].decode(errors="replace")
+                name = headers.partition('name="')[2].partition('"')[0]
+                start = headers_end + 4
+                if 'filename="' in headers:
+                    filename = headers.partition('filename="')[2].partition('"')[0]
+                else:
+                    position = head.find(delimiter, start)
+                    fields[name] = head[start:position - 2].decode()
+            end = length - len(b"\r\n" + delimiter + b"--\r\n")
+
+            if remaining or filename is None or end < start:
+                os.remove(path)
+                self._answer(400)
+                return
+            upload = _Upload(end - start, {"filename": filename, "id": fields.get("id", "unknown")},
+                             path + ".video")
+            with open(upload.path, "wb") as video:
+                f.seek(start)
+                left = end - start
+                while left:
+                    block = f.read(min(left, 65536))
+                    video.write(block)
+                    left -= len(block)
+        os.remove(path)
+        server.complete(upload)
+        server.count("bytes", upload.length)
+        self._answer(200)
+
+
+    def do_HEAD(self) -> None:
+        upload = self._upload()
+        if upload is not None:
+            self._answer(200, {"Upload-Offset": upload.offset, "Upload-Length": upload.length,
+                               "Cache-Control": "no-store"})
+
+
+    def do_PATCH(self) -> None:
+        server = self.upload_server
+        upload = self._upload()
+        if upload is None:
+            return
+        length = int(self.headers.get("Content-Length", 0))
+
+        if server.fault(server.drop_rate):
+            # The link went down in the middle of the chunk
+            self.rfile.read(length // 2)
+            server.count("dropped")
+            self.close_connection = True
+            return
+        chunk = self.rfile.read(length)
+        if server.fault(server.fail_rate):
+            server.count("failed")
+            self._answer(500)
+            return
+        if chunk and server.fault(server.corrupt_rate):
+            chunk = bytes([chunk[0] ^ 0xFF]) + chunk[1:]
+            server.count("corrupted")
+
+        with upload.lock:
+            if int(self.headers.get("Upload-Offset", -1)) != upload.offset:
+                server.count("conflicts")
+                self._answer(409, {"Upload-Offset": upload.offset})
+                return
+            algorithm, _, checksum = self.headers.get("Upload-Checksum", "").partition(" ")
+            if algorithm:
+                if algorithm != "sha256":
+                    self._answer(400)
+                    return
+                if base64.b64encode(hashlib.sha256(chunk).digest()).decode() != checksum:
+                    self._answer(460)
+                    return
+            if upload.offset + len(chunk) > upload.length:
+                self._answer(413)
+                return
+            with open(upload.path, "ab") as f:
+                f.write(chunk)
+            upload.offset += len(chunk)
+            server.count("chunks")
+            server.count("bytes", len(chunk))
+            if upload.offset == upload.length:
+                server.complete(upload)
+            self._answer(204, {"Upload-Offset": upload.offset})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stand-in resumable upload server with fault injection")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--storage", default="received_videos", help="folder for received files")
+    parser.add_argument("--fail-rate", type=float, default=0, help="probability of answering 500 to a chunk")
+    parser.add_argument("--drop-rate", type=float, default=0, help="probability of dropping the connection in a chunk")
+    parser.add_argument("--corrupt-rate", type=float, default=0, help="probability of corrupting a chunk")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = UploadServer(args.storage, args.host, args.port, args.fail_rate,
+                          args.drop_rate, args.corrupt_rate, args.seed)
+    print(f"Upload server listening on {server.url}, statistics at {server.url}/stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
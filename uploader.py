@@ -0,0 +1,389 @@
+import base64
+import hashlib
+import io
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+import requests
+from settings.config import *
+
+
+TUS_VERSION = "1.0.0"
+
+
+class UploadError(Exception):
+    """The server rejected the upload, the status code is None for protocol errors."""
+    def __init__(self, message: str, status_code: Optional[int]=None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadNotSupported(UploadError):
+    """The server has no resumable upload endpoint."""
+
+
+def encode_metadata(metadata: dict) -> str:
+    """Upload-Metadata header value: comma separated "key base64(value)" pairs."""
+    return ",".join(f"{key} {base64.b64encode(str(value).encode()).decode()}"
+                    for key, value in metadata.items())
+
+
+def chunk_checksum(chunk: bytes) -> str:
+    """Upload-Checksum header value of the chunk."""
+    return "sha256 " + base64.b64encode(hashlib.sha256(chunk).digest()).decode()
+
+
+def create_session(pool_size: int=1) -> requests.Session:
+    """Session keeping connections to the server alive, with a connection for every parallel upload."""
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    return session
+
+
+class Backoff:
+    """Exponential backoff with full jitter: a random delay up to base * 2^attempt, capped by maximum."""
+    def __init__(self, base: float, maximum: float) -> None:
+        self.base = base
+        self.maximum = maximum
+
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after the failed attempt, counted from 0."""
+        return random.uniform(0, min(self.maximum, self.base * 2 ** attempt))
+
+
+class TokenBucket:
+    """
+    Limits the rate of sent bytes, shared by all uploads.\n
+    Reading more than is available puts the bucket in debt and the reader sleeps it off,
+    so several threads together never exceed the rate.
+    """
+    def __init__(self, rate: float, burst: Optional[float]=None) -> None:
+        """
+        Args:
+            rate: Bytes per second, 0 for no limit
+            burst: Bytes that can be sent at once after a pause, a second of the rate by default
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.throttled = 0.0 # seconds spent waiting
+
+
+    def consume(self, amount: int) -> None:
+        """Take the bytes from the bucket, waiting until they are available."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - amount
+            self._updated = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            self.throttled += wait
+        if wait:
+            time.sleep(wait)
+
+
+class ThrottledReader(io.RawIOBase):
+    """Request body that takes every block it reads from the token bucket."""
+    def __init__(self, body, length: int, bucket: TokenBucket) -> None:
+        self._body = body
+        self.len = length
+        self._bucket = bucket
+        self._position = 0
+
+
+    def __len__(self) -> int:
+        return self.len
+
+
+    def readable(self) -> bool:
+        return True
+
+
+    def tell(self) -> int:
+        return self._position
+
+
+    def read(self, size: int=-1) -> bytes:
+        data = self._body.read(size)
+        self._bucket.consume(len(data))
+        self._position += len(data)
+        return data
+
+
+class MultipartFile(io.RawIOBase):
+    """
+    multipart/form-data body with form fields and one file, read from disk while it is sent.
+
+    Passed to requests as data, it is sent with a Content-Length in blocks of http.client,
+    so memory use doesn't depend on the file size, unlike files= which builds the whole body.
+    The body is the same as the one requests builds for data=fields, files={name: file}.
+    """
+    def __init__(self, fields: dict, name: str, path: str, boundary: Optional[str]=None) -> None:
+        """
+        Args:
+            fields: Form fields sent before the file
+            name: Form field of the file
+            path: Path of the file, its name is sent as the file name
+            boundary: Multipart boundary, random by default
+        """
+        self.boundary = boundary or uuid.uuid4().hex
+        head = b"".join(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode()
+                        for key, value in fields.items())
+        head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                 f'filename="{os.path.basename(path)}"\r\n\r\n').encode()
+        tail = f"\r\n--{self.boundary}--\r\n".encode()
+
+        self._file = open(path, "rb")
+        self.len = len(head) + os.fstat(self._file.fileno()).st_size + len(tail)
+        self._parts = [io.BytesIO(head), self._file, io.BytesIO(tail)]
+        self._position = 0
+
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+
+    def __len__(self) -> int:
+        return self.len
+
+
+    def readable(self) -> bool:
+        return True
+
+
+    def tell(self) -> int:
+        # requests sends len - tell() as Content-Length
+        return self._position
+
+
+    def read(self, size: int=-1) -> bytes:
+        data = b""
+        while self._parts and (size < 0 or len(data) < size):
+            block = self._parts[0].read(-1 if size < 0 else size - len(data))
+            if not block:
+                self._parts.pop(0)
+            data += block
+        self._position += len(data)
+        return data
+
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+class ResumableUploader:
+    """
+    Client of the resumable upload protocol (a subset of tus 1.0 with the checksum extension).\n
+    POST /uploads creates an upload and returns its URL in Location,
+    HEAD on the URL returns the offset the server has, PATCH appends a chunk at the offset
+    with the sha256 checksum of the chunk. A dropped connection only loses the current chunk,
+    the next attempt asks the server for the offset and continues from it, also after a restart
+    if the upload URL was saved.
+    """
+    def __init__(self, base_url: str, chunk_size: int, timeout: float,
+                 session: Optional[requests.Session]=None, bucket: Optional[TokenBucket]=None) -> None:
+        """
+        Args:
+            base_url: Server address, e.g. http://host:port
+            chunk_size: Bytes sent in one PATCH request
+            timeout: Timeout of every request in seconds
+            session: Session for the requests, may be shared by several uploaders
+            bucket: Bandwidth limit of sent chunks
+        """
+        self.base_url = base_url.rstrip("/")
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.session = session or create_session()
+        self.bucket = bucket or TokenBucket(0)
+        self._lock = threading.Lock() # files are uploaded from several threads
+        self._stats = {"files": 0, "chunks": 0, "bytes_sent": 0, "bytes_resumed": 0,
+                       "checksum_mismatches": 0, "offset_conflicts": 0}
+
+
+    def _count(self, key: str, value: int=1) -> None:
+        with self._lock:
+            self._stats[key] += value
+
+
+    def _headers(self, **headers) -> dict:
+        return {"Tus-Resumable": TUS_VERSION, **headers}
+
+
+    def create(self, size: int, metadata: dict) -> str:
+        """Create an upload of the size in bytes, returns its URL."""
+        r = self.session.post(f"{self.base_url}/uploads", timeout=self.timeout,
+                              headers=self._headers(**{"Upload-Length": str(size),
+                                                       "Upload-Metadata": encode_metadata(metadata)}))
+        if r.status_code in (404, 405):
+            raise UploadNotSupported("Server doesn't support resumable uploads", r.status_code)
+        if r.status_code != 201 or "Location" not in r.headers:
+            raise UploadError(f"Can't create upload, status code: {r.status_code}", r.status_code)
+        return requests.compat.urljoin(self.base_url + "/", r.headers["Location"])
+
+
+    def offset(self, url: str) -> Optional[int]:
+        """Bytes of the upload the server has, None if the server doesn't know the upload."""
+        r = self.session.head(url, timeout=self.timeout, headers=self._headers())
+        if r.status_code in (404, 410):
+            return None
+        if r.status_code != 200:
+            raise UploadError(f"Can't get upload offset, status code: {r.status_code}", r.status_code)
+        return int(r.headers["Upload-Offset"])
+
+
+    def upload(self, path: str, metadata: dict, url: Optional[str]=None,
+               on_created: Optional[Callable[[str], None]]=None) -> str:
+        """
+        Upload the file, continuing the upload at the url if it is given.\n
+        Network errors are raised as is, the upload can be continued with the same url.
+        Returns the upload URL
+        Args:
+            path: Path of the file
+            metadata: Sent to the server with a new upload, e.g. the file name
+            url: URL of an earlier upload of the file
+            on_created: Called with the URL of a new upload before any data is sent
+        """
+        size = os.path.getsize(path)
+        offset = self.offset(url) if url is not None else None
+        if offset is None:
+            url = self.create(size, metadata)
+            offset = 0
+            if on_created is not None:
+                on_created(url)
+        elif offset:
+            log.info(f"Resuming upload of {os.path.basename(path)} from {offset} of {size} bytes")
+            self._count("bytes_resumed", offset)
+
+        with open(path, "rb") as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(self.chunk_size)
+                offset = self._send_chunk(url, offset, chunk)
+
+        self._count("files")
+        return url
+
+
+    def _send_chunk(self, url: str, offset: int, chunk: bytes) -> int:
+        """Append the chunk at the offset, returns the new offset of the upload."""
+        r = self.session.patch(url, data=ThrottledReader(io.BytesIO(chunk), len(chunk), self.bucket),
+                               timeout=self.timeout,
+                               headers=self._headers(**{"Upload-Offset": str(offset),
+                                                        "Upload-Checksum": chunk_checksum(chunk),
+                                                        "Content-Type": "application/offset+octet-stream"}))
+        if r.status_code == 204:
+            new_offset = int(r.headers["Upload-Offset"])
+            if new_offset <= offset:
+                raise UploadError(f"Server didn't accept the chunk at offset {offset}")
+            self._count("chunks")
+            self._count("bytes_sent", new_offset - offset)
+            return new_offset
+        if r.status_code == 409:
+            # The server has a different offset, e.g. the answer to the previous chunk was lost
+            self._count("offset_conflicts")
+            server_offset = self.offset(url)
+            if server_offset is None or server_offset == offset:
+                raise UploadError(f"Upload offset conflict at {offset}", r.status_code)
+            return server_offset
+        if r.status_code == 460:
+            self._count("checksum_mismatches")
+            raise UploadError(f"Chunk at offset {offset} was corrupted in transfer", r.status_code)
+        raise UploadError(f"Chunk upload failed, status code: {r.status_code}", r.status_code)
+
+
+    @property
+    def stats(self) -> dict:
+        """Uploaded files, chunks, bytes sent, bytes that didn't have to be sent again and throttled seconds."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["throttled_seconds"] = round(self.bucket.throttled, 1)
+        return stats
+
+
+class PeakRss:
+    """Peak resident memory of the process above the start level, sampled in a thread (Linux)."""
+    def __init__(self, interval: float=0.002) -> None:
+        self.interval = interval
+        self.peak = 0
+
+
+    @staticmethod
+    def rss() -> int:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+    def __enter__(self) -> "PeakRss":
+        self._start = self._max = self.rss()
+        self._running = True
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+
+    def _sample(self) -> None:
+        while self._running:
+            self._max = max(self._max, self.rss())
+            time.sleep(self.interval)
+
+
+    def __exit__(self, *args) -> None:
+        self._running = False
+        self._thread.join()
+        self._max = max(self._max, self.rss())
+        self.peak = self._max - self._start
+
+
+def benchmark_upload_memory(sizes_mb: tuple=(16, 64, 256)) -> None:
+    """
+    Upload files of the sizes to a local stand-in server and log the peak memory of every upload:
+    requests files= (the whole body in memory), the streaming MultipartFile and resumable chunks.
+    """
+    import tempfile
+    from upload_server import UploadServer
+
+    with tempfile.TemporaryDirectory(dir=settings.video_folder if os.path.isdir(settings.video_folder) else None) as folder:
+        server = UploadServer(os.path.join(folder, "received")).start()
+        uploader = ResumableUploader(server.url, settings.upload_chunk_size, settings.connection_timeout)
+        try:
+            for size_mb in sizes_mb:
+                path = os.path.join(folder, f"{size_mb}.mp4")
+                with open(path, "wb") as f:
+                    block = os.urandom(1024 * 1024)
+                    for _ in range(size_mb):
+                        f.write(block)
+
+                def buffered() -> None:
+                    with open(path, "rb") as f:
+                        r = requests.post(f"{server.url}/upload", files={"video": f}, data={"id": "benchmark"},
+                                          timeout=settings.connection_timeout)
+                    r.raise_for_status()
+
+                def streaming() -> None:
+                    with MultipartFile({"id": "benchmark"}, "video", path) as body:
+                        r = requests.post(f"{server.url}/upload", data=body, headers={"Content-Type": body.content_type},
+                                          timeout=settings.connection_timeout)
+                    r.raise_for_status()
+
+                def resumable() -> None:
+                    uploader.upload(path, {"filename": os.path.basename(path), "id": "benchmark"})
+
+                results = []
+                for name, upload in (("files=", buffered), ("streaming", streaming), ("resumable", resumable)):
+                    with PeakRss() as peak:
+                        upload()
+                    results.append(f"{name} {peak.peak / 1024 / 1024:.1f} MB")
+                log.info(f"Peak memory of a {size_mb} MB upload: " + ", ".join(results))
+                os.remove(path)
+        finally:
+            server.stop()
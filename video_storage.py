@@ -1,7 +1,12 @@
+import csv
 import os
+import re
 import threading
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from server_connection import ServerConnection
+from upload_journal import Clip, UploadJournal, Visit
+from uploader import (Backoff, MultipartFile, ResumableUploader, ThrottledReader, TokenBucket,
+                      UploadError, UploadNotSupported, create_session)
 from typing import Optional
 import time
 from settings.config import *
@@ -11,6 +16,19 @@ class VideoStorage:
     """
     Manages the video files captured.\n
     Handles local storage and uploading of video files to the server.
+    Files and their upload state are kept in the UploadJournal, so the video folder
+    is never scanned and visit numbers keep growing across restarts.
+    In segmented mode a visit is recorded as short segments named {id}_{number}
+    with a manifest {id}.csv listing the finished ones, so they are uploaded
+    while the visit continues.
+    Files are sent in chunks with ResumableUploader, an interrupted upload continues
+    from the offset the server has. Servers without resumable uploads get whole files.
+    Uploads share a keep-alive session and a bandwidth limit, so they don't starve the live stream.
+    A failed upload is retried with jittered exponential backoff a limited number of times,
+    files that still fail are retried in the next upload round.
+    Visit metadata (start time, duration, squirrel confidence) is journaled with the files and sent
+    with them. Files are uploaded in the order of the upload_priority policy, the next file is
+    picked after every upload, so a new visit doesn't wait for a backlog of old ones.
     """
 
     def __init__(self, server_connection: Optional[ServerConnection]=None) -> None:
@@ -18,30 +36,177 @@ class VideoStorage:
         if not os.path.exists(settings.video_folder):
             os.makedirs(settings.video_folder)
 
-        self.last_id = 0
+        self.journal = UploadJournal(settings.upload_journal_path)
+        self.journal.recover(settings.journal_keep_uploaded_days * 24 * 3600)
+        if self.journal.next_visit() == 0:
+            self._adopt_existing_files()
+        self._recover_unfinished_visit()
+
+        self.last_id = self.journal.next_visit()
         self.lock = threading.Lock() # Prevents concurrent access to video files during upload
         self.server_connection = server_connection
+        self._last_upload_start = 0
+        self._stopping = threading.Event()
+        self._claim_lock = threading.Lock()
+        self._start_visit_metadata()
+
+        self.session = create_session(settings.upload_workers)
+        self.bucket = TokenBucket(settings.upload_bandwidth_limit)
+        self.backoff = Backoff(settings.upload_backoff_base, settings.upload_backoff_max)
+        self.uploader = None
+        if settings.enable_resumable_upload:
+            self.uploader = ResumableUploader(f"http://{get_socket_address()}", settings.upload_chunk_size,
+                                              settings.connection_timeout, self.session, self.bucket)
+
+
+    def _adopt_existing_files(self) -> None:
+        """
+        Journal files recorded before the journal existed, done once on an empty journal.\n
+        Their visit numbers are taken from the names, so new visits get larger numbers.
+        """
+        for filename in sorted(os.listdir(settings.video_folder)):
+            path = os.path.join(settings.video_folder, filename)
+            if filename.startswith(".") or not os.path.isfile(path):
+                continue
+            number = re.match(r"\d+", filename)
+            self.journal.add(path, int(number.group()) if number else 0, "ready", os.path.getsize(path))
+            log.info(f"Existing file {filename} added to the upload journal")
+
+
+    def _recover_unfinished_visit(self) -> None:
+        """
+        Journal segments of a segmented visit interrupted by a restart.\n
+        Finished segments are journaled only when an upload is started during the visit,
+        the others listed in the manifest would never be uploaded.
+        Only the last visit can be unfinished, it was recorded when the feeder stopped.
+        """
+        visit = self.journal.next_visit() - 1
+        manifest = self.get_manifest_name(visit)
+        if visit < 0 or self.journal.get(manifest) is not None or not os.path.exists(manifest):
+            return
+        self._journal_finished_segments(visit)
+        self.journal.add(manifest, visit, "ready", os.path.getsize(manifest))
+        log.info(f"Segments of interrupted visit {visit} added to the upload journal")
 
 
     def cleanup(self) -> None:
-        """Wait for any ongoing upload operations to complete."""
+        """Stop retrying uploads and wait for any ongoing upload operations to complete."""
+        self._stopping.set()
         while self.lock.locked(): pass
+        self.session.close()
+        self.journal.close()
 
     
+    def _start_visit_metadata(self) -> None:
+        self._visit_started = None
+        self._max_confidence = None
+        self._confidence_sum = 0.0
+        self._confidence_count = 0
+
+
+    def start_visit(self) -> None:
+        """Remember the start time of the visit recorded next."""
+        self._visit_started = time.time()
+
+
+    def add_confidence(self, confidence: Optional[float]) -> None:
+        """Add the squirrel confidence of a frame of the current visit, None if the detector has no scores."""
+        if confidence is None:
+            return
+        self._max_confidence = max(confidence, self._max_confidence or 0.0)
+        self._confidence_sum += confidence
+        self._confidence_count += 1
+
+
+    def _save_visit(self) -> None:
+        """Journal the metadata of the current visit collected so far."""
+        started = self._visit_started
+        self.journal.set_visit(Visit(
+            visit=self.last_id,
+            started=started,
+            duration=round(time.time() - started, 2) if started is not None else None,
+            max_confidence=self._max_confidence,
+            mean_confidence=(self._confidence_sum / self._confidence_count if self._confidence_count else None)))
+
+
     def get_new_video_name(self) -> str:
+        """Name of the video of the current visit, it is journaled as recording."""
         path = os.path.join(settings.video_folder, f"{self.last_id}.{settings.video_file_ext}")
+        self.journal.add(path, self.last_id)
         return path
 
 
+    def get_segment_pattern(self) -> str:
+        """
+        Output pattern of the segments of the current visit for the ffmpeg segment muxer.\n
+        The visit is journaled, so its number isn't given out again if the feeder restarts
+        before any segment is journaled.
+        """
+        self._save_visit()
+        return os.path.join(settings.video_folder, f"{self.last_id}_%03d.{settings.video_file_ext}")
+
+
+    def get_manifest_name(self, visit: Optional[int]=None) -> str:
+        """Manifest of the visit, the current one by default, ffmpeg adds every finished segment to it."""
+        return os.path.join(settings.video_folder, f"{self.last_id if visit is None else visit}.csv")
+
+
     def go_to_next_video(self) -> None:
-        """Increment the video counter and trigger an upload operation."""
+        """Mark files of the finished visit ready, increment the video counter and trigger an upload operation."""
+        self._save_visit()
+        if settings.enable_segmented_recording:
+            self._journal_finished_segments()
+            # The manifest is added last, so it is sent after the segments it lists
+            manifest = self.get_manifest_name()
+            if os.path.exists(manifest):
+                self.journal.add(manifest, self.last_id, "ready", os.path.getsize(manifest))
+
+        for clip in self.journal.clips("recording", visit=self.last_id):
+            if os.path.exists(clip.name):
+                self.journal.set_state(clip.name, "ready", size=os.path.getsize(clip.name))
+            else:
+                log.warning(f"Recorded file {clip.name} doesn't exist")
+                self.journal.remove(clip.name)
+
         self.last_id += 1
+        self._start_visit_metadata()
+        self.start_upload()
+
+
+    def start_upload(self) -> None:
+        """Upload stored videos in the background."""
+        self._last_upload_start = time.monotonic()
         threading.Thread(target=self.send_to_server, daemon=True).start()
 
 
+    def upload_finished_segments(self) -> None:
+        """Start uploading segments of the current visit, at most once per segment duration."""
+        if time.monotonic() - self._last_upload_start >= settings.segment_duration:
+            self._save_visit()
+            self._journal_finished_segments()
+            self.start_upload()
+
+
+    def _finished_segments(self, visit: Optional[int]=None) -> list:
+        """Segments of the visit listed in its manifest, ffmpeg lists only closed files."""
+        try:
+            with open(self.get_manifest_name(visit), newline="") as f:
+                return [row[0] for row in csv.reader(f) if row]
+        except OSError:
+            return []
+
+
+    def _journal_finished_segments(self, visit: Optional[int]=None) -> None:
+        visit = self.last_id if visit is None else visit
+        for filename in self._finished_segments(visit):
+            path = os.path.join(settings.video_folder, filename)
+            if self.journal.get(path) is None and os.path.exists(path):
+                self.journal.add(path, visit, "ready", os.path.getsize(path))
+
+
     def send_to_server(self) -> None:
         """
-        Upload all stored videos to the server except the current one being recorded.\n
+        Upload all files ready in the journal in the order they were recorded.\n
         Deletes videos after successful upload to save space
         """
         # Skip if no server connection or already uploading
@@ -52,38 +217,123 @@ class VideoStorage:
             return
 
         with self.lock:
-            files = os.listdir(settings.video_folder)
-            log.debug("Sending files: "+" ".join(files))
-
-            for filename in files:
-                # Skip the video currently being recorded
-                if filename != f"{self.last_id}.{settings.video_file_ext}":
-                    log.debug(f"Sending file {filename}")
-                    video_sent = False
-                    while not video_sent:
-                        try:
-                            with open(os.path.join(settings.video_folder, filename), "rb") as f:
-                                feeder_id = self.server_connection.feeder_id
-                                files={"video": f}
-                                r = requests.post(f"http://{get_socket_address()}/upload",
-                                                    files=files,
-                                                    timeout=settings.connection_timeout,
-                                                    data={"id": feeder_id})
-                                if r.status_code == 200:
-                                    video_sent = True
-                                    log.info(f"Video {filename} sent")
-                                else:
-                                    log.error(f"Video upload failed. Status code: {r.status_code}")
-                        except OSError: # for some reason Timeout can't be catched
-                            log.error("Request error", exc_info=True)
-                        except:
-                            log.error("Can\'t send video to server", exc_info=True)
-
-                        # Delete the video file if successfully uploaded
-                        if video_sent:
-                            os.remove(os.path.join(settings.video_folder, filename))
-                        else:
-                            if not self.server_connection.connected:
-                                log.info("No connection to server, sending stopped")
-                                return
-                            time.sleep(30)
+            clips = self.journal.clips("ready", order=settings.upload_priority)
+            log.debug("Sending files: "+" ".join(os.path.basename(clip.name) for clip in clips))
+
+            taken = set()
+            if settings.upload_workers > 1:
+                with ThreadPoolExecutor(max_workers=settings.upload_workers, thread_name_prefix="upload") as pool:
+                    for _ in range(settings.upload_workers):
+                        pool.submit(self._upload_worker, taken)
+            else:
+                self._upload_worker(taken)
+
+
+    def _upload_worker(self, taken: set) -> None:
+        """Upload files one by one until there are none left in this upload round."""
+        while not self._stopping.is_set() and self.server_connection.connected:
+            clip = self._next_clip(taken)
+            if clip is None:
+                return
+            self._send_clip(clip)
+
+
+    def _next_clip(self, taken: set) -> Optional[Clip]:
+        """
+        Ready file with the highest priority that wasn't taken in this upload round.\n
+        Files that became ready during the round are included, e.g. a visit that just ended.
+        A manifest waits until all segments of its visit are uploaded.
+        """
+        with self._claim_lock:
+            for clip in self.journal.clips("ready", order=settings.upload_priority):
+                if clip.name in taken:
+                    continue
+                if clip.name.endswith(".csv") and any(pending.name != clip.name
+                                                      for pending in self.journal.pending(clip.visit)):
+                    continue
+                taken.add(clip.name)
+                return clip
+        return None
+
+
+    def _send_clip(self, clip: Clip) -> bool:
+        """
+        Upload the file, retrying up to upload_max_attempts times.\n
+        Deletes the video after successful upload to save space.
+        Returns True if the file was sent
+        """
+        filename = os.path.basename(clip.name)
+        for attempt in range(settings.upload_max_attempts):
+            if self._stopping.is_set():
+                return False
+            if not self.server_connection.connected:
+                log.info(f"No connection to server, sending of {filename} stopped")
+                return False
+
+            log.debug(f"Sending file {filename}")
+            self.journal.set_state(clip.name, "uploading")
+            try:
+                self._upload(self.journal.get(clip.name))
+                log.info(f"Video {filename} sent")
+                os.remove(clip.name)
+                self.journal.set_state(clip.name, "uploaded")
+                return True
+            except FileNotFoundError:
+                log.error(f"Video {filename} doesn't exist, removed from the journal")
+                self.journal.remove(clip.name)
+                return False
+            except UploadError as e:
+                error = str(e)
+                log.error(f"Video upload failed. {error}")
+            except OSError as e: # for some reason Timeout can't be catched
+                error = repr(e)
+                log.error("Request error", exc_info=True)
+            except Exception as e:
+                error = repr(e)
+                log.error("Can\'t send video to server", exc_info=True)
+
+            self.journal.set_state(clip.name, "ready", error=error)
+            if attempt + 1 < settings.upload_max_attempts:
+                self._stopping.wait(self.backoff.delay(attempt))
+
+        log.warning(f"Video {filename} not sent after {settings.upload_max_attempts} attempts, "
+                    "it will be sent in the next upload round")
+        return False
+
+
+    def _upload(self, clip) -> None:
+        """Send the journaled file, raises UploadError if the server rejected it."""
+        metadata = {"filename": os.path.basename(clip.name), "id": self.server_connection.feeder_id}
+        visit = self.journal.get_visit(clip.visit)
+        if visit is not None:
+            metadata.update((key, value) for key, value in visit._asdict().items()
+                            if key != "visit" and value is not None)
+        if self.uploader is not None:
+            try:
+                self.uploader.upload(clip.name, metadata, clip.upload_url,
+                                     on_created=lambda url: self.journal.set_upload_url(clip.name, url))
+                return
+            except UploadNotSupported:
+                log.warning("Server doesn't support resumable uploads, sending whole files")
+                self.uploader = None
+
+        # Streamed from disk, files= would build the whole body in memory
+        fields = {key: value for key, value in metadata.items() if key != "filename"}
+        with MultipartFile(fields, "video", clip.name) as body:
+            r = self.session.post(f"http://{get_socket_address()}/upload",
+                                  data=ThrottledReader(body, len(body), self.bucket),
+                                  headers={"Content-Type": body.content_type},
+                                  timeout=settings.connection_timeout)
+        if r.status_code != 200:
+            raise UploadError(f"Status code: {r.status_code}", r.status_code)
+
+
+    @property
+    def stats(self) -> dict:
+        """Files and bytes in every journal state, upload counters and time throttled by the bandwidth limit."""
+        stats = {"journal": self.journal.stats}
+        if self.uploader is not None:
+            stats["upload"] = self.uploader.stats
+        else:
+            stats["upload"] = {"throttled_seconds": round(self.bucket.throttled, 1)}
+        return stats